@@ -1,29 +1,56 @@
-from flask import Flask
+from flask import Flask, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
-from app.auth.routes import auth_bp
-from app.admin.routes import admin_bp
-from app.images.routes import image_bp
-from app.notifications.routes import notifications_bp
-from app.user.routes import user_bp
-from app.payment.routes import payment_bp
-from app.technician.routes import tech_bp
+from app import db
+from app.utils.startup import timed_import, print_startup_report
+from app.utils.model_registry import warm_up_from_env
+from app.utils.blog_jobs import start_weekly_schedule
+from app.utils.sentiment_queue import sentiment_queue
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+# (module, blueprint attribute); heavy ML imports inside these are deferred to first use
+BLUEPRINTS = [
+    ("app.auth.routes", "auth_bp"),
+    ("app.admin.routes", "admin_bp"),
+    ("app.images.routes", "image_bp"),
+    ("app.notifications.routes", "notifications_bp"),
+    ("app.payment.routes", "payment_bp"),
+    ("app.technician.routes", "tech_bp"),
+    ("app.user.routes", "user_bp"),
+]
+
 def create_app():
 
     app=Flask(__name__)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
     app.config['PRODUCT_IMAGE_FOLDER'] = os.path.join(app.root_path, 'app/static/products')
+    # Larger request bodies are rejected with 413 before they are read
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', 10)) * 1024 * 1024
     CORS(app,supports_credentials=True)
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(admin_bp)
-    app.register_blueprint(image_bp)
-    app.register_blueprint(notifications_bp)
-    app.register_blueprint(payment_bp)
-    app.register_blueprint(tech_bp)
-    app.register_blueprint(user_bp)
-    return app
 
+    @app.before_request
+    def reject_oversized_body():
+        # Refuse on the declared length, before a route's broad except can swallow the 413
+        limit = app.config['MAX_CONTENT_LENGTH']
+        if request.content_length is not None and request.content_length > limit:
+            raise RequestEntityTooLarge()
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def upload_too_large(e):
+        return jsonify({
+            "success": False,
+            "message": f"Upload too large (limit {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB)"
+        }), 413
+
+    db.init_app(app)
+    for module_name, attr in BLUEPRINTS:
+        app.register_blueprint(getattr(timed_import(module_name), attr))
+    if os.getenv("STARTUP_REPORT"):
+        print_startup_report()
+    warm_up_from_env()
+    start_weekly_schedule()
+    sentiment_queue.start()
+    return app
@@ -1,12 +1,26 @@
-from flask import request, jsonify, Blueprint,g
+from flask import request, jsonify, Blueprint,g, current_app, Response, stream_with_context
 from app.db import create_connection
 from ..utils.verify_token import token_required
-from ..utils.grok_model import CreateMessage
+from ..utils.grok_model import CreateMessage, LLMUnavailable
+from ..utils.similiarity_checker import on_service_changed
+from ..utils.store_recommender import on_order_status_changed
+from ..utils.tech_dashboard import on_technician_schedule_changed
+from ..utils.dispatch import optimize_day
+from ..utils.intervals import LEAVE_SQL, normalize_interval, validate_leaves
+from ..utils.notification_hub import notification_hub
+from ..utils.tech_availability import technician_availability
 import os
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from werkzeug.exceptions import HTTPException
+from datetime import date, datetime
 import re
-from app.models.agent.blog_agent import run_weekly_blog_pipeline
+from app.utils.metrics import collect_stats
+from app.utils.jobs import job_runner
+from app.utils.blog_jobs import BLOG_JOB, enqueue_weekly_blog
+from app.utils.report_sql import (
+    ReportQueryError, validate_sql, bounded_sql, check_budget, RowStream, report_sql_cache,
+    close_stream,
+)
 
 admin_bp=Blueprint("admin",__name__,url_prefix="/admin")
 
@@ -333,6 +347,8 @@ def update_product(id):
 
         return jsonify({"message": "Product updated successfully"})
 
+    except HTTPException:
+        raise  # 413 from the upload size limit
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"message": "Failed to update product"}), 500
@@ -389,6 +405,8 @@ def add_product():
 
         return jsonify({"message": "Product added successfully"})
 
+    except HTTPException:
+        raise  # 413 from the upload size limit
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"message": "Failed to add product"}), 500
@@ -500,9 +518,12 @@ def add_service():
             duration_minutes
         ))
         connection.commit()
+        on_service_changed(cursor.lastrowid)
 
         return jsonify({"message": "Service added successfully"}), 201
 
+    except HTTPException:
+        raise  # 413 from the upload size limit
     except Exception as e:
         connection.rollback()
         print(f"Error adding service: {str(e)}")
@@ -602,6 +623,7 @@ def update_service(service_id):
 
         if cursor.rowcount == 0:
             return jsonify({"message": "Service not found"}), 404
+        on_service_changed(service_id)
 
         return jsonify({"message": "Service updated successfully"}), 200
 
@@ -629,6 +651,7 @@ def delete_service(id):
         cursor.execute("DELETE FROM services WHERE service_id = %s", (id,))
         if cursor.rowcount > 0:
             connection.commit()
+            on_service_changed(id, deleted=True)
             return jsonify({'message': "Service deleted successfully"}), 200
             
         else:
@@ -705,6 +728,7 @@ def update_order_status(cart_id):
         cursor = connection.cursor()
         cursor.execute("UPDATE cart SET status = %s WHERE cart_id = %s", (status, cart_id))
         connection.commit()
+        on_order_status_changed([cart_id])
         return jsonify({'message': 'Order status updated'}), 200
     except Exception as e:
         print(e)
@@ -781,6 +805,47 @@ ORDER BY tu.created_at DESC;
     cursor.close()
     conn.close()
     return jsonify(leaves)
+def _set_leave_status(leave_ids, new_status):
+    """
+    Update many leave rows in one statement. Returns {leave_id: technician_id} of the leaves
+    found; job rows are never touched, since a rejected row no longer blocks the technician.
+    """
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ", ".join(["%s"] * len(leave_ids))
+        cursor.execute(
+            f"SELECT id, technician_id FROM technician_unavailable WHERE id IN ({placeholders}) AND {LEAVE_SQL}",
+            leave_ids,
+        )
+        found = dict(cursor.fetchall())
+        if not found:
+            return found
+
+        placeholders = ", ".join(["%s"] * len(found))
+        cursor.execute(f"""
+            UPDATE technician_unavailable SET status = %s WHERE id IN ({placeholders}) AND {LEAVE_SQL}
+        """, (new_status, *found))
+
+        # Insert notifications
+        cursor.executemany("""
+            INSERT INTO notifications (user_id, user_type, message, created_at)
+            VALUES (%s, 'technician', %s, NOW())
+        """, [(technician_id, f"Your leave request has been {new_status} by admin.") for technician_id in found.values()])
+
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    if new_status == "rejected":
+        for leave_id, technician_id in found.items():
+            technician_availability.remove_unavailability(leave_id, technician_id)
+    on_technician_schedule_changed(found.values())
+    notification_hub.nudge()
+    return found
+
+
 @admin_bp.route("/technician-leaves/<int:leave_id>", methods=["PATCH"])
 @token_required(role="admin")
 def update_leave_status(leave_id):
@@ -790,39 +855,95 @@ def update_leave_status(leave_id):
     if new_status not in ["approved", "rejected"]:
         return jsonify({"error": "Invalid status"}), 400
 
-    conn = create_connection()
-    cursor = conn.cursor()
-
-    # Check if the leave exists
-    cursor.execute("SELECT technician_id FROM technician_unavailable WHERE id = %s", (leave_id,))
-    result = cursor.fetchone()
-    if not result:
-        cursor.close()
-        conn.close()
+    found = _set_leave_status([leave_id], new_status)
+    if not found:
         return jsonify({"error": "Leave not found"}), 404
 
-    technician_id = result[0]
+    return jsonify({"message": f"Leave {new_status}"}), 200
+@admin_bp.route("/technician-leaves", methods=["PATCH"])
+@token_required(role="admin")
+def update_leave_statuses():
+    data = request.get_json(silent=True) or {}
+    new_status = data.get("status")
+    leave_ids = data.get("ids") or []
 
-    # Update status
-    cursor.execute("""
-        UPDATE technician_unavailable SET status = %s WHERE id = %s
-    """, (new_status, leave_id))
-    conn.commit()
+    if new_status not in ["approved", "rejected"]:
+        return jsonify({"error": "Invalid status"}), 400
+    if not isinstance(leave_ids, list) or not all(isinstance(i, int) for i in leave_ids) or not leave_ids:
+        return jsonify({"error": "ids must be a non-empty list of leave ids"}), 400
+
+    found = _set_leave_status(leave_ids, new_status)
+    return jsonify({
+        "message": f"{len(found)} leave(s) {new_status}",
+        "updated": sorted(found),
+        "not_found": sorted(set(leave_ids) - set(found)),
+    }), 200
+@admin_bp.route("/technician-leaves/import", methods=["POST"])
+@token_required(role="admin")
+def import_technician_leaves():
+    """
+    Validate a roster of leaves against each other and the stored rows in one pass. Nothing
+    is written if any row is invalid or overlaps; with "dry_run" only the report is returned.
+    """
+    data = request.get_json(silent=True) or {}
+    leaves = data.get("leaves")
+    status = data.get("status", "pending")
+    if not isinstance(leaves, list) or not leaves:
+        return jsonify({"error": "leaves must be a non-empty list"}), 400
+    if status not in ["pending", "approved"]:
+        return jsonify({"error": "Invalid status"}), 400
+    if not all(isinstance(leave, dict) for leave in leaves):
+        return jsonify({"error": "Each leave must be an object"}), 400
 
-    # Insert notification
-    cursor.execute("""
-        INSERT INTO notifications (user_id, user_type, message, created_at)
-        VALUES (%s, 'technician', %s, NOW())
-    """, (
-        technician_id,
-        f"Your leave request has been {new_status} by admin."
-    ))
+    technician_ids = set()
+    for leave in leaves:
+        try:
+            technician_ids.add(int(leave.get("technician_id")))
+        except (TypeError, ValueError):
+            pass  # reported per row by validate_leaves
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    conn = create_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # Lock the technicians first, as reserve_technicians() does, so no booking can assign
+        # them between the overlap check and the insert. Being the transaction's first read,
+        # it also makes the check's snapshot start after every earlier booking committed.
+        known = set()
+        if technician_ids:
+            placeholders = ", ".join(["%s"] * len(technician_ids))
+            cursor.execute(f"""
+                SELECT technician_id FROM technicians
+                WHERE technician_id IN ({placeholders})
+                ORDER BY technician_id
+                FOR UPDATE
+            """, sorted(technician_ids))
+            known = {row["technician_id"] for row in cursor.fetchall()}
+
+        results = validate_leaves(cursor, leaves)
+        for leave, result in zip(leaves, results):
+            if result["ok"] and int(leave["technician_id"]) not in known:
+                result.update(ok=False, error="Unknown technician")
+        valid = all(r["ok"] for r in results)
+        if not valid or data.get("dry_run"):
+            conn.rollback()
+            return jsonify({"valid": valid, "imported": 0, "results": results}), 200 if valid else 409
+
+        rows = []
+        for leave in leaves:
+            start, end = normalize_interval(leave["start_datetime"], leave["end_datetime"])
+            rows.append((int(leave["technician_id"]), start, end, leave.get("reason"), status))
+        cursor.executemany("""
+            INSERT INTO technician_unavailable (technician_id, start_datetime, end_datetime, reason, status)
+            VALUES (%s, %s, %s, %s, %s)
+        """, rows)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
 
-    return jsonify({"message": f"Leave {new_status}"}), 200
+    technician_availability.invalidate()
+    on_technician_schedule_changed({row[0] for row in rows})
+    return jsonify({"valid": True, "imported": len(rows), "results": results}), 201
 @admin_bp.route('/blogs', methods=['GET'])
 @token_required(role='admin')
 def get_all_blogs():
@@ -1066,71 +1187,120 @@ def generate_report():
             technician_unavailable(id, technician_id, start_datetime, end_datetime, reason, created_at) -- technician unavailability details (could be job or leave)  
             users(id, username, password, role, created_at, name, phone, email, status) -- user details    """
 
-    # Step 1: Get raw SQL from LLM
-    content = CreateMessage(question,prompt)
-    raw_sql=content.content
-    print(raw_sql)
-    # Step 2: Extract SELECT query from any text
-    match = re.search(r"(?i)select\s.+", raw_sql.strip(), re.DOTALL)
-    if not match:
-        return jsonify({'error': 'Only SELECT queries are allowed.'}), 500
-
-    sql = match.group(0).strip()
-    sql_lower = sql.lower()
-
-    # Step 3: Block unsafe keywords and patterns
-    unsafe_keywords = ["⚠️", "drop", "delete", "update", "insert", "--", "/*", "alter"]
-    if any(bad in sql_lower for bad in unsafe_keywords):
-        return jsonify({"message":"dangerous queries detected"})
-
-    semicolon_count = sql.count(";")
-    if semicolon_count > 1 or (semicolon_count == 1 and not sql.strip().endswith(";")):
-        pass
-
-    # Strip trailing semicolon safely
-    sql = sql.rstrip(";").strip()
-
-    # Step 4: Verify allowed tables only
-    allowed_tables = {
-        "bookings", "booking_technicians", "cart", "notifications", "payments",
-        "services", "store", "technicians", "technician_unavailable", "users"
-    }
-    used_tables = set(re.findall(r'from\s+(\w+)|join\s+(\w+)', sql_lower))
-    used_tables = {tbl for pair in used_tables for tbl in pair if tbl}
-
-    if not used_tables.intersection(allowed_tables):
-        return jsonify({'error': 'SQL must be a SELECT query targeting allowed tables.'}), 500
-
-    # Step 5: Execute query
-    try:
-        conn = create_connection()
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        results = [dict(zip(columns, row)) for row in rows]
-        print(results)
-
-        return jsonify({
-            'sql': sql,
-            'results': results,
-            'message': 'Query executed successfully.'
-        })
+    # Step 1: Reuse SQL already validated for this question, otherwise ask the LLM
+    sql = report_sql_cache.get(question)
+    cached_sql = sql is not None
+    if sql is None:
+        try:
+            content = CreateMessage(question,prompt)
+        except LLMUnavailable as e:
+            print(f"Error calling LLM: {e}")
+            return jsonify({"error": "AI service unavailable"}), 503
+        raw_sql=content.content
+        print(raw_sql)
+        # Steps 2-4: extract the SELECT, block unsafe patterns, check tables
+        try:
+            sql = validate_sql(raw_sql)
+        except ReportQueryError as e:
+            return jsonify(e.payload), e.status
 
+    # Step 5: Execute within the plan/time/row budget and stream rows out as they are read
+    bounded = bounded_sql(sql)
+    conn = create_connection()
+    if conn is None:
+        return jsonify({'error': 'Database error: connection failed'}), 500
+    cursor = conn.cursor(buffered=False)
+    try:
+        estimated_rows = check_budget(cursor, bounded)
+        rows = RowStream(cursor, bounded)
+    except ReportQueryError as e:
+        close_stream(cursor, conn)
+        return jsonify(e.payload), e.status
     except Exception as e:
         print("Database Error:", str(e))
+        close_stream(cursor, conn)
+        report_sql_cache.discard(question)
         return jsonify({'error': f'Database error: {str(e)}'}), 500
 
-    finally:
-        if conn:
-            conn.close() 
+    if not cached_sql:
+        report_sql_cache.put(question, sql)
+    dumps = current_app.json.dumps
+
+    def generate():
+        try:
+            yield '{"sql": ' + dumps(sql) + ', "results": ['
+            error = None
+            try:
+                for i, row in enumerate(rows):
+                    yield ("," if i else "") + dumps(row)
+            except Exception as e:
+                # e.g. MAX_EXECUTION_TIME hit while rows were being read
+                print("Database Error:", str(e))
+                error = f'Database error: {str(e)}'
+            summary = {
+                'row_count': rows.count,
+                'truncated': rows.truncated,
+                'estimated_rows': estimated_rows,
+                'cached_sql': cached_sql,
+            }
+            if error:
+                summary['error'] = error
+            else:
+                summary['message'] = 'Query executed successfully.'
+            yield '], ' + dumps(summary)[1:]
+        finally:
+            close_stream(cursor, conn)
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
 @admin_bp.route('/run-weekly-blog', methods=['POST'])
+@token_required(role='admin')
 def run_weekly_blog():
     try:
-        run_weekly_blog_pipeline()
-        return jsonify({'status': 'success', 'message': 'Blog generated and saved successfully'}), 200
+        job_id = enqueue_weekly_blog()
+        return jsonify({'status': 'queued', 'job_id': job_id, 'message': 'Blog generation started'}), 202
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@admin_bp.route('/blog-jobs', methods=['GET'])
+@token_required(role='admin')
+def list_blog_jobs():
+    return jsonify({'jobs': job_runner.recent(name=BLOG_JOB, limit=request.args.get('limit', 20, type=int))}), 200
+
+
+@admin_bp.route('/blog-jobs/<job_id>', methods=['GET'])
+@token_required(role='admin')
+def get_blog_job(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify({'job': job}), 200
+
+
+@admin_bp.route('/dispatch/optimize', methods=['POST'])
+@token_required(role='admin')
+def optimize_dispatch():
+    data = request.get_json(silent=True) or {}
+    try:
+        day = date.fromisoformat(data['date']) if data.get('date') else None
+    except ValueError:
+        return jsonify({"success": False, "message": "date must be YYYY-MM-DD"}), 400
+    try:
+        plan = optimize_day(day, apply=bool(data.get('apply')))
+    except Exception as e:
+        current_app.logger.error(f"Dispatch optimisation failed: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+    if plan.get('applied'):
+        moved = {m['to_technician'] for m in plan['moves']} | {m['from_technician'] for m in plan['moves']}
+        on_technician_schedule_changed(moved)
+        technician_availability.invalidate()
+    return jsonify({"success": True, "plan": plan}), 200
+@admin_bp.route('/metrics', methods=['GET'])
+@token_required(role='admin')
+def get_runtime_metrics():
+    return jsonify({"success": True, "metrics": collect_stats()}), 200
 @token_required(role='admin')
 @admin_bp.route('/stats', methods=['GET'])
 def get_admin_stats():
@@ -1,7 +1,13 @@
 from dotenv import load_dotenv
 import os
+import threading
+import time
 import mysql.connector
-from mysql.connector import Error
+from flask import g, has_app_context
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import SQLAlchemyError
+from app.utils.metrics import register_stats
 
 load_dotenv()
 
@@ -11,16 +17,115 @@ db_user=os.getenv("DB_USER")
 db_password=os.getenv("DB_PASSWORD")
 db_name=os.getenv("DB_NAME")
 
+pool_size=int(os.getenv("DB_POOL_SIZE", 10))
+pool_max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", 5))
+pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 10))
+pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+# One engine (and one pool) per process, shared by the cursor-style routes
+# through create_connection() and by the pandas readers through `engine`.
+engine = create_engine(
+    URL.create(
+        "mysql+mysqlconnector",
+        username=db_user,
+        password=db_password,
+        host=db_host,
+        port=int(db_port) if db_port else None,
+        database=db_name,
+    ),
+    pool_size=pool_size,
+    max_overflow=pool_max_overflow,
+    pool_timeout=pool_timeout,
+    pool_recycle=pool_recycle,
+    pool_pre_ping=True,
+)
+
+
+class PooledConnection:
+    """
+    Thin proxy around a pooled DBAPI (mysql.connector) connection.
+    close() hands the connection back to the engine's pool and is safe to call twice.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._raw.close()
+
+
+class _PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+
+_stats = _PoolStats()
+
+
 def create_connection():
     connection=None
+    started = time.perf_counter()
     try:
-        connection=mysql.connector.connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
-    except Error as e:
-        pass
-    return connection
\ No newline at end of file
+        connection=PooledConnection(engine.raw_connection())
+        _stats.record(time.perf_counter() - started)
+        if has_app_context():
+            g.setdefault("_db_connections", []).append(connection)
+    except (SQLAlchemyError, mysql.connector.Error) as e:
+        # The driver's connect errors reach us unwrapped; callers expect None either way
+        _stats.record_failure()
+        print(f"Database connection failed: {e}")
+    return connection
+
+
+def pool_status():
+    pool = engine.pool
+    checkouts = _stats.checkouts
+    return {
+        "size": pool.size(),
+        "max_overflow": pool_max_overflow,
+        "idle": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checkouts": checkouts,
+        "failures": _stats.failures,
+        "wait_avg_ms": round(_stats.wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+        "wait_max_ms": round(_stats.wait_max * 1000, 3),
+    }
+
+
+register_stats("db_pool", pool_status)
+
+
+def release_connections(exc=None):
+    # Return anything a route forgot to close once the request is torn down
+    for connection in g.pop("_db_connections", []):
+        connection.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_connections)
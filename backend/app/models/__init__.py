@@ -1,4 +1,14 @@
-from transformers import pipeline
+from app.utils.model_registry import register_model, get_model
 
 
-sentiment_pipeline = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")
+def _load_sentiment_pipeline():
+    from transformers import pipeline
+    return pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")
+
+
+register_model("sentiment", _load_sentiment_pipeline)
+
+
+def sentiment_pipeline(*args, **kwargs):
+    # Same call signature as the transformers pipeline; the model is built on first call
+    return get_model("sentiment")(*args, **kwargs)
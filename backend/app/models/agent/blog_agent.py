@@ -1,23 +1,86 @@
 # weekly_blog_agent.py
 from typing import TypedDict
 import os
+import re
+import time
 import requests
-import mysql.connector
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
+from app.db import create_connection
 
 # Load secrets from .env
 load_dotenv()
 
+# BLOG_AGENT_OFFLINE=1 replaces the Tavily and Groq calls with canned responses, so the
+# pipeline (and the job runner around it) can be exercised without network access or keys.
+BLOG_AGENT_OFFLINE = os.getenv("BLOG_AGENT_OFFLINE", "").lower() in ("1", "true", "yes")
+BLOG_CONNECT_TIMEOUT = float(os.getenv("BLOG_CONNECT_TIMEOUT", 5))
+BLOG_SEARCH_TIMEOUT = float(os.getenv("BLOG_SEARCH_TIMEOUT", 30))
+BLOG_GENERATE_TIMEOUT = float(os.getenv("BLOG_GENERATE_TIMEOUT", 120))
+GROQ_BASE_URL = (os.getenv("GROQ_BASE_URL") or "https://api.groq.com").rstrip("/")
+BLOG_MODEL = os.getenv("BLOG_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
+
+OFFLINE_RESULTS = [
+    {
+        "title": "Monsoon brings early surge in mosquito breeding across Kerala",
+        "url": "https://example.com/offline/monsoon-mosquitoes",
+        "content": "Health officials urge households to clear stagnant water as dengue cases rise.",
+    },
+    {
+        "title": "Termite damage claims climb in Bengaluru apartments",
+        "url": "https://example.com/offline/termites-bengaluru",
+        "content": "Builders turn to pre-construction soil treatment and bait systems.",
+    },
+    {
+        "title": "Farmers adopt integrated pest management for rice crops",
+        "url": "https://example.com/offline/ipm-rice",
+        "content": "Pheromone traps and biological controls cut pesticide use by a third.",
+    },
+]
 
 
 # Define the data structure for LangGraph state
 class BlogState(TypedDict, total=False):
     search_data: str
     blog_content: str
+    title: str
+    blog_id: int
+
+
+def summarize_results(results):
+    summaries = []
+    for r in results:
+        title = r.get("title", "")
+        url = r.get("url", "")
+        content = r.get("raw_content") or r.get("content") or ""
+        summaries.append(f"{title}\n{url}\n{content}")
+    return "\n\n".join(summaries)
+
+
+def offline_blog_html(search_data):
+    """Deterministic stand-in for the generated post, built from the search summaries."""
+    headlines = [block.split("\n", 1)[0] for block in search_data.split("\n\n") if block.strip()]
+    sections = "".join(
+        '<div class="blog-section bg-white/5 border border-white/10 rounded-xl p-6 mb-8">'
+        f'<h2 class="blog-section-title text-2xl font-bold text-white mb-4 flex items-center gap-2">{h}</h2>'
+        f'<p class="blog-content text-gray-300 text-base mb-6">What this means for homes and businesses: {h.lower()}.</p>'
+        '</div>'
+        for h in headlines[:3]
+    )
+    return (
+        '<h1 class="blog-title text-4xl font-extrabold text-white bg-gradient-to-r from-emerald-400 '
+        'to-teal-300 bg-clip-text text-transparent mb-6">This Week in Pest Control</h1>'
+        '<p class="blog-intro text-gray-200 text-lg max-w-3xl mb-8">A round-up of the pest news that matters this week.</p>'
+        f"{sections}"
+        '<p class="blog-conclusion text-gray-200 text-lg mt-8"><strong>Conclusion</strong> '
+        'Stay ahead of the season with regular inspections.</p>'
+    )
 
 ### Step 1: Tavily search for pest news
 def tavily_search(state: BlogState) -> BlogState:
+    if BLOG_AGENT_OFFLINE:
+        return {**state, "search_data": summarize_results(OFFLINE_RESULTS)}
+
     tavily_key = os.getenv("TAVILY_API_KEY")
     if not tavily_key:
         raise ValueError("Missing TAVILY_API_KEY")
@@ -30,27 +93,24 @@ def tavily_search(state: BlogState) -> BlogState:
         },
         headers={
             "Authorization": f"Bearer {tavily_key}"
-        }
+        },
+        timeout=(BLOG_CONNECT_TIMEOUT, BLOG_SEARCH_TIMEOUT)
     )
+    response.raise_for_status()
     data = response.json()
 
     results = data.get("results", [])
     if not results:
         return {**state, "search_data": "No pest control news found."}
 
-    summaries = []
-    for r in results:
-        title = r.get("title", "")
-        url = r.get("url", "")
-        content = r.get("raw_content") or r.get("content") or ""
-        summaries.append(f"{title}\n{url}\n{content}")
-
-    combined = "\n\n".join(summaries)
-    return {**state, "search_data": combined}
+    return {**state, "search_data": summarize_results(results)}
 
 
 ### Step 2: Use Groq Mixtral to generate a blog
 def generate_blog(state: BlogState) -> BlogState:
+    if BLOG_AGENT_OFFLINE:
+        return {**state, "blog_content": offline_blog_html(state["search_data"])}
+
     groq_key = os.getenv("GROQ_API_KEY")
     if not groq_key:
         raise ValueError("Missing GROQ_API_KEY")
@@ -74,16 +134,17 @@ Generate a full SEO-optimized blog post in **HTML format** with the following re
 - Ensure the content is engaging, informative, and tailored to Indian homeowners and businesses, reflecting the latest pest trends (e.g., eco-friendly methods, Integrated Pest Management).
 """
     res = requests.post(
-        "https://api.groq.com/openai/v1/chat/completions",
+        f"{GROQ_BASE_URL}/openai/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {groq_key}",
             "Content-Type": "application/json"
         },
         json={
-            "model": "meta-llama/llama-4-scout-17b-16e-instruct",
+            "model": BLOG_MODEL,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": 0.7
-        }
+        },
+        timeout=(BLOG_CONNECT_TIMEOUT, BLOG_GENERATE_TIMEOUT)
     )
 
     data = res.json()
@@ -98,8 +159,6 @@ Generate a full SEO-optimized blog post in **HTML format** with the following re
 
 
 ### Step 3: Store blog in MySQL database
-import re
-
 def save_to_mysql(state: BlogState) -> BlogState:
     # Extract <h1> title from content
     html = state["blog_content"]
@@ -109,26 +168,22 @@ def save_to_mysql(state: BlogState) -> BlogState:
 
     print("🔍 Blog Title:", title)
 
-    conn = mysql.connector.connect(
-        host="127.0.0.1", 
-        port=3306,
-        user="root",
-        password="vidakuzha92**",
-        database="pest_control",
-        use_pure=True
-    )
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "INSERT INTO blog_posts (title, content, date) VALUES (%s, %s, NOW())",
-        (title, html_without_title)
-    )
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+    conn = create_connection()
+    if conn is None:
+        raise RuntimeError("Database connection failed")
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO blog_posts (title, content, date) VALUES (%s, %s, NOW())",
+            (title, html_without_title)
+        )
+        conn.commit()
+        blog_id = cursor.lastrowid
+        cursor.close()
+    finally:
+        conn.close()
 
-    return state
+    return {**state, "title": title, "blog_id": blog_id}
 
 
 ### Step 4: LangGraph flow definition
@@ -146,6 +201,23 @@ graph = builder.compile()
 
 
 
+def run_blog_graph(on_step=None) -> BlogState:
+    """
+    Run the graph node by node. on_step(node, seconds) is called as each node finishes,
+    so callers can report progress and per-node timings. Returns the final state.
+    """
+    state: BlogState = {}
+    started = time.perf_counter()
+    for update in graph.stream({}, stream_mode="updates"):
+        finished = time.perf_counter()
+        for node, node_state in update.items():
+            state.update(node_state or {})
+            if on_step:
+                on_step(node, finished - started)
+        started = finished
+    return state
+
+
 def run_weekly_blog_pipeline() -> dict:
     try:
         graph.invoke({})
@@ -1,6 +1,11 @@
-from flask import request, jsonify, Blueprint,g
+from collections import deque
+from flask import request, jsonify, Blueprint,g, Response, stream_with_context
 from app.db import create_connection
 from ..utils.verify_token import token_required
+from ..utils.chat_stream import sse_event
+from ..utils.notification_hub import (
+    NOTIFY_KEEPALIVE_SECONDS, NOTIFY_TAIL_LIMIT, OVERFLOW, notification_hub, unseen_after
+)
 
 notifications_bp = Blueprint("notifications", __name__, url_prefix="/notifications")
 
@@ -64,3 +69,80 @@ def mark_notification_seen(notification_id):
     except Exception as e:
         print(e)
         return jsonify({"success": False, "message": str(e)}), 500
+
+
+def _unseen_since(user_type, user_id, after_id):
+    conn = create_connection()
+    if conn is None:
+        raise RuntimeError("Database connection failed")
+    try:
+        cursor = conn.cursor(dictionary=True)
+        rows = []
+        while True:
+            page = unseen_after(cursor, user_type, user_id, after_id)
+            rows.extend(page)
+            if len(page) < NOTIFY_TAIL_LIMIT:
+                break
+            after_id = page[-1]["id"]
+        cursor.close()
+        return rows
+    finally:
+        conn.close()
+
+
+@notifications_bp.route("/stream", methods=["GET"])
+@token_required()
+def stream_notifications():
+    """
+    The caller's unseen notifications as Server-Sent Events, then each new one as it is
+    written: `event: notification` frames whose id is the notification id. A reconnect
+    sending Last-Event-ID (or ?last_id=) only gets the notifications after that id.
+    Comment frames keep idle connections open through proxies.
+    """
+    user_type = g.current_user['role']
+    user_id = g.current_user['sub']
+    try:
+        after_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_id") or 0)
+    except ValueError:
+        return jsonify({"message": "last_id must be a notification id"}), 400
+
+    try:
+        # Subscribe before reading the backlog so nothing written in between is missed
+        subscription = notification_hub.subscribe(user_type, user_id)
+    except Exception as e:
+        print(f"Error subscribing to notifications: {e}")
+        return jsonify({"message": "Failed to fetch notifications"}), 503
+
+    def generate():
+        last_id = after_id
+        sent = deque(maxlen=NOTIFY_TAIL_LIMIT)  # the hub re-publishes late rows from a lookback window
+        try:
+            yield "retry: 3000\n\n"
+            pending = _unseen_since(user_type, user_id, last_id)
+            while True:
+                for row in pending:
+                    if row["id"] <= after_id or row["id"] in sent:
+                        continue
+                    sent.append(row["id"])
+                    last_id = max(last_id, row["id"])
+                    yield sse_event(row, event="notification", event_id=last_id)
+                message = subscription.get(timeout=NOTIFY_KEEPALIVE_SECONDS)
+                if message is None:
+                    pending = []
+                    yield ": keepalive\n\n"
+                elif message is OVERFLOW:
+                    pending = _unseen_since(user_type, user_id, last_id)
+                else:
+                    pending = [message]
+        except Exception as e:
+            print(f"Error streaming notifications: {e}")
+            yield sse_event({"message": "Notification stream failed"}, event="error")
+        finally:
+            subscription.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # Disable proxy buffering so each frame reaches the browser as it is produced
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
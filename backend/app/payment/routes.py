@@ -1,6 +1,7 @@
 from flask import request, jsonify, Blueprint, current_app, g
 from app.db import create_connection
 from ..utils.verify_token import token_required
+from ..utils.tech_dashboard import on_technician_schedule_changed
 
 payment_bp = Blueprint('payment', __name__, url_prefix="/payment")
 
@@ -29,6 +30,7 @@ def verify_payment_test():
         """, (booking_id,))
 
         conn.commit()
+        on_technician_schedule_changed()
         cursor.close()
         conn.close()
 
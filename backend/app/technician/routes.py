@@ -1,6 +1,9 @@
 from flask import request, jsonify, Blueprint, current_app,g
 from app.db import create_connection
 from ..utils.verify_token import token_required
+from ..utils.tech_dashboard import get_dashboard, on_technician_schedule_changed
+from ..utils.tech_availability import technician_availability
+from ..utils.intervals import IntervalError, normalize_interval, find_conflict, conflict_message
 import os
 from datetime import datetime, timedelta
 import traceback
@@ -24,98 +27,7 @@ def serialize_datetimes(obj):
 def home():
     try:
         technician_id = g.current_user["sub"]  # from token
-
-        conn = create_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # 1. Today’s assigned services
-        cursor.execute("""
-            SELECT b.booking_id, s.name AS service_type, b.booking_date, b.status, b.location_lat, b.location_lng
-            FROM bookings b
-            JOIN booking_technicians bt ON b.booking_id = bt.booking_id
-            JOIN services s ON b.service_id = s.service_id
-            WHERE bt.technician_id = %s AND DATE(b.booking_date) = CURDATE()
-            ORDER BY b.booking_date ASC
-        """, (technician_id,))
-        todays_services = cursor.fetchall()
-
-        # 2. Upcoming services (future)
-        cursor.execute("""
-            SELECT b.booking_id, s.name AS service_type, b.booking_date, b.status
-            FROM bookings b
-            JOIN booking_technicians bt ON b.booking_id = bt.booking_id
-            JOIN services s ON b.service_id = s.service_id
-            WHERE bt.technician_id = %s AND b.booking_date > NOW()
-            ORDER BY b.booking_date ASC
-        """, (technician_id,))
-        upcoming_services = cursor.fetchall()
-
-        # 3. Service history (past and completed)
-        cursor.execute("""
-            SELECT b.booking_id, s.name AS service_type, b.booking_date, b.status
-            FROM bookings b
-            JOIN booking_technicians bt ON b.booking_id = bt.booking_id
-            JOIN services s ON b.service_id = s.service_id
-            WHERE bt.technician_id = %s AND b.status = 'completed'
-            ORDER BY b.booking_date DESC
-        """, (technician_id,))
-        service_history = cursor.fetchall()
-
-        # 4. Availability info
-        cursor.execute("""
-            SELECT start_datetime, end_datetime, reason,status
-            FROM technician_unavailable
-            WHERE technician_id = %s AND end_datetime >= NOW() and reason !='job' and status = 'approved'
-            ORDER BY start_datetime ASC
-        """, (technician_id,))
-        upcoming_unavailability = cursor.fetchall()
-
-        # 5. Earnings summary (sum of payment amounts)
-        cursor.execute("""
-            SELECT SUM(s.salary) as total_earned
-            FROM salary s where technician_id =%s
-        """, (technician_id,))
-        earnings = cursor.fetchone()
-
-        # 6. Latest notifications (limit 5)
-        cursor.execute("""
-            SELECT id, message, created_at
-            FROM notifications
-            WHERE user_type = 'technician' 
-            AND user_id = %s
-            AND is_seen = FALSE
-            ORDER BY created_at DESC
-            LIMIT 5
-        """, (technician_id,))
-        notifications = cursor.fetchall()
-
-        # ✅ Convert datetime fields to ISO strings for frontend
-        from datetime import timezone
-
-        def format_datetime_fields(items, keys):
-            for item in items:
-                for key in keys:
-                    if key in item and isinstance(item[key], (str, bytes)) is False:
-                        # Convert to UTC and then to ISO string
-                        item[key] = item[key].astimezone(timezone.utc).isoformat()
-            return items
-
-
-        format_datetime_fields(todays_services, ["booking_date"])
-        format_datetime_fields(upcoming_services, ["booking_date"])
-        format_datetime_fields(service_history, ["booking_date"])
-        format_datetime_fields(upcoming_unavailability, ["start_datetime", "end_datetime"])
-        format_datetime_fields(notifications, ["created_at"])
-
-        return jsonify({
-            "success": True,
-            "today_services": todays_services,
-            "upcoming_services": upcoming_services,
-            "service_history": service_history,
-            "availability": upcoming_unavailability,
-            "earnings": earnings.get("total_earned", 0),
-            "notifications": notifications
-        })
+        return jsonify(get_dashboard(technician_id))
 
     except Exception as e:
         print("Error:", e)
@@ -268,6 +180,7 @@ def verify_otp(booking_id):
     """, (booking_id,))
 
     conn.commit()
+    on_technician_schedule_changed()  # every technician on the booking
     return jsonify({"success": True, "message": "Booking marked as completed"})
 
 @tech_bp.route("/leaves", methods=["GET"])
@@ -295,31 +208,26 @@ def apply_leave():
 
     if not start or not end:
         return jsonify({"message": "Start and end time required"}), 400
+    try:
+        start, end = normalize_interval(start, end)
+    except IntervalError as e:
+        return jsonify({"message": str(e)}), 400
 
     conn = create_connection()
     cursor = conn.cursor()
 
+    # Lock the technician first, as reserve_technicians() does, so no booking can assign them
+    # between the check and the insert; as the first read it also starts the check's snapshot
+    cursor.execute("SELECT technician_id FROM technicians WHERE technician_id = %s FOR UPDATE", (technician_id,))
+    cursor.fetchall()
+
     # Check for overlapping entries (leave or job)
-    cursor.execute("""
-        SELECT reason FROM technician_unavailable
-        WHERE technician_id = %s
-          AND (
-                (start_datetime <= %s AND end_datetime >= %s) OR
-                (start_datetime <= %s AND end_datetime >= %s) OR
-                (start_datetime >= %s AND end_datetime <= %s)
-              )
-    """, (technician_id, start, start, end, end, start, end))
-
-    conflict = cursor.fetchone()
+    conflict = find_conflict(cursor, technician_id, start, end)
     if conflict:
-        reason_text = conflict[0].lower()
-        if reason_text == "job":
-            message = "You have a job assigned during this time. Leave cannot be applied."
-        else:
-            message = "You already have a leave or unavailability during this time."
+        conn.rollback()
         cursor.close()
         conn.close()
-        return jsonify({"message": message}), 409
+        return jsonify({"message": conflict_message(conflict[1])}), 409
 
     # Insert new leave
     cursor.execute("""
@@ -327,6 +235,8 @@ def apply_leave():
         VALUES (%s, %s, %s, %s)
     """, (technician_id, start, end, reason))
     conn.commit()
+    technician_availability.add_unavailability(technician_id, cursor.lastrowid, start, end)
+    on_technician_schedule_changed([technician_id])
 
     cursor.close()
     conn.close()
@@ -356,6 +266,8 @@ def delete_technician_leave(leave_id):
     # Perform deletion
     cursor.execute("DELETE FROM technician_unavailable WHERE id = %s", (leave_id,))
     conn.commit()
+    technician_availability.remove_unavailability(leave_id)
+    on_technician_schedule_changed([technician_id])
 
     cursor.close()
     conn.close()
@@ -1,33 +1,26 @@
-from flask import request, jsonify, Blueprint, current_app,g
+from flask import request, jsonify, Blueprint, current_app,g, Response, stream_with_context
 from app.db import create_connection
-from app.models import sentiment_pipeline
 from ..utils.verify_token import token_required
 import os
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 from datetime import datetime, timedelta
 import traceback
 import requests
 from dotenv import load_dotenv   
-from langchain_huggingface import HuggingFaceEndpoint
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sqlalchemy import create_engine
-import pandas as pd
-import numpy as np
-from surprise import Dataset, Reader, KNNBasic
 import re
-from ..utils.grok_model import CreateMessage
+from ..utils.grok_model import CreateMessage, StreamMessage
+from ..utils.chat_stream import ReplyFormatter, format_reply, sse_event
+from ..utils.chat_cache import chat_cache
 import textwrap
-from  ..utils.clip_model import predict_pest_from_image
-from ..utils.similiarity_checker import get_recommendations_for_pest
+from ..utils.prediction_cache import predict_pest_cached, MIN_CONFIDENCE
+from ..utils.store_recommender import get_hybrid_recommendations, on_order_status_changed
+from ..utils.sentiment_queue import sentiment_queue, PENDING as PENDING_SENTIMENT
+from ..utils.booking import BookingError, book_with_technicians
  
 load_dotenv()
 user_bp=Blueprint('user',__name__,url_prefix="/user")
 
-def get_sqlalchemy_engine():
-    return create_engine(f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}")
-
 @user_bp.route("/services", methods=['GET'])
 @token_required(role='user')
 def get_services():
@@ -102,78 +95,20 @@ def book_service(service_id):
         requirements = data.get('requirements', '')
 
         conn = create_connection()
-        cursor = conn.cursor(dictionary=True)
-        now = datetime.utcnow()
-
-        # 1. Insert into bookings
-        insert_booking = """
-            INSERT INTO bookings
-            (user_id, service_id, booking_date, location_lat, location_lng, requirements, status, created_at, updated_at, feedback, sentiment)
-            VALUES (%s, %s, %s, %s, %s, %s, 'pending', %s, %s, '', '')
-        """
-        cursor.execute(insert_booking, (
-            user_id, service_id, booking_date, location_lat, location_lng, requirements, now, now
-        ))
-        booking_id = cursor.lastrowid
-
-        # 2. Get number of technicians needed
-        cursor.execute("SELECT technicians_needed FROM services WHERE service_id = %s", (service_id,))
-        service = cursor.fetchone()
-        if not service:
-            return jsonify({"success": False, "message": "Service not found"}), 404
-        tech_needed = service['technicians_needed']
-
-        # 3. Find available technicians (exclude those unavailable that day)
-        query_tech = """
-            SELECT t.technician_id, COALESCE(MAX(b.booking_date), '1970-01-01') AS last_job_date
-            FROM technicians t
-            LEFT JOIN booking_technicians bt ON t.technician_id = bt.technician_id
-            LEFT JOIN bookings b ON bt.booking_id = b.booking_id
-            WHERE t.technician_id NOT IN (
-                SELECT technician_id FROM technician_unavailable
-                WHERE DATE(%s) BETWEEN DATE(start_datetime) AND DATE(end_datetime)
+        try:
+            booking_id, assigned = book_with_technicians(
+                conn, user_id, service_id, booking_date, location_lat, location_lng, requirements
             )
-            GROUP BY t.technician_id
-            ORDER BY last_job_date ASC
-            LIMIT %s
-        """
-        cursor.execute(query_tech, (booking_date, tech_needed))
-        available_techs = cursor.fetchall()
-
-        if len(available_techs) < tech_needed:
-            return jsonify({
-                "success": False,
-                "message": "Not enough technicians available for the selected date"
-            }), 400
-
-        # 4. Assign technicians to booking and mark as unavailable
-        insert_bt = "INSERT INTO booking_technicians (booking_id, technician_id) VALUES (%s, %s)"
-        update_tech_last_job = "UPDATE technicians SET last_job = %s WHERE technician_id = %s"
-        insert_unavailable = """
-            INSERT INTO technician_unavailable
-            (technician_id, start_datetime, end_datetime, reason, status)
-            VALUES (%s, %s, %s, 'job', 'approved')
-        """
-
-        # Set the full day range
-        start_dt = datetime.strptime(booking_date, "%Y-%m-%d %H:%M:%S")
-        end_dt = start_dt + timedelta(days=1)
-
-        for tech in available_techs:
-            tid = tech['technician_id']
-            cursor.execute(insert_bt, (booking_id, tid))
-            cursor.execute(update_tech_last_job, (now, tid))
-            cursor.execute(insert_unavailable, (tid, start_dt, end_dt))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        except BookingError as e:
+            return jsonify({"success": False, "message": e.message}), e.status
+        finally:
+            conn.close()
 
         return jsonify({
             "success": True,
             "message": "Service booked successfully",
             "booking_id": booking_id,
-            "assigned_technicians": [t['technician_id'] for t in available_techs]
+            "assigned_technicians": assigned
         }), 201
 
     except Exception as e:
@@ -369,6 +304,7 @@ def confirm_payment():
 
         cursor.close()
         conn.close()
+        on_order_status_changed(cart_ids)
         return jsonify({'message': 'Order placed successfully'}), 200
 
     except Exception as e:
@@ -443,147 +379,109 @@ def get_all_booking_locations():
         if cursor: cursor.close()
         if conn: conn.close()
 
-@user_bp.route("/chat", methods=["POST"])
-def user_chat():
-    # Validate request
+CHAT_SYSTEM_PROMPT = textwrap.dedent("""
+    You are a friendly and knowledgeable pest control assistant for a professional pest management service website.
+    Your job is to help users with:
+
+    - Identifying pests (based on user description or uploaded images)
+    - Recommending appropriate pest control services
+    - Explaining the treatment process
+    - Answering questions about safety, pricing, and bookings
+    - Providing tips for pest prevention
+
+    Always ask follow-up questions to understand the user's pest issue better, and suggest specific services or actions.
+    Keep your responses professional, concise, and supportive.
+    If the issue is complex, guide the user to contact human support or schedule an inspection.
+
+    Use a friendly tone but avoid humor unless asked.
+    Always prioritize safety and accuracy in your suggestions.
+""").strip()
+
+
+def _chat_message():
+    # (message, error response) for the chat endpoints
     if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
+        return None, (jsonify({"error": "Request must be JSON"}), 400)
 
     data = request.get_json()
     user_message = data.get("message", "").strip()
 
     if not user_message:
-        return jsonify({"error": "Message cannot be empty"}), 400
+        return None, (jsonify({"error": "Message cannot be empty"}), 400)
+    return user_message, None
 
-    try:
-        prompt = textwrap.dedent("""
-            You are a friendly and knowledgeable pest control assistant for a professional pest management service website.
-            Your job is to help users with:
 
-            - Identifying pests (based on user description or uploaded images)
-            - Recommending appropriate pest control services
-            - Explaining the treatment process
-            - Answering questions about safety, pricing, and bookings
-            - Providing tips for pest prevention
+@user_bp.route("/chat", methods=["POST"])
+def user_chat():
+    # Validate request
+    user_message, error = _chat_message()
+    if error:
+        return error
 
-            Always ask follow-up questions to understand the user's pest issue better, and suggest specific services or actions.
-            Keep your responses professional, concise, and supportive.
-            If the issue is complex, guide the user to contact human support or schedule an inspection.
+    # FAQ-style questions repeat a lot; answer those without an LLM round trip
+    cached_reply, cache_probe = chat_cache.lookup(user_message)
+    if cached_reply is not None:
+        return jsonify({"reply": cached_reply})
 
-            Use a friendly tone but avoid humor unless asked.
-            Always prioritize safety and accuracy in your suggestions.
-        """).strip()
-        bot_reply = CreateMessage(user_message,prompt)
+    try:
+        bot_reply = CreateMessage(user_message,CHAT_SYSTEM_PROMPT)
 
         # Validate response
         if not bot_reply:
             return jsonify({"error": "Invalid response from AI service"}), 500
 
         # Format response to insert newlines after numbered items
-        formatted_reply = bot_reply.content
-        formatted_reply = formatted_reply.replace(". ", ".\n")  # New line after numbered points
-        formatted_reply = "\n".join(line.strip() for line in formatted_reply.splitlines() if line.strip())
+        formatted_reply = format_reply(bot_reply.content)
+        chat_cache.store(cache_probe, formatted_reply)
         return jsonify({"reply": formatted_reply})
 
     except Exception as e:
         # Proper error logging
         print(f"Error calling LLM: {str(e)}")
         return jsonify({"error": "AI service unavailable"}), 503
-    
-
-def get_hybrid_recommendations(user_id, engine):
-    """Enhanced recommendation system combining multiple approaches"""
-    # Load all necessary data
-    store_df = pd.read_sql("SELECT id, name, category, description FROM store", engine)
-    cart_df = pd.read_sql(f"""
-        SELECT product_id 
-        FROM cart 
-        WHERE user_id = {user_id} AND status != 'in_cart'
-    """, engine)
-    
-    if cart_df.empty or store_df.empty:
-        return []
-
-    # 1. Content-Based (TF-IDF) - Improved version
-    store_df['text'] = (
-        store_df['name'] + ' ' + 
-        store_df['category'] + ' ' + 
-        store_df['description'].fillna('')
-    )
-    
-    # Improved text preprocessing
-    tfidf = TfidfVectorizer(
-        stop_words='english',
-        min_df=2,  # Ignore terms that appear in only 1 product
-        max_df=0.8  # Ignore terms that appear in >80% of products
-    )
-    tfidf_matrix = tfidf.fit_transform(store_df['text'])
-
-    # 2. Collaborative Filtering (if we have purchase history)
-    try:
-        ratings_data = pd.read_sql(f"""
-            SELECT 
-                user_id, 
-                product_id, 
-                CASE 
-                    WHEN status = 'delivered' THEN 5 
-                    WHEN status = 'shipped' THEN 3 
-                    ELSE 1 
-                END as rating
-            FROM cart 
-            WHERE user_id = {user_id} AND status != 'in_cart'
-        """, engine)
-        
-        if not ratings_data.empty:
-            reader = Reader(rating_scale=(1, 5))
-            data = Dataset.load_from_df(ratings_data[['user_id', 'product_id', 'rating']], reader)
-            trainset = data.build_full_trainset()
-            sim_options = {'name': 'cosine', 'user_based': False}
-            algo = KNNBasic(sim_options=sim_options)
-            algo.fit(trainset)
-    except Exception as e:
-        print(f"Collaborative filtering skipped: {str(e)}")
-
-    # Get cart items
-    cart_product_ids = cart_df['product_id'].unique().tolist()
-    cart_indices = store_df[store_df['id'].isin(cart_product_ids)].index.tolist()
-
-    if not cart_indices:
-        return []
-
-    # Hybrid scoring
-    def calculate_scores(product_id):
-        # Content-based score
-        idx = store_df[store_df['id'] == product_id].index[0]
-        content_score = cosine_similarity(
-            np.asarray(tfidf_matrix[cart_indices].mean(axis=0)).reshape(1, -1),
-            np.asarray(tfidf_matrix[idx].toarray()).reshape(1, -1)
-        )[0][0]
-
-        
-        # Collaborative score (if available)
-        collab_score = 0
-        if not ratings_data.empty:
-            try:
-                pred = algo.predict(user_id, product_id)
-                collab_score = pred.est / 5  # Normalize to 0-1
-            except:
-                pass
-        
-        # Combine scores (weighted)
-        return 0.7 * content_score + 0.3 * collab_score
 
-    # Calculate scores for all products not in cart
-    recommendations = store_df[~store_df['id'].isin(cart_product_ids)].copy()
-    recommendations['similarity'] = recommendations['id'].apply(calculate_scores)
-    
-    # Get top 3 recommendations
-    top_recommendations = recommendations.sort_values(
-        by='similarity', 
-        ascending=False
-    ).head(3)
 
-    return top_recommendations[['id', 'name', 'category', 'description']].to_dict(orient='records')
+@user_bp.route("/chat/stream", methods=["POST"])
+def user_chat_stream():
+    """
+    Same reply as /chat, relayed as Server-Sent Events while it is generated:
+    `data: {"delta": ...}` frames, then `event: done` (or `event: error`).
+    Disconnecting stops the upstream completion.
+    """
+    user_message, error = _chat_message()
+    if error:
+        return error
+
+    cached_reply, cache_probe = chat_cache.lookup(user_message)
+
+    def generate():
+        if cached_reply is not None:
+            yield sse_event({"delta": cached_reply})
+            yield sse_event({"cached": True}, event="done")
+            return
+
+        formatter = ReplyFormatter()
+        parts = []
+        try:
+            for delta in StreamMessage(user_message, CHAT_SYSTEM_PROMPT):
+                text = formatter.feed(delta)
+                if text:
+                    parts.append(text)
+                    yield sse_event({"delta": text})
+        except Exception as e:
+            print(f"Error streaming LLM reply: {str(e)}")
+            yield sse_event({"error": "AI service unavailable"}, event="error")
+            return
+        parts.append(formatter.finish())
+        chat_cache.store(cache_probe, "".join(parts))
+        yield sse_event({"cached": False}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # Disable proxy buffering so each frame reaches the browser as it is produced
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @user_bp.route("/store", methods=["GET"])
@@ -591,7 +489,6 @@ def get_hybrid_recommendations(user_id, engine):
 def get_user_store():
     try:
         conn = create_connection()  # For cursor use
-        engine = get_sqlalchemy_engine()  # For pandas
         current_user = g.current_user
 
         # Fetch all items using cursor
@@ -600,7 +497,7 @@ def get_user_store():
         items = cursor.fetchall()
 
         # Get recommendations using the improved engine
-        recommended_items = get_hybrid_recommendations(current_user['sub'], engine)
+        recommended_items = get_hybrid_recommendations(current_user['sub'])
 
         return jsonify({
     "success": True,
@@ -635,21 +532,16 @@ def submit_feedback():
         if not cursor.fetchone():
             return jsonify({"error": "Booking not found or unauthorized"}), 403
 
-        # Sentiment prediction
-        result = sentiment_pipeline(feedback_text)[0]
-        label = result['label'].lower()  # "positive" or "negative"
-        if label not in ['positive', 'negative']:
-            label = 'neutral'
-
-        # Update DB
+        # Sentiment is scored in the background; the row stays 'pending' until then
         cursor.execute("""
             UPDATE bookings
             SET feedback = %s, sentiment = %s
             WHERE booking_id = %s
-        """, (feedback_text, label, booking_id))
+        """, (feedback_text, PENDING_SENTIMENT, booking_id))
         conn.commit()
+        sentiment_queue.enqueue(booking_id, feedback_text)
 
-        return jsonify({"message": "Feedback submitted", "sentiment": label}), 200
+        return jsonify({"message": "Feedback submitted", "sentiment": PENDING_SENTIMENT}), 200
 
     except Exception as e:
         print("Error in submit_feedback:", e)
@@ -756,20 +648,18 @@ def predict_pest_type():
         if 'image' not in request.files:
             return jsonify({"success": False, "message": "Image file is required"}), 400
 
+        # Werkzeug spools the upload to a temp file; hash and decode it from there
         file = request.files['image']
-        image_bytes = file.read()
 
-        predicted_label, confidence = predict_pest_from_image(image_bytes)
+        predicted_label, confidence, recommended_services = predict_pest_cached(file.stream)
 
-        if confidence < 0.40:
+        if confidence < MIN_CONFIDENCE:
             return jsonify({
                 "success": False,
                 "message": "Confidence too low to make a reliable prediction.",
                 "confidence": confidence
             }), 200
 
-        recommended_services = get_recommendations_for_pest(predicted_label)
-        print(recommended_services)
         return jsonify({
             "success": True,
             "pest_type": predicted_label,
@@ -777,6 +667,8 @@ def predict_pest_type():
             "recommendations": recommended_services
         }), 200
 
+    except HTTPException:
+        raise  # e.g. 413 for a chunked upload over MAX_UPLOAD_MB
     except Exception as e:
         print("Pest prediction error:", str(e))
         return jsonify({"success": False, "message": "Prediction failed"}), 500
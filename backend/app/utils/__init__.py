@@ -0,0 +1,7 @@
+import os
+
+# Local, git-ignored directory for derived artifacts (embedding indexes, caches, checkpoints)
+INSTANCE_DIR = os.getenv(
+    "INSTANCE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "instance")
+)
@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from request threads and hands them to `batch_fn` in groups.
+
+    The worker waits for the first item, then keeps collecting for up to `max_wait_ms`
+    or until `max_batch_size` items are queued, runs one `batch_fn(items)` call and
+    resolves each caller's future with its own result.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=20, name="batcher"):
+        self._batch_fn = batch_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._last_batch_size = 0
+        self._max_seen_batch = 0
+        self._queue_wait_total = 0.0
+        self._run_total = 0.0
+        self._last_run_ms = 0.0
+
+    def submit(self, item):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout=timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self._batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self._name}: expected {len(items)} results, got {len(results)}")
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._last_batch_size = len(batch)
+                self._max_seen_batch = max(self._max_seen_batch, len(batch))
+                self._queue_wait_total += sum(started - queued for _, _, queued in batch)
+                self._run_total += finished - started
+                self._last_run_ms = (finished - started) * 1000
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self._max_batch_size,
+                "max_wait_ms": self._max_wait * 1000,
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "last_batch_size": self._last_batch_size,
+                "max_seen_batch_size": self._max_seen_batch,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "avg_queue_wait_ms": round(self._queue_wait_total / self._items * 1000, 3) if self._items else 0.0,
+                "avg_batch_run_ms": round(self._run_total / self._batches * 1000, 3) if self._batches else 0.0,
+                "last_batch_run_ms": round(self._last_run_ms, 3),
+            }
@@ -0,0 +1,33 @@
+"""
+The weekly blog pipeline as a background job.
+
+/admin/run-weekly-blog enqueues it and returns the job id; the job runner executes the
+LangGraph pipeline and records each node's duration. With BLOG_WEEKLY_SCHEDULE set
+(e.g. "mon 09:00", local time) create_app() also starts a weekly run, no cron needed.
+"""
+import os
+from app.utils.jobs import job_runner, WeeklySchedule
+
+BLOG_JOB = "weekly_blog"
+BLOG_WEEKLY_SCHEDULE = os.getenv("BLOG_WEEKLY_SCHEDULE", "")
+
+_schedule = None
+
+
+def _run_blog_job(job):
+    from app.models.agent.blog_agent import run_blog_graph  # pulls in langgraph
+
+    state = run_blog_graph(on_step=job.step)
+    return {"blog_id": state.get("blog_id"), "title": state.get("title")}
+
+
+def enqueue_weekly_blog(trigger="manual"):
+    return job_runner.submit(BLOG_JOB, _run_blog_job, trigger=trigger)
+
+
+def start_weekly_schedule(spec=BLOG_WEEKLY_SCHEDULE):
+    """Start the weekly run in this worker if a schedule is configured."""
+    global _schedule
+    if spec and _schedule is None:
+        _schedule = WeeklySchedule(BLOG_JOB, spec, enqueue_weekly_blog).start()
+    return _schedule
@@ -0,0 +1,124 @@
+"""
+Service booking with technician assignment as a single transaction.
+
+The booking row, the technician locks and the three assignment writes either all commit
+or all roll back. Two concurrent bookings can never be given the same technician, and a
+booking that cannot be staffed leaves nothing behind.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+from app.utils.dispatch import dispatch_index
+from app.utils.notification_hub import notification_hub
+from app.utils.tech_availability import technician_availability, reserve_technicians
+from app.utils.tech_dashboard import on_technician_schedule_changed
+
+INSERT_BOOKING = """
+    INSERT INTO bookings
+    (user_id, service_id, booking_date, location_lat, location_lng, requirements, status, created_at, updated_at, feedback, sentiment)
+    VALUES (%s, %s, %s, %s, %s, %s, 'pending', %s, %s, '', '')
+"""
+# InnoDB deadlock and lock wait timeout: the transaction was rolled back and can be replayed
+RETRYABLE_ERRNOS = (1213, 1205)
+BOOKING_ATTEMPTS = 3
+INSERT_ASSIGNMENT = "INSERT INTO booking_technicians (booking_id, technician_id) VALUES (%s, %s)"
+INSERT_JOB_UNAVAILABLE = """
+    INSERT INTO technician_unavailable
+    (technician_id, start_datetime, end_datetime, reason, status)
+    VALUES (%s, %s, %s, 'job', 'approved')
+"""
+
+
+def _location(lat, lng):
+    try:
+        return float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+
+
+class BookingError(Exception):
+    """The booking was rolled back; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _book_once(conn, user_id, service_id, booking_date, start_dt, end_dt, location, lat, lng, requirements):
+    """One attempt at the booking transaction; it is committed or rolled back before returning."""
+    now = datetime.utcnow()
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT technicians_needed FROM services WHERE service_id = %s", (service_id,))
+        service = cursor.fetchone()
+        if not service:
+            raise BookingError("Service not found", 404)
+        tech_needed = service[0]
+
+        cursor.execute(INSERT_BOOKING, (
+            user_id, service_id, booking_date, lat, lng, requirements, now, now
+        ))
+        booking_id = cursor.lastrowid
+
+        technician_ids = reserve_technicians(cursor, start_dt, tech_needed, location=location)
+        if len(technician_ids) < tech_needed:
+            raise BookingError("Not enough technicians available for the selected date", 400)
+
+        if technician_ids:
+            cursor.executemany(INSERT_ASSIGNMENT, [(booking_id, tid) for tid in technician_ids])
+            placeholders = ", ".join(["%s"] * len(technician_ids))
+            cursor.execute(
+                f"UPDATE technicians SET last_job = %s WHERE technician_id IN ({placeholders})",
+                (now, *technician_ids),
+            )
+            cursor.executemany(INSERT_JOB_UNAVAILABLE, [(tid, start_dt, end_dt) for tid in technician_ids])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return booking_id, technician_ids
+
+
+def book_with_technicians(conn, user_id, service_id, booking_date, lat, lng, requirements=""):
+    """
+    Insert the booking and assign the service's technicians. Returns
+    (booking_id, technician_ids); raises BookingError after rolling back when the service
+    does not exist or not enough technicians are free. A transaction InnoDB aborts on a
+    deadlock or lock wait timeout is replayed up to BOOKING_ATTEMPTS times.
+    """
+    try:
+        start_dt = datetime.strptime(booking_date, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        raise BookingError("booking_date must be 'YYYY-MM-DD HH:MM:SS'", 400)
+    # Technicians are blocked for the full day range
+    end_dt = start_dt + timedelta(days=1)
+    location = _location(lat, lng)
+    for attempt in range(BOOKING_ATTEMPTS):
+        try:
+            booking_id, technician_ids = _book_once(
+                conn, user_id, service_id, booking_date, start_dt, end_dt, location, lat, lng, requirements
+            )
+            break
+        except Exception as e:
+            # The range re-check in reserve_technicians() takes next-key locks, so two bookings
+            # inserting job rows can deadlock; InnoDB rolls one back and it is safe to replay
+            if getattr(e, "errno", None) not in RETRYABLE_ERRNOS:
+                raise
+            if attempt + 1 == BOOKING_ATTEMPTS:
+                raise BookingError("The booking could not be completed, please try again", 503)
+            time.sleep(random.uniform(0.01, 0.05) * 2 ** attempt)
+
+    for tid in technician_ids:
+        # Job rows are never removed by id, so a synthetic key is enough until the next reload
+        technician_availability.add_unavailability(tid, ("job", booking_id, tid), start_dt, end_dt)
+        technician_availability.record_job(tid, start_dt)
+        if location:
+            dispatch_index.record_job(tid, booking_id, start_dt, *location)
+    on_technician_schedule_changed(technician_ids)
+    notification_hub.nudge()  # the booking and assignment triggers wrote notifications
+    return booking_id, technician_ids
@@ -0,0 +1,148 @@
+"""
+Fire concurrent bookings for one day at a local MySQL and check no technician was double-booked.
+
+    python -m app.utils.booking_stress --user-id 3 --service-id 1 --date 2031-01-15 \
+        --bookings 200 --concurrency 12
+
+Every booking goes through book_with_technicians() on its own pooled connection. The run
+fails (exit code 1) if a technician ends up with two jobs covering the day, or if the
+number of assignments does not match the bookings that succeeded. Created bookings and
+their job rows are deleted afterwards unless --keep is given. Use a date with no real
+bookings; the notifications the assignment trigger writes are left in place.
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from app.db import create_connection
+from app.utils.booking import BookingError, book_with_technicians
+
+
+def _book_one(user_id, service_id, booking_date):
+    conn = create_connection()
+    if conn is None:
+        return "error", "Database connection failed", None
+    started = time.perf_counter()
+    try:
+        booking_id, technicians = book_with_technicians(conn, user_id, service_id, booking_date, 0, 0, "stress test")
+        return "booked", (booking_id, technicians), time.perf_counter() - started
+    except BookingError as e:
+        return "rejected", e.message, time.perf_counter() - started
+    except Exception as e:
+        return "error", str(e), time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def find_double_bookings(cursor, booking_ids, day_start):
+    """Technicians assigned by this run who hold more than one unavailability row covering the day."""
+    placeholders = ", ".join(["%s"] * len(booking_ids))
+    cursor.execute(f"""
+        SELECT tu.technician_id, COUNT(*) AS jobs
+        FROM technician_unavailable tu
+        WHERE tu.technician_id IN (
+                SELECT technician_id FROM booking_technicians WHERE booking_id IN ({placeholders})
+              )
+          AND tu.start_datetime < %s AND tu.end_datetime >= %s
+        GROUP BY tu.technician_id
+        HAVING COUNT(*) > 1
+    """, (*booking_ids, day_start + timedelta(days=1), day_start))
+    return cursor.fetchall()
+
+
+def cleanup(cursor, booking_ids, technician_ids, start_dt):
+    if technician_ids:
+        placeholders = ", ".join(["%s"] * len(technician_ids))
+        cursor.execute(f"""
+            DELETE FROM technician_unavailable
+            WHERE reason = 'job' AND start_datetime = %s AND technician_id IN ({placeholders})
+        """, (start_dt, *technician_ids))
+    placeholders = ", ".join(["%s"] * len(booking_ids))
+    cursor.execute(f"DELETE FROM bookings WHERE booking_id IN ({placeholders})", booking_ids)
+
+
+def run(user_id, service_id, day, bookings, concurrency, keep=False):
+    booking_date = f"{day} 09:00:00"
+    start_dt = datetime.strptime(booking_date, "%Y-%m-%d %H:%M:%S")
+    gate = threading.Barrier(min(concurrency, bookings))
+
+    def worker(i):
+        if i < gate.parties:
+            try:
+                gate.wait(timeout=10)  # release the first wave together
+            except threading.BrokenBarrierError:
+                pass
+        return _book_one(user_id, service_id, booking_date)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(bookings)))
+    elapsed = time.perf_counter() - started
+
+    booked = [r[1] for r in results if r[0] == "booked"]
+    rejected = [r for r in results if r[0] == "rejected"]
+    errors = [r for r in results if r[0] == "error"]
+    latencies = sorted(r[2] for r in results if r[2] is not None)
+    print(
+        f"{bookings} bookings, concurrency {concurrency}: {len(booked)} booked, {len(rejected)} rejected, "
+        f"{len(errors)} errors in {elapsed:.2f}s"
+    )
+    if latencies:
+        print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    for _, message, _ in errors[:5]:
+        print(f"  error: {message}")
+
+    if not booked:
+        return 1 if errors else 0
+
+    booking_ids = [booking_id for booking_id, _ in booked]
+    assigned = [tid for _, technicians in booked for tid in technicians]
+    conn = create_connection()
+    if conn is None:
+        print("Database connection failed")
+        return 1
+    try:
+        cursor = conn.cursor()
+        doubles = find_double_bookings(cursor, booking_ids, start_dt)
+        placeholders = ", ".join(["%s"] * len(booking_ids))
+        cursor.execute(f"SELECT COUNT(*) FROM booking_technicians WHERE booking_id IN ({placeholders})", booking_ids)
+        (rows,) = cursor.fetchone()
+        if not keep:
+            cleanup(cursor, booking_ids, sorted(set(assigned)), start_dt)
+            conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+    ok = True
+    if doubles:
+        ok = False
+        print(f"DOUBLE-BOOKED technicians (id, jobs): {doubles}")
+    if len(set(assigned)) != len(assigned):
+        ok = False
+        print("The same technician was returned for more than one booking")
+    if rows != len(assigned):
+        ok = False
+        print(f"{rows} assignment rows written, expected {len(assigned)}")
+    if errors:
+        ok = False
+    print("OK: no technician double-booked" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.utils.booking_stress")
+    parser.add_argument("--user-id", type=int, required=True, help="existing user the bookings are made for")
+    parser.add_argument("--service-id", type=int, required=True)
+    parser.add_argument("--date", required=True, help="YYYY-MM-DD, ideally a day with no real bookings")
+    parser.add_argument("--bookings", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=12, help="keep within DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW")
+    parser.add_argument("--keep", action="store_true", help="leave the created bookings in the database")
+    args = parser.parse_args(argv)
+    return run(args.user_id, args.service_id, args.date, args.bookings, args.concurrency, args.keep)
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from app.utils.metrics import register_stats
+
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", 1000))
+CHAT_CACHE_TTL_SECONDS = int(os.getenv("CHAT_CACHE_TTL_SECONDS", 24 * 3600))
+# Cosine similarity above which a differently worded question reuses a cached answer.
+# 0 keeps the cache exact-match only; ~0.9 catches rephrasings without mixing up topics.
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", 0))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(text):
+    """Case, punctuation and whitespace-insensitive form of a chat message."""
+    return _SPACES.sub(" ", _PUNCTUATION.sub(" ", text.lower())).strip()
+
+
+class ChatResponseCache:
+    """
+    LRU of normalized question -> reply with a TTL. With a similarity threshold set, a miss
+    on the exact text falls back to the closest cached question by MiniLM embedding.
+
+    lookup() returns (reply, probe); pass the probe to store() after a miss so the
+    embedding computed for the lookup is not computed again.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=86400, similarity=0.0, namespace=""):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self.similarity = similarity
+        self._namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._semantic_hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._errors = 0
+        self._lookup_total = 0.0
+
+    def _key(self, normalized):
+        return hashlib.sha1(f"{self._namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def lookup(self, message):
+        started = time.perf_counter()
+        normalized = normalize_message(message)
+        probe = {"key": self._key(normalized), "text": normalized, "embedding": None}
+        reply = self._exact(probe["key"])
+        if reply is None and self.similarity > 0 and normalized:
+            try:
+                reply = self._semantic(probe)
+            except Exception as e:
+                # MiniLM failed to load or encode: a miss, so the caller still asks the LLM
+                print(f"Chat cache similarity lookup failed: {e}")
+                with self._lock:
+                    self._errors += 1
+        with self._lock:
+            self._lookup_total += time.perf_counter() - started
+            if reply is None:
+                self._misses += 1
+        return reply, probe
+
+    def _exact(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["created"] > self._ttl:
+                del self._entries[key]
+                self._expired += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry["reply"]
+
+    def _semantic(self, probe):
+        from app.utils.similiarity_checker import encode_texts
+
+        probe["embedding"] = encode_texts([probe["text"]])[0]
+        now = time.time()
+        with self._lock:
+            live = [(k, e) for k, e in self._entries.items()
+                    if e["embedding"] is not None and now - e["created"] <= self._ttl]
+            if not live:
+                return None
+            scores = np.stack([e["embedding"] for _, e in live]) @ probe["embedding"]
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None
+            key, entry = live[best]
+            self._entries.move_to_end(key)
+            self._semantic_hits += 1
+            return entry["reply"]
+
+    def store(self, probe, reply):
+        embedding = probe["embedding"]
+        if embedding is None and self.similarity > 0 and probe["text"]:
+            from app.utils.similiarity_checker import encode_texts
+            try:
+                embedding = encode_texts([probe["text"]])[0]
+            except Exception as e:
+                # Still cached for exact repeats, just not for similar questions
+                print(f"Chat cache embedding failed: {e}")
+                with self._lock:
+                    self._errors += 1
+        with self._lock:
+            self._entries[probe["key"]] = {"reply": reply, "created": time.time(), "embedding": embedding}
+            self._entries.move_to_end(probe["key"])
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._semantic_hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self._max_entries,
+                "ttl_seconds": self._ttl,
+                "similarity_threshold": self.similarity,
+                "hits": self._hits,
+                "semantic_hits": self._semantic_hits,
+                "misses": self._misses,
+                "expired": self._expired,
+                "errors": self._errors,
+                "hit_ratio": round((self._hits + self._semantic_hits) / lookups, 4) if lookups else 0.0,
+                "avg_lookup_ms": round(self._lookup_total / lookups * 1000, 3) if lookups else 0.0,
+            }
+
+
+chat_cache = ChatResponseCache(
+    max_entries=CHAT_CACHE_SIZE,
+    ttl_seconds=CHAT_CACHE_TTL_SECONDS,
+    similarity=CHAT_CACHE_SIMILARITY,
+    namespace="user_chat",
+)
+register_stats("chat_cache", chat_cache.stats)
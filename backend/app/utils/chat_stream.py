@@ -0,0 +1,58 @@
+import json
+
+# Everything str.splitlines() treats as a line boundary
+_LINE_BREAKS = frozenset("\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+
+def format_reply(text):
+    """Chat reply layout: a line break after every sentence, lines stripped, blank lines dropped."""
+    text = text.replace(". ", ".\n")  # New line after numbered points
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+class ReplyFormatter:
+    """
+    Applies format_reply() to a reply that arrives in pieces. feed() returns the formatted text
+    that is final so far; whitespace that may still turn out to end a line is held back.
+    "".join of all feed() outputs plus finish() equals format_reply() of the whole text.
+    """
+
+    def __init__(self):
+        self._after_dot = False
+        self._line_has_text = False
+        self._pending_space = ""
+        self._need_break = False
+
+    def feed(self, text):
+        out = []
+        for ch in text:
+            is_break = ch in _LINE_BREAKS or (ch == " " and self._after_dot)
+            self._after_dot = ch == "."
+            if is_break:
+                if self._line_has_text:
+                    self._need_break = True
+                self._line_has_text = False
+                self._pending_space = ""
+            elif ch.isspace():
+                if self._line_has_text:
+                    self._pending_space += ch
+            else:
+                if self._need_break:
+                    out.append("\n")
+                    self._need_break = False
+                out.append(self._pending_space)
+                self._pending_space = ""
+                out.append(ch)
+                self._line_has_text = True
+        return "".join(out)
+
+    def finish(self):
+        # Trailing whitespace and blank lines are dropped, so nothing is left to emit
+        return ""
+
+
+def sse_event(data, event=None, event_id=None):
+    """One Server-Sent Events frame with a JSON payload; event_id is what a reconnect resumes from."""
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    frame += f"event: {event}\n" if event else ""
+    return f"{frame}data: {json.dumps(data)}\n\n"
@@ -1,7 +1,22 @@
-from PIL import Image
-import io
-import torch
-from transformers import CLIPProcessor, CLIPModel
+import os
+import threading
+import time
+import numpy as np
+from app.utils.model_registry import register_model, get_model
+from app.utils.batcher import MicroBatcher
+from app.utils.image_preprocess import open_downsized
+from app.utils.metrics import register_stats
+from app.utils import INSTANCE_DIR
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+TEXT_EMBEDDING_CACHE = os.path.join(INSTANCE_DIR, "clip_text_embeddings.npz")
+
+PEST_BATCH_SIZE = int(os.getenv("PEST_BATCH_SIZE", 8))
+PEST_BATCH_WAIT_MS = float(os.getenv("PEST_BATCH_WAIT_MS", 15))
+PEST_PREDICT_TIMEOUT = float(os.getenv("PEST_PREDICT_TIMEOUT", 30))
+TORCH_NUM_THREADS = os.getenv("TORCH_NUM_THREADS")
+# torch (default), onnx, or onnx-int8; the ONNX variants come from app.utils.clip_onnx
+PEST_MODEL_BACKEND = os.getenv("PEST_MODEL_BACKEND", "torch")
 
 # Define pest categories
 pest_labels = [
@@ -15,33 +30,193 @@ pest_labels = [
 ]
 prompt_texts = [f"A photo of a {label}" for label in pest_labels]
 
-# Lazy-loaded global variables
-_model = None
-_processor = None
+def _load_clip():
+    import torch
+    from transformers import CLIPProcessor, CLIPModel
+    if TORCH_NUM_THREADS:
+        torch.set_num_threads(int(TORCH_NUM_THREADS))
+    model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).to("cpu")
+    model.eval()
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    return model, processor
+
+register_model("clip", _load_clip)
 
 def load_clip():
-    global _model, _processor
-    if _model is None or _processor is None:
-        _model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to("cpu")
-        _processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    return get_model("clip")
 
-def predict_pest_from_image(image_bytes):
+def _load_clip_processor():
+    from transformers import CLIPProcessor
+    return CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+
+# The ONNX backends only need the preprocessing half of the pipeline
+register_model("clip_processor", _load_clip_processor)
+
+
+class PromptEmbeddings:
     """
-    Predict pest type from image bytes using CLIP.
-    Returns: (predicted_label, confidence)
+    Normalised CLIP text embeddings for the prompt texts, computed once and kept on disk.
+    Cached prompts are never re-encoded; only prompts added to pest_labels are.
     """
-    load_clip()  # Load model only when needed
 
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    inputs = _processor(text=prompt_texts, images=image, return_tensors="pt", padding=True)
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._by_prompt = {}
+        self._matrix = None
+        self._prompts = None
+        self._loaded_from_disk = False
+
+    def matrix(self, prompts):
+        """(len(prompts), dim) float32 matrix in the same order as `prompts`."""
+        if self._prompts == list(prompts):
+            return self._matrix
+        with self._lock:
+            if self._prompts != list(prompts):
+                self._refresh(list(prompts))
+        return self._matrix
+
+    def _refresh(self, prompts):
+        if not self._loaded_from_disk:
+            self._by_prompt.update(self._read())
+            self._loaded_from_disk = True
 
+        missing = [p for p in prompts if p not in self._by_prompt]
+        if missing:
+            for prompt, vector in zip(missing, self._encode(missing)):
+                self._by_prompt[prompt] = vector
+            self._write()
+
+        self._matrix = np.vstack([self._by_prompt[p] for p in prompts]).astype(np.float32)
+        self._prompts = prompts
+
+    def _encode(self, prompts):
+        import torch
+        model, processor = load_clip()
+        inputs = processor(text=prompts, return_tensors="pt", padding=True)
+        with torch.no_grad():
+            features = model.get_text_features(**inputs)
+        features = features / features.norm(dim=-1, keepdim=True)
+        return features.cpu().numpy()
+
+    def _read(self):
+        try:
+            with np.load(self._path, allow_pickle=False) as data:
+                if str(data["model"]) != CLIP_MODEL_NAME:
+                    return {}
+                return dict(zip(data["prompts"].tolist(), data["embeddings"]))
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _write(self):
+        prompts = list(self._by_prompt)
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            tmp = self._path + ".tmp.npz"
+            np.savez(
+                tmp,
+                model=np.array(CLIP_MODEL_NAME),
+                prompts=np.array(prompts),
+                embeddings=np.vstack([self._by_prompt[p] for p in prompts]).astype(np.float32),
+            )
+            os.replace(tmp, self._path)
+        except OSError as e:
+            print(f"Could not persist CLIP prompt embeddings: {e}")
+
+
+prompt_embeddings = PromptEmbeddings(TEXT_EMBEDDING_CACHE)
+register_model("clip_prompts", lambda: prompt_embeddings.matrix(prompt_texts))  # so warm-up covers it
+
+
+def _torch_image_embeddings(images):
+    import torch
+    model, processor = load_clip()
+    inputs = processor(images=images, return_tensors="pt")
     with torch.no_grad():
-        outputs = _model(**inputs)
-        logits = outputs.logits_per_image
-        probs = logits.softmax(dim=1)
+        features = model.get_image_features(**inputs)
+    return features.cpu().numpy(), float(model.logit_scale.exp())
+
+
+def image_embeddings(images, backend=None):
+    """Normalised image embeddings and the logit scale for the selected backend."""
+    backend = backend or PEST_MODEL_BACKEND
+    if backend == "torch":
+        features, logit_scale = _torch_image_embeddings(images)
+    elif backend in ("onnx", "onnx-int8"):
+        from app.utils.clip_onnx import onnx_image_embeddings
+        features, logit_scale = onnx_image_embeddings(images, quantized=backend == "onnx-int8")
+    else:
+        raise ValueError(f"Unknown PEST_MODEL_BACKEND: {backend}")
+    features = features / np.linalg.norm(features, axis=-1, keepdims=True)
+    return features.astype(np.float32), logit_scale
 
-    top_prob, top_idx = probs[0].topk(1)
-    predicted_label = pest_labels[top_idx.item()]
-    confidence = float(top_prob.item())
 
-    return predicted_label, confidence
+def classify_images(images, backend=None):
+    """
+    Run only the CLIP vision tower on a list of PIL images and score them against the
+    cached prompt embeddings. Returns a list of (predicted_label, confidence).
+    """
+    text_embeddings = prompt_embeddings.matrix(prompt_texts)
+    features, logit_scale = image_embeddings(images, backend)
+
+    # Same scaling CLIPModel applies to logits_per_image
+    logits = logit_scale * features @ text_embeddings.T
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=1, keepdims=True)
+
+    top_idx = probs.argmax(axis=1)
+    return [
+        (pest_labels[i], float(probs[row, i]))
+        for row, i in enumerate(top_idx)
+    ]
+
+# All CLIP forward passes go through this single worker thread, so concurrent uploads
+# share one batched pass instead of competing for cores.
+pest_batcher = MicroBatcher(
+    classify_images,
+    max_batch_size=PEST_BATCH_SIZE,
+    max_wait_ms=PEST_BATCH_WAIT_MS,
+    name="pest-inference"
+)
+
+_decode_lock = threading.Lock()
+_decode_count = 0
+_decode_total = 0.0
+
+
+def _record_decode(seconds):
+    global _decode_count, _decode_total
+    with _decode_lock:
+        _decode_count += 1
+        _decode_total += seconds
+
+
+def pest_inference_stats():
+    stats = pest_batcher.stats()
+    with _decode_lock:
+        stats["avg_decode_ms"] = round(_decode_total / _decode_count * 1000, 3) if _decode_count else 0.0
+    return stats
+
+
+register_stats("pest_inference", pest_inference_stats)
+
+def load_image(source):
+    """Decode bytes or a binary file object, reduced to roughly the resolution CLIP uses."""
+    started = time.perf_counter()
+    image = open_downsized(source)
+    _record_decode(time.perf_counter() - started)
+    return image
+
+def predict_pest_from_pil(image):
+    return pest_batcher(image, timeout=PEST_PREDICT_TIMEOUT)
+
+def predict_pest_from_image(image_bytes):
+    """
+    Predict pest type from image bytes using CLIP.
+    Returns: (predicted_label, confidence)
+    """
+    return predict_pest_from_pil(load_image(image_bytes))
+
+if PEST_MODEL_BACKEND != "torch":
+    import app.utils.clip_onnx  # registers the ONNX sessions so MODEL_WARMUP can load them
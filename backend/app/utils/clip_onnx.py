@@ -0,0 +1,167 @@
+"""
+ONNX Runtime backend for the CLIP pest classifier.
+
+Only the vision tower is exported; prompt embeddings come from the cache in clip_model.
+Export once, then select the backend with PEST_MODEL_BACKEND=onnx or onnx-int8:
+
+    python -m app.utils.clip_onnx export
+    python -m app.utils.clip_onnx parity path/to/fixture/images
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from PIL import Image
+from app.utils import INSTANCE_DIR
+from app.utils.model_registry import register_model, get_model
+from app.utils.clip_model import (
+    CLIP_MODEL_NAME, load_clip, prompt_embeddings, prompt_texts, classify_images
+)
+
+ONNX_DIR = os.getenv("CLIP_ONNX_DIR", os.path.join(INSTANCE_DIR, "clip_onnx"))
+FP32_PATH = os.path.join(ONNX_DIR, "clip_vision.onnx")
+INT8_PATH = os.path.join(ONNX_DIR, "clip_vision.int8.onnx")
+META_PATH = os.path.join(ONNX_DIR, "clip_vision.json")
+ORT_NUM_THREADS = os.getenv("ORT_NUM_THREADS")
+
+
+def export_vision_model(quantize=True):
+    """Export CLIP's image tower to ONNX (and a dynamic int8 copy) from the PyTorch weights."""
+    import torch
+
+    model, _ = load_clip()
+
+    class VisionTower(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            return self.clip.get_image_features(pixel_values=pixel_values)
+
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    dummy = torch.zeros(1, 3, 224, 224)
+    torch.onnx.export(
+        VisionTower(model).eval(),
+        (dummy,),
+        FP32_PATH,
+        input_names=["pixel_values"],
+        output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=17,
+    )
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(FP32_PATH, INT8_PATH, weight_type=QuantType.QInt8)
+
+    with open(META_PATH, "w") as f:
+        json.dump({"model": CLIP_MODEL_NAME, "logit_scale": float(model.logit_scale.exp())}, f)
+
+    # Fill the prompt cache now so ONNX workers never need the PyTorch model
+    prompt_embeddings.matrix(prompt_texts)
+
+
+def _load_session(path):
+    import onnxruntime as ort
+
+    if not os.path.exists(path) or not os.path.exists(META_PATH):
+        raise FileNotFoundError(f"{path} not found; run `python -m app.utils.clip_onnx export` first")
+    with open(META_PATH) as f:
+        meta = json.load(f)
+    if meta.get("model") != CLIP_MODEL_NAME:
+        raise ValueError(f"{path} was exported from {meta.get('model')}, expected {CLIP_MODEL_NAME}")
+
+    options = ort.SessionOptions()
+    if ORT_NUM_THREADS:
+        options.intra_op_num_threads = int(ORT_NUM_THREADS)
+    session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+    return session, meta["logit_scale"]
+
+
+register_model("clip_onnx", lambda: _load_session(FP32_PATH))
+register_model("clip_onnx_int8", lambda: _load_session(INT8_PATH))
+
+
+def onnx_image_embeddings(images, quantized=False):
+    session, logit_scale = get_model("clip_onnx_int8" if quantized else "clip_onnx")
+    processor = get_model("clip_processor")
+    pixel_values = processor(images=images, return_tensors="np")["pixel_values"]
+    (features,) = session.run(["image_embeds"], {"pixel_values": pixel_values.astype("float32")})
+    return features, logit_scale
+
+
+def compare_backends(image_paths, backends=("onnx", "onnx-int8"), reference="torch"):
+    """
+    Classify each fixture image with the reference and candidate backends.
+    Returns per-backend top-1 agreement, worst confidence drift and mean latency.
+    """
+    images = [Image.open(p).convert("RGB") for p in image_paths]
+    report = {}
+    baseline = None
+    for backend in (reference, *backends):
+        classify_images(images[:1], backend)  # load + warm up outside the timing
+        started = time.perf_counter()
+        results = [classify_images([img], backend)[0] for img in images]
+        elapsed_ms = (time.perf_counter() - started) * 1000 / max(len(images), 1)
+
+        entry = {"mean_latency_ms": round(elapsed_ms, 2), "results": results}
+        if baseline is None:
+            baseline = results
+        else:
+            mismatches = [
+                os.path.basename(path)
+                for path, (label, _), (ref_label, _) in zip(image_paths, results, baseline)
+                if label != ref_label
+            ]
+            drift = [abs(conf - ref_conf) for (_, conf), (_, ref_conf) in zip(results, baseline)]
+            entry.update({
+                "top1_agreement": round(1 - len(mismatches) / max(len(images), 1), 4),
+                "mismatches": mismatches,
+                "max_confidence_drift": round(max(drift, default=0.0), 4),
+            })
+        report[backend] = entry
+    return report
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.utils.clip_onnx")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="export the vision tower to ONNX")
+    export.add_argument("--no-int8", action="store_true", help="skip the dynamic int8 copy")
+
+    parity = sub.add_parser("parity", help="compare ONNX backends against PyTorch on fixture images")
+    parity.add_argument("image_dir")
+    parity.add_argument("--max-drift", type=float, default=0.05)
+    parity.add_argument("--backends", default="onnx,onnx-int8")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        export_vision_model(quantize=not args.no_int8)
+        print(f"Exported to {ONNX_DIR}")
+        return 0
+
+    paths = sorted(
+        os.path.join(args.image_dir, name) for name in os.listdir(args.image_dir)
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+    )
+    if not paths:
+        print(f"No images found in {args.image_dir}")
+        return 1
+    report = compare_backends(paths, backends=tuple(args.backends.split(",")))
+
+    failed = False
+    for backend, entry in report.items():
+        line = f"{backend:>10}: {entry['mean_latency_ms']} ms/image"
+        if "top1_agreement" in entry:
+            line += f", top-1 agreement {entry['top1_agreement']:.2%}, max drift {entry['max_confidence_drift']}"
+            if entry["mismatches"] or entry["max_confidence_drift"] > args.max_drift:
+                failed = True
+                line += "  FAIL " + ", ".join(entry["mismatches"])
+        print(line)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
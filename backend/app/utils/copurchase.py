@@ -0,0 +1,214 @@
+"""
+Item-item co-purchase model for the store recommender, built from every shopper's orders.
+
+Each (user, product) pair carries the implicit order-status rating (delivered 5, shipped 3,
+anything else 1). Items are compared by cosine similarity of their rating columns. The model
+stores the co-occurrence dot products as a sparse matrix, so an order status change only
+touches the rows of the products that user bought and nothing is refitted.
+"""
+import threading
+import numpy as np
+from scipy import sparse
+
+RATING_SCALE = (1, 5)
+NEIGHBOURS = 40  # k most similar rated items used per prediction, as KNNBasic did
+COMPACT_AFTER = 5000  # pending pair updates folded into the CSR matrix past this
+
+
+class CoPurchaseModel:
+
+    def __init__(self, ratings=(), k=NEIGHBOURS):
+        self.k = k
+        self.revision = 0
+        self._lock = threading.RLock()
+        self._user_items = {}
+        for user_id, product_id, rating in ratings:
+            items = self._user_items.setdefault(int(user_id), {})
+            items[int(product_id)] = max(rating, items.get(int(product_id), 0))
+
+        self._item_ids = sorted({pid for items in self._user_items.values() for pid in items})
+        self._item_pos = {pid: i for i, pid in enumerate(self._item_ids)}
+        self._sq_norms = np.zeros(len(self._item_ids))
+        self._rating_sum = 0.0
+        self._rating_count = 0
+        # Symmetric dot products between item columns; pair updates since the last
+        # compaction live in _pending as {pos: {pos: delta}}
+        self._pending = {}
+        self._pending_count = 0
+        self._rows_cache = None
+
+        rows, cols, vals = [], [], []
+        for items in self._user_items.values():
+            pos = np.array([self._item_pos[pid] for pid in items], dtype=np.int64)
+            r = np.array(list(items.values()), dtype=np.float64)
+            rows.append(np.repeat(pos, len(pos)))
+            cols.append(np.tile(pos, len(pos)))
+            vals.append(np.outer(r, r).ravel())
+            self._rating_sum += r.sum()
+            self._rating_count += len(r)
+        size = len(self._item_ids)
+        if rows:
+            self._dot = sparse.coo_matrix(
+                (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(size, size)
+            ).tocsr()
+            self._sq_norms = self._dot.diagonal().astype(np.float64)
+        else:
+            self._dot = sparse.csr_matrix((size, size))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_rows_cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    # -- updates ------------------------------------------------------------
+
+    def set_rating(self, user_id, product_id, rating):
+        """Record the user's current rating for a product; None removes the pair."""
+        user_id, product_id = int(user_id), int(product_id)
+        with self._lock:
+            items = self._user_items.get(user_id, {})
+            old = items.get(product_id, 0)
+            new = float(rating) if rating else 0.0
+            if old == new:
+                return False
+            self._user_items[user_id] = items
+            if new:
+                items[product_id] = new
+            else:
+                items.pop(product_id, None)
+
+            i = self._position(product_id)
+            delta = new - old
+            for other, r in items.items():
+                j = self._position(other)
+                if j == i:
+                    continue
+                self._add_pending(i, j, delta * r)
+                self._add_pending(j, i, delta * r)
+            self._add_pending(i, i, new * new - old * old)
+            self._sq_norms[i] += new * new - old * old
+            self._rating_sum += delta
+            self._rating_count += (new > 0) - (old > 0)
+            self.revision += 1
+            if self._pending_count > COMPACT_AFTER:
+                self._compact()
+            return True
+
+    def _position(self, product_id):
+        pos = self._item_pos.get(product_id)
+        if pos is None:
+            pos = len(self._item_ids)
+            self._item_ids.append(product_id)
+            self._item_pos[product_id] = pos
+            self._sq_norms = np.append(self._sq_norms, 0.0)
+        return pos
+
+    def _add_pending(self, i, j, value):
+        row = self._pending.setdefault(i, {})
+        if j not in row:
+            self._pending_count += 1
+        row[j] = row.get(j, 0.0) + value
+
+    def _compact(self):
+        size = len(self._item_ids)
+        dot = self._dot.tocoo()
+        rows, cols, vals = [dot.row], [dot.col], [dot.data]
+        for i, row in self._pending.items():
+            rows.append(np.full(len(row), i))
+            cols.append(np.fromiter(row.keys(), dtype=np.int64, count=len(row)))
+            vals.append(np.fromiter(row.values(), dtype=np.float64, count=len(row)))
+        self._dot = sparse.coo_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(size, size)
+        ).tocsr()
+        self._dot.eliminate_zeros()
+        self._pending = {}
+        self._pending_count = 0
+
+    # -- serving ------------------------------------------------------------
+
+    def _dot_columns(self, cols):
+        """Dense (n_items, len(cols)) slice of the dot-product matrix including pending updates."""
+        trained = self._dot.shape[0]
+        block = np.zeros((len(self._item_ids), len(cols)))
+        in_matrix = [c for c, j in enumerate(cols) if j < trained]
+        if in_matrix:
+            # symmetric, so rows are columns
+            block[:trained, in_matrix] = self._dot[[cols[c] for c in in_matrix]].toarray().T
+        for c, j in enumerate(cols):
+            for i, value in self._pending.get(j, {}).items():
+                block[i, c] += value
+        return block
+
+    def similarities(self, cols):
+        block = self._dot_columns(cols)
+        norms = np.sqrt(np.maximum(self._sq_norms, 0.0))
+        denom = np.outer(norms, norms[cols])
+        return np.divide(block, denom, out=np.zeros_like(block), where=denom > 0)
+
+    def _rows_for(self, product_ids):
+        # The same catalog array is passed on every request; positions only ever get appended
+        cached = self._rows_cache
+        if cached is not None and cached[0] is product_ids and cached[1] == len(self._item_ids):
+            return cached[2]
+        rows = np.array([self._item_pos.get(int(pid), -1) for pid in product_ids], dtype=np.int64)
+        self._rows_cache = (product_ids, len(self._item_ids), rows)
+        return rows
+
+    def similar_items(self, product_id, k=10):
+        """The k products most often bought together with product_id, as [(product_id, similarity)]."""
+        with self._lock:
+            pos = self._item_pos.get(int(product_id))
+            if pos is None:
+                return []
+            sims = self.similarities([pos])[:, 0]
+            sims[pos] = 0.0
+            top = np.argsort(-sims, kind="stable")[:k]
+            return [(self._item_ids[i], float(sims[i])) for i in top if sims[i] > 0]
+
+    def scores(self, user_id, product_ids):
+        """
+        Predicted rating / 5 for each product: the similarity-weighted mean of the user's own
+        ratings over the k most similar products they bought. Falls back to the global mean
+        rating for unknown users and products nobody has bought together with theirs.
+        """
+        low, high = RATING_SCALE
+        with self._lock:
+            global_mean = self._rating_sum / self._rating_count if self._rating_count else 0.0
+            est = np.full(len(product_ids), global_mean, dtype=np.float64)
+            items = self._user_items.get(int(user_id))
+            if not items:
+                return np.clip(est, low, high) / 5
+
+            cols = [self._item_pos[pid] for pid in items]
+            ratings = np.array(list(items.values()), dtype=np.float64)
+            rows = self._rows_for(product_ids)
+            known = np.flatnonzero(rows >= 0)
+            if not len(known):
+                return np.clip(est, low, high) / 5
+            sims = self.similarities(cols)[rows[known]]
+
+        if sims.shape[1] > self.k:
+            top = np.argsort(-sims, axis=1, kind="stable")[:, :self.k]
+            kept = np.zeros_like(sims)
+            np.put_along_axis(kept, top, np.take_along_axis(sims, top, axis=1), axis=1)
+            sims = kept
+        sims = np.where(sims > 0, sims, 0.0)
+        sum_sim = sims.sum(axis=1)
+        ok = sum_sim > 0
+        est[known[ok]] = (sims @ ratings)[ok] / sum_sim[ok]
+        return np.clip(est, low, high) / 5
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._user_items),
+                "items": len(self._item_ids),
+                "pairs": int(self._dot.nnz),
+                "pending_pairs": self._pending_count,
+                "revision": self.revision,
+            }
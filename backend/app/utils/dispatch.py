@@ -0,0 +1,430 @@
+"""
+Distance-aware technician dispatch.
+
+A job blocks a technician for the whole day, so each technician's route is their sequence
+of jobs across days: where they worked last and where they are due next. A candidate is
+scored by the kilometres the new job adds to that sequence,
+
+    haversine(prev, job) + haversine(job, next) - haversine(prev, next),
+
+computed for all candidates at once over NumPy coordinate arrays. book_service takes the
+DISPATCH_POOL least recently used free technicians and assigns the nearest of them, which
+keeps the rotation fair while cutting travel.
+
+optimize_day() reassigns the technicians already booked on a day (tomorrow by default)
+among that day's bookings with the same start time so the total added distance is
+minimal:
+
+    python -m app.utils.dispatch optimize [--date 2031-01-15] [--apply]
+    python -m app.utils.dispatch bench [N ...]
+"""
+import argparse
+import bisect
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from app.db import create_connection
+from app.utils.metrics import register_stats
+from app.utils.notification_hub import notification_hub
+
+# How many least-recently-used free technicians are ranked by distance (0 = plain rotation)
+DISPATCH_POOL = int(os.getenv("DISPATCH_POOL", 10))
+DISPATCH_HISTORY_DAYS = int(os.getenv("DISPATCH_HISTORY_DAYS", 30))
+DISPATCH_REFRESH_SECONDS = float(os.getenv("DISPATCH_REFRESH_SECONDS", 300))
+# Days with more assignments than this are optimised in geographic cells of this size
+DISPATCH_CELL_SIZE = int(os.getenv("DISPATCH_CELL_SIZE", 200))
+EARTH_RADIUS_KM = 6371.0088
+OPEN_STATUSES = ("pending", "confirmed")
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km; arguments broadcast like NumPy arrays."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def added_km(prev_lat, prev_lng, next_lat, next_lng, lat, lng):
+    """
+    Detour of inserting the job (lat, lng) between prev and next; arguments broadcast. NaN
+    coordinates mean no job on that side, and a technician with no known jobs costs 0.
+    """
+    to_job = np.nan_to_num(haversine_km(prev_lat, prev_lng, lat, lng))
+    from_job = np.nan_to_num(haversine_km(lat, lng, next_lat, next_lng))
+    skipped = np.nan_to_num(haversine_km(prev_lat, prev_lng, next_lat, next_lng))
+    return to_job + from_job - skipped
+
+
+class _Route:
+    __slots__ = ("days", "lats", "lngs", "bookings")
+
+    def __init__(self):
+        self.days, self.lats, self.lngs, self.bookings = [], [], [], []
+
+    def add(self, day, lat, lng, booking_id):
+        if booking_id in self.bookings:
+            return
+        i = bisect.bisect_right(self.days, day)
+        self.days.insert(i, day)
+        self.lats.insert(i, lat)
+        self.lngs.insert(i, lng)
+        self.bookings.insert(i, booking_id)
+
+    def around(self, day):
+        """(prev lat, prev lng, next lat, next lng) of the jobs before and after `day`, NaN if none."""
+        lo = bisect.bisect_left(self.days, day)
+        hi = bisect.bisect_right(self.days, day)
+        prev = (self.lats[lo - 1], self.lngs[lo - 1]) if lo > 0 else (np.nan, np.nan)
+        nxt = (self.lats[hi], self.lngs[hi]) if hi < len(self.days) else (np.nan, np.nan)
+        return prev + nxt
+
+
+class DispatchIndex:
+    """Per-technician job sequences (day, coordinates), loaded from bookings and kept current."""
+
+    def __init__(self, refresh_seconds=DISPATCH_REFRESH_SECONDS):
+        self._refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._loaded_at = None
+        self._rankings = 0
+        self._ranking_total = 0.0
+        self._km_saved = 0.0
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self._refresh_seconds:
+            return
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"Dispatch index reload failed: {e}")
+            with self._lock:
+                self._loaded_at = time.monotonic()
+
+    def reload(self):
+        conn = create_connection()
+        if conn is None:
+            raise RuntimeError("Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT bt.technician_id, b.booking_id, b.booking_date, b.location_lat, b.location_lng
+                FROM bookings b
+                JOIN booking_technicians bt ON b.booking_id = bt.booking_id
+                WHERE b.booking_date >= CURDATE() - INTERVAL %s DAY AND b.status != 'cancelled'
+            """, (DISPATCH_HISTORY_DAYS,))
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        routes = {}
+        for tid, booking_id, booking_date, lat, lng in rows:
+            routes.setdefault(tid, _Route()).add(booking_date.toordinal(), float(lat), float(lng), booking_id)
+        with self._lock:
+            self._routes = routes
+            self._loaded_at = time.monotonic()
+
+    def record_job(self, technician_id, booking_id, booking_date, lat, lng):
+        with self._lock:
+            self._routes.setdefault(int(technician_id), _Route()).add(
+                booking_date.toordinal(), float(lat), float(lng), booking_id
+            )
+
+    def neighbours(self, technician_ids, day):
+        """Arrays (prev_lat, prev_lng, next_lat, next_lng) for the technicians around `day`."""
+        with self._lock:
+            empty = (np.nan,) * 4
+            rows = [self._routes[t].around(day) if t in self._routes else empty for t in technician_ids]
+        return np.array(rows, dtype=np.float64).reshape(-1, 4).T
+
+    def rank(self, technician_ids, booking_date, lat, lng):
+        """technician_ids reordered by added km for a job at (lat, lng); ties keep the given order."""
+        if len(technician_ids) < 2:
+            return list(technician_ids)
+        self._ensure_loaded()
+        started = time.perf_counter()
+        cost = added_km(*self.neighbours(technician_ids, booking_date.toordinal()), float(lat), float(lng))
+        order = np.argsort(cost, kind="stable")
+        with self._lock:
+            self._rankings += 1
+            self._ranking_total += time.perf_counter() - started
+            self._km_saved += float(cost[0] - cost[order[0]])
+        return [technician_ids[i] for i in order]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "technicians": len(self._routes),
+                "jobs": sum(len(r.days) for r in self._routes.values()),
+                "pool": DISPATCH_POOL,
+                "rankings": self._rankings,
+                "avg_ranking_us": round(self._ranking_total / self._rankings * 1e6, 2) if self._rankings else 0.0,
+                "km_saved_vs_rotation": round(self._km_saved, 1),
+            }
+
+
+dispatch_index = DispatchIndex()
+register_stats("dispatch", dispatch_index.stats)
+
+
+def _spatial_cells(lats, lngs, size, first_axis):
+    """Slot indices split recursively at the median of the wider coordinate into cells of <= size."""
+    coords = (lats, lngs)
+    cells, stack = [], [(np.arange(len(lats)), first_axis)]
+    while stack:
+        idx, axis = stack.pop()
+        if len(idx) <= size:
+            cells.append(idx)
+            continue
+        if axis is None:
+            axis = int(np.ptp(lngs[idx]) > np.ptp(lats[idx]))
+        idx = idx[np.argsort(coords[axis][idx], kind="stable")]
+        half = len(idx) // 2
+        stack += [(idx[:half], None), (idx[half:], None)]
+    return cells
+
+
+def _morton(lats, lngs):
+    """Z-order key of each coordinate, so nearby points get nearby keys."""
+    def spread(v):
+        v = v.astype(np.uint64)
+        for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+            v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+        return v
+
+    def quantize(v, lo, hi):
+        return np.clip((v - lo) / max(hi - lo, 1e-9) * 65535, 0, 65535)
+
+    return spread(quantize(lats, -90.0, 90.0)) | (spread(quantize(lngs, -180.0, 180.0)) << np.uint64(1))
+
+
+def _solve_cell(assignment, slots, techs, neighbours, lats, lngs):
+    cost = added_km(*(a[techs][:, None] for a in neighbours), lats[slots][None, :], lngs[slots][None, :])
+    tech_rows, slot_cols = linear_sum_assignment(cost)
+    assignment[slots[slot_cols]] = techs[tech_rows]
+
+
+def plan_assignment(slot_coords, neighbours, cell_size=DISPATCH_CELL_SIZE, passes=2):
+    """
+    Technician per slot minimising the total added km, where technician i currently holds
+    slot i. slot_coords is (lat array, lng array) with one slot per technician a booking
+    needs; neighbours are the technicians' route arrays around the day.
+
+    Up to cell_size slots are solved exactly (Hungarian method on the full cost matrix).
+    Larger days are decomposed: slots (by job location) and technicians (by the midpoint of
+    their previous and next jobs) are both ordered along a Z-order curve and matched cell by
+    cell, then `passes` rounds re-solve geographic cells of slots among the technicians they
+    hold, alternating the split axis so technicians can cross earlier cell borders. The
+    result is never worse than the current assignment.
+    Returns (technician index per slot, added km per slot).
+    """
+    lats, lngs = slot_coords
+    n = len(lats)
+    current = np.arange(n)
+    if n <= cell_size:
+        assignment = current.copy()
+        _solve_cell(assignment, current, current, neighbours, lats, lngs)
+        return assignment, added_km(*(a[assignment] for a in neighbours), lats, lngs)
+
+    prev_lat, prev_lng, next_lat, next_lng = neighbours
+    with np.errstate(invalid="ignore"):
+        anchor_lat = np.nan_to_num(np.nanmean(np.stack((prev_lat, next_lat)), axis=0), nan=0.0)
+        anchor_lng = np.nan_to_num(np.nanmean(np.stack((prev_lng, next_lng)), axis=0), nan=0.0)
+    slot_order = np.argsort(_morton(lats, lngs), kind="stable")
+    tech_order = np.argsort(_morton(anchor_lat, anchor_lng), kind="stable")
+    assignment = np.empty(n, dtype=np.int64)
+    for start in range(0, n, cell_size):
+        slots, techs = slot_order[start:start + cell_size], tech_order[start:start + cell_size]
+        assignment[slots] = techs
+        _solve_cell(assignment, slots, techs, neighbours, lats, lngs)
+
+    for pass_no in range(passes):
+        for cell in _spatial_cells(lats, lngs, cell_size, first_axis=pass_no % 2):
+            _solve_cell(assignment, cell, assignment[cell].copy(), neighbours, lats, lngs)
+
+    cost = added_km(*(a[assignment] for a in neighbours), lats, lngs)
+    before = added_km(*neighbours, lats, lngs)
+    if cost.sum() > before.sum():
+        return current, before
+    return assignment, cost
+
+
+def optimize_day(day=None, apply=False):
+    """
+    Reassign the technicians booked on `day` among that day's open bookings to minimise the
+    total added distance. Technicians are only swapped between bookings with the same start
+    time: a job blocks the 24 hours from its booking_date, so any other move would shift the
+    technician's job window onto their next day's job or leave. Their technician_unavailable
+    rows therefore stay valid as they are. With apply=True the moves are written in one
+    transaction and the moved technicians are notified.
+    """
+    day = day or date.today() + timedelta(days=1)
+    started = time.perf_counter()
+    conn = create_connection()
+    if conn is None:
+        raise RuntimeError("Database connection failed")
+    try:
+        cursor = conn.cursor()
+        placeholders = ", ".join(["%s"] * len(OPEN_STATUSES))
+        cursor.execute(f"""
+            SELECT bt.id, bt.booking_id, bt.technician_id, b.booking_date, b.location_lat, b.location_lng
+            FROM booking_technicians bt
+            JOIN bookings b ON bt.booking_id = b.booking_id
+            WHERE b.booking_date >= %s AND b.booking_date < %s AND b.status IN ({placeholders})
+            ORDER BY bt.id
+            {"FOR UPDATE" if apply else ""}
+        """, (day, day + timedelta(days=1), *OPEN_STATUSES))
+        slots = cursor.fetchall()
+        if not slots:
+            conn.rollback()
+            return {"date": day.isoformat(), "assignments": 0, "moves": [], "km_before": 0.0, "km_after": 0.0}
+
+        dispatch_index._ensure_loaded()
+        technician_ids = [row[2] for row in slots]
+        lats = np.array([float(row[4]) for row in slots])
+        lngs = np.array([float(row[5]) for row in slots])
+        neighbours = dispatch_index.neighbours(technician_ids, day.toordinal())
+        before = added_km(*neighbours, lats, lngs)
+        assignment, after = np.arange(len(slots)), before.copy()
+        start_groups = {}
+        for slot, row in enumerate(slots):
+            start_groups.setdefault(row[3], []).append(slot)
+        for group in start_groups.values():
+            if len(group) < 2:
+                continue
+            group = np.array(group)
+            local, cost = plan_assignment((lats[group], lngs[group]), tuple(a[group] for a in neighbours))
+            assignment[group] = group[local]
+            after[group] = cost
+
+        # Technicians who stay on the same booking keep their slot; the rest fill the freed ones
+        slots_by_booking, new_by_booking = {}, {}
+        for slot, tech_index in enumerate(assignment):
+            slots_by_booking.setdefault(slots[slot][1], []).append(slot)
+            new_by_booking.setdefault(slots[slot][1], []).append(int(tech_index))
+        moves = []
+        for booking_id, incoming in new_by_booking.items():
+            booking_slots = slots_by_booking[booking_id]
+            staying = set(incoming) & set(booking_slots)
+            arriving = iter(i for i in incoming if i not in staying)
+            for slot in booking_slots:
+                if slot in staying:
+                    continue
+                tech_index = next(arriving)
+                row_id, _, old_tid, booking_date, _, _ = slots[slot]
+                moves.append({
+                    "assignment_id": row_id,
+                    "booking_id": booking_id,
+                    "from_technician": old_tid,
+                    "to_technician": technician_ids[tech_index],
+                    "booking_date": booking_date,
+                })
+
+        if apply and moves:
+            cursor.executemany(
+                "UPDATE booking_technicians SET technician_id = %s WHERE id = %s",
+                [(m["to_technician"], m["assignment_id"]) for m in moves],
+            )
+            cursor.executemany("""
+                INSERT INTO notifications (user_id, user_type, message, created_at)
+                VALUES (%s, 'technician', %s, NOW())
+            """, [
+                (m["to_technician"], f"Your job on {day.isoformat()} was moved to booking #{m['booking_id']} to shorten your route.")
+                for m in moves
+            ])
+            conn.commit()
+            dispatch_index.reload()
+            notification_hub.nudge()
+        else:
+            conn.rollback()
+        cursor.close()
+    finally:
+        conn.close()
+
+    for m in moves:
+        m["booking_date"] = m["booking_date"].isoformat()
+    return {
+        "date": day.isoformat(),
+        "assignments": len(slots),
+        "moves": moves,
+        "applied": bool(apply and moves),
+        "km_before": round(float(before.sum()), 2),
+        "km_after": round(float(after.sum()), 2),
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+
+def benchmark(sizes=(1000, 5000), seed=0):
+    """Ranking and day-optimisation latency on synthetic routes around Kochi, one job per technician that day."""
+    rng = np.random.default_rng(seed)
+    results = []
+    for jobs in sizes:
+        index = DispatchIndex(refresh_seconds=float("inf"))
+        index._loaded_at = time.monotonic()
+        day = date.today().toordinal()
+        # Each technician works around a home area; today's jobs fall near random technicians' areas
+        homes = np.column_stack((9.93 + rng.normal(0, 0.3, jobs), 76.26 + rng.normal(0, 0.3, jobs)))
+        for tid in range(jobs):
+            for offset in (-2, -1, 1, 2):
+                lat, lng = homes[tid] + rng.normal(0, 0.03, 2)
+                index.record_job(tid, (tid, offset), date.fromordinal(day + offset), lat, lng)
+        ids = list(range(jobs))
+
+        started = time.perf_counter()
+        for _ in range(100):
+            index.rank(ids[:DISPATCH_POOL], date.fromordinal(day), 9.93, 76.26)
+        rank_us = (time.perf_counter() - started) / 100 * 1e6
+
+        lats, lngs = (homes[rng.permutation(jobs)] + rng.normal(0, 0.03, (jobs, 2))).T
+        started = time.perf_counter()
+        neighbours = index.neighbours(ids, day)
+        before = added_km(*neighbours, lats, lngs)
+        _, after = plan_assignment((lats, lngs), neighbours)
+        optimize_ms = (time.perf_counter() - started) * 1000
+        row = {
+            "jobs": jobs,
+            "rank_us": round(rank_us, 1),
+            "optimize_ms": round(optimize_ms, 1),
+            "km_before": round(float(before.sum()), 1),
+            "km_after": round(float(after.sum()), 1),
+        }
+        if jobs <= 2000:
+            _, exact = plan_assignment((lats, lngs), neighbours, cell_size=jobs)
+            row["km_exact"] = round(float(exact.sum()), 1)
+        results.append(row)
+    return results
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.utils.dispatch")
+    commands = parser.add_subparsers(dest="command", required=True)
+    optimize = commands.add_parser("optimize", help="reassign a day's technicians to shorten routes")
+    optimize.add_argument("--date", type=date.fromisoformat, help="YYYY-MM-DD, default tomorrow")
+    optimize.add_argument("--apply", action="store_true", help="write the new assignment (default: dry run)")
+    bench = commands.add_parser("bench", help="time ranking and optimisation on synthetic data")
+    bench.add_argument("sizes", type=int, nargs="*")
+    args = parser.parse_args(argv)
+
+    if args.command == "optimize":
+        plan = optimize_day(args.date, apply=args.apply)
+        print(
+            f"{plan['date']}: {plan['assignments']} assignments, {len(plan['moves'])} moves, "
+            f"{plan['km_before']} km -> {plan['km_after']} km added travel"
+            + (" (applied)" if plan.get("applied") else " (dry run)")
+        )
+    else:
+        for row in benchmark(tuple(args.sizes) or (1000, 5000)):
+            print(
+                f"{row['jobs']:>6} jobs: rank {row['rank_us']} us, optimise {row['optimize_ms']} ms, "
+                f"{row['km_before']} km -> {row['km_after']} km"
+                + (f" (exact {row['km_exact']} km)" if "km_exact" in row else "")
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -1,22 +1,355 @@
-from groq import Groq
 from dotenv import load_dotenv
+import functools
 import os
+import threading
+import time
+from collections import deque
+from app.utils.metrics import register_stats
 
 load_dotenv()
 
 api_key=os.getenv("GROQ_API_KEY")
+# Point at a local stub (python -m app.utils.groq_stub) to exercise the client offline
+base_url=os.getenv("GROQ_BASE_URL")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+# Total time a caller may spend on one completion, retries and queueing included
+GROQ_DEADLINE_SECONDS = float(os.getenv("GROQ_DEADLINE_SECONDS", 30))
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", 5))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", 1))
+# In-flight requests per worker process; callers wait at most GROQ_QUEUE_SECONDS for a slot
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", 8))
+GROQ_QUEUE_SECONDS = float(os.getenv("GROQ_QUEUE_SECONDS", 2))
+GROQ_BREAKER_FAILURES = int(os.getenv("GROQ_BREAKER_FAILURES", 5))
+GROQ_BREAKER_RESET_SECONDS = float(os.getenv("GROQ_BREAKER_RESET_SECONDS", 30))
 
-client = Groq(
-    api_key=api_key,
-)
+
+class LLMUnavailable(Exception):
+    """The provider is failing, too slow or saturated; callers should answer 503."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures and rejects calls for
+    `reset_seconds`. Then a single trial call is let through (half-open): success closes
+    the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._opened_count = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self._reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        """End a half-open trial that neither succeeded nor failed (e.g. the caller gave up)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self._failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    self._opened_count += 1
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state(),
+                "consecutive_failures": self._failures,
+                "times_opened": self._opened_count,
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def _transport_errors():
+    errors = [TimeoutError, ConnectionError]
+    try:
+        import httpx
+        errors.append(httpx.TransportError)  # connect/read/write errors and timeouts
+    except ImportError:
+        pass
+    try:
+        import groq
+        errors.append(groq.APIConnectionError)  # includes APITimeoutError
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def _is_upstream_fault(error):
+    # 429 and 5xx mean the provider is struggling; other 4xx are our own bad requests.
+    # Without a status only timeouts and connection errors count: a TypeError or KeyError
+    # in our code says nothing about the provider and must not trip the breaker.
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, _transport_errors())
+
+
+class GroqClient:
+    """One pooled Groq client per process with deadlines, bounded concurrency and a circuit breaker."""
+
+    def __init__(self, model=GROQ_MODEL, deadline=GROQ_DEADLINE_SECONDS, max_retries=GROQ_MAX_RETRIES,
+                 max_concurrency=GROQ_MAX_CONCURRENCY, queue_seconds=GROQ_QUEUE_SECONDS,
+                 breaker=None, client_factory=None):
+        self.model = model
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.queue_seconds = queue_seconds
+        self.breaker = breaker or CircuitBreaker(GROQ_BREAKER_FAILURES, GROQ_BREAKER_RESET_SECONDS)
+        self._client_factory = client_factory or self._default_client
+        self._client = None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+        self._latencies = deque(maxlen=500)
+        self._first_token_latencies = deque(maxlen=500)
+        self._in_flight = 0
+        self._calls = 0
+        self._failures = 0
+        self._timeouts = 0
+        self._rejected_open = 0
+        self._rejected_busy = 0
+        self._retries = 0
+        self._cancelled = 0
+        self._prompt_tokens = 0
+        self._completion_tokens = 0
+
+    def _default_client(self):
+        import httpx
+        from groq import Groq
+
+        # Keep-alive pool sized to the concurrency limit so TLS connections are reused
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            timeout=httpx.Timeout(self.deadline, connect=GROQ_CONNECT_TIMEOUT),
+        )
+        return Groq(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        return self._client
+
+    def complete(self, messages, deadline=None, **kwargs):
+        """Chat completion bounded by `deadline` seconds; raises LLMUnavailable when it can't be served."""
+        started = time.monotonic()
+        expires = started + (deadline or self.deadline)
+        self._admit(expires)
+        try:
+            completion = self._create_with_retries(messages, expires, kwargs)
+            self.breaker.record_success()
+            self._record_call(started, getattr(completion, "usage", None))
+            return completion
+        finally:
+            self._release()
+
+    def stream(self, messages, deadline=None, **kwargs):
+        """
+        Yield content deltas of a streamed completion. Closing the generator (the client went
+        away) closes the upstream response and frees the slot. Failures before the first chunk
+        are retried; once text has been yielded an error ends the stream with LLMUnavailable.
+        """
+        started = time.monotonic()
+        expires = started + (deadline or self.deadline)
+        self._admit(expires)
+        chunks = None
+        usage = None
+        first_token = None
+        try:
+            chunks = self._create_with_retries(messages, expires, dict(kwargs, stream=True))
+            for chunk in chunks:
+                if time.monotonic() > expires:
+                    raise TimeoutError("LLM deadline exceeded")
+                # Groq reports usage on the last chunk under x_groq
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                    yield delta
+        except GeneratorExit:
+            with self._lock:
+                self._cancelled += 1
+            if first_token is None:
+                self.breaker.release()
+            else:
+                self.breaker.record_success()
+            raise
+        except LLMUnavailable:
+            raise
+        except Exception as e:
+            self._record_failure(e)
+            raise LLMUnavailable(f"LLM stream failed: {e}") from e
+        else:
+            self.breaker.record_success()
+            self._record_call(started, usage, first_token)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+            self._release()
+
+    def _admit(self, expires):
+        # Fail fast while open, before queueing for a slot
+        if self.breaker.state == "open":
+            self._reject_open()
+        if not self._slots.acquire(timeout=min(self.queue_seconds, max(expires - time.monotonic(), 0))):
+            with self._lock:
+                self._rejected_busy += 1
+            raise LLMUnavailable("Too many concurrent LLM requests")
+        if not self.breaker.allow():
+            self._slots.release()
+            self._reject_open()
+        with self._lock:
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _reject_open(self):
+        with self._lock:
+            self._rejected_open += 1
+        raise LLMUnavailable("LLM provider circuit is open")
+
+    def _create_with_retries(self, messages, expires, kwargs):
+        attempt = 0
+        while True:
+            remaining = expires - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise TimeoutError("LLM deadline exceeded")
+                return self.client().chat.completions.create(
+                    messages=messages, model=self.model, timeout=remaining, **kwargs
+                )
+            except Exception as e:
+                if not _is_upstream_fault(e):
+                    if getattr(e, "status_code", None) is not None:
+                        self.breaker.record_success()  # the provider answered; the request was bad
+                        with self._lock:
+                            self._failures += 1
+                    else:
+                        self._record_failure(e)
+                    raise
+                backoff = 0.25 * 2 ** attempt
+                if attempt < self.max_retries and expires - time.monotonic() > backoff:
+                    attempt += 1
+                    with self._lock:
+                        self._retries += 1
+                    time.sleep(backoff)
+                    continue
+                self._record_failure(e)
+                raise LLMUnavailable(f"LLM request failed: {e}") from e
+
+    def _record_failure(self, error):
+        timed_out = isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower()
+        if _is_upstream_fault(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()  # a local bug; end a half-open trial without a verdict
+        with self._lock:
+            self._failures += 1
+            self._timeouts += timed_out
+
+    def _record_call(self, started, usage, first_token=None):
+        with self._lock:
+            self._calls += 1
+            self._latencies.append(time.monotonic() - started)
+            if first_token is not None:
+                self._first_token_latencies.append(first_token)
+            if usage is not None:
+                self._prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+                self._completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            first_tokens = sorted(self._first_token_latencies)
+            pick = lambda values, q: (
+                round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 1) if values else None
+            )
+            return {
+                "model": self.model,
+                "breaker": self.breaker.stats(),
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "calls": self._calls,
+                "failures": self._failures,
+                "timeouts": self._timeouts,
+                "retries": self._retries,
+                "rejected_circuit_open": self._rejected_open,
+                "rejected_busy": self._rejected_busy,
+                "streams_cancelled": self._cancelled,
+                "latency_p50_ms": pick(latencies, 0.5),
+                "latency_p95_ms": pick(latencies, 0.95),
+                "first_token_p50_ms": pick(first_tokens, 0.5),
+                "first_token_p95_ms": pick(first_tokens, 0.95),
+                "prompt_tokens": self._prompt_tokens,
+                "completion_tokens": self._completion_tokens,
+            }
+
+
+groq_client = GroqClient()
+register_stats("groq", groq_client.stats)
+
+
+def get_client():
+    return groq_client.client()
 
 def CreateMessage(user_message,system_prompt):
 
-    chat_completion = client.chat.completions.create(
+    chat_completion = groq_client.complete(
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message},
         ],
-        model="llama-3.3-70b-versatile",
     )
     return chat_completion.choices[0].message
+
+def StreamMessage(user_message,system_prompt):
+    """Like CreateMessage, but yields the reply text as it is generated."""
+    return groq_client.stream(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message},
+        ],
+    )
@@ -0,0 +1,127 @@
+"""
+Local stand-in for the Groq chat completions API, for exercising GroqClient offline.
+
+    python -m app.utils.groq_stub --port 8089 --delay 0.5 --fail-rate 0.2
+    GROQ_BASE_URL=http://127.0.0.1:8089 GROQ_API_KEY=stub flask run
+
+Replies echo the last user message, streamed word by word for stream=true requests.
+--delay, --fail-rate and --status simulate a slow or degraded provider so timeouts, retries
+and the circuit breaker can be observed in /admin/metrics.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(delay=0.0, fail_rate=0.0, fail_status=503, token_delay=0.02):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._send(404, {"error": {"message": f"no route {self.path}"}})
+            time.sleep(delay)
+            if random.random() < fail_rate:
+                return self._send(fail_status, {"error": {"message": "stub failure", "type": "server_error"}})
+
+            request = json.loads(body or b"{}")
+            user_text = next(
+                (m["content"] for m in reversed(request.get("messages", [])) if m.get("role") == "user"), ""
+            )
+            reply = f"Stub reply to: {user_text}. It is streamed word by word when asked to."
+            prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(reply.split()),
+                "total_tokens": prompt_tokens + len(reply.split()),
+            }
+            if request.get("stream"):
+                return self._stream(request.get("model", "stub"), reply, usage)
+            self._send(200, {
+                "id": f"stub-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        def _stream(self, model, reply, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            words = reply.split(" ")
+            try:
+                for i, word in enumerate(words):
+                    time.sleep(token_delay)
+                    chunk = {
+                        "id": "stub-stream",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"content": word if i == 0 else " " + word},
+                            "finish_reason": None,
+                        }],
+                    }
+                    self._chunk(f"data: {json.dumps(chunk)}\n\n")
+                final = {
+                    "id": "stub-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "x_groq": {"usage": usage},
+                }
+                self._chunk(f"data: {json.dumps(final)}\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self._chunk("")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client cancelled
+
+        def _chunk(self, text):
+            data = text.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def run_stub(port=8089, delay=0.0, fail_rate=0.0, fail_status=503, token_delay=0.02, background=False):
+    """Start the stub on 127.0.0.1:port. With background=True returns the server after starting it in a thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(delay, fail_rate, fail_status, token_delay))
+    if background:
+        threading.Thread(target=server.serve_forever, name="groq-stub", daemon=True).start()
+        return server
+    print(f"Groq stub listening on http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.utils.groq_stub")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each reply")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--status", type=int, default=503, help="HTTP status of failed requests")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed words")
+    args = parser.parse_args()
+    run_stub(args.port, args.delay, args.fail_rate, args.status, args.token_delay)
@@ -0,0 +1,78 @@
+"""
+Decode uploads straight to the size CLIP needs instead of full resolution.
+
+CLIPProcessor resizes the short side to 224px anyway, so a 12MP phone photo only has to be
+decoded at a fraction of its size. For JPEGs Image.thumbnail() asks the decoder for a DCT
+scaled draft, which skips most of the decode work.
+
+    python -m app.utils.image_preprocess path/to/photo.jpg
+"""
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from PIL import Image
+
+# Short side kept after reduction; CLIP crops 224px, the margin keeps the resize filter sharp
+PEST_IMAGE_SHORT_SIDE = int(os.getenv("PEST_IMAGE_SHORT_SIDE", 448))
+
+
+def open_downsized(source, short_side=PEST_IMAGE_SHORT_SIDE):
+    """Open bytes or a binary file object and return an RGB image whose short side is <= short_side."""
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    image = Image.open(fp)
+    width, height = image.size
+    scale = short_side / min(width, height)
+    if scale < 1:
+        image.thumbnail((max(1, round(width * scale)), max(1, round(height * scale))), Image.BICUBIC)
+    return image.convert("RGB")
+
+
+def open_full(source):
+    """The previous behaviour: decode and convert at full resolution."""
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    return Image.open(fp).convert("RGB")
+
+
+def _measure(variant, path, repeat):
+    loader = open_downsized if variant == "downsized" else open_full
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            image = loader(f)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "variant": variant,
+        "size": list(image.size),
+        "median_ms": round(sorted(timings)[len(timings) // 2], 2),
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def benchmark(path, repeat=5):
+    """Run each variant in a fresh interpreter so peak RSS is not shared between them."""
+    results = []
+    for variant in ("full", "downsized"):
+        out = subprocess.run(
+            [sys.executable, "-m", "app.utils.image_preprocess", "--child", variant, path, str(repeat)],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        )
+        results.append(json.loads(out.stdout))
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        print(json.dumps(_measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+        sys.exit(0)
+    if len(sys.argv) < 2:
+        print("usage: python -m app.utils.image_preprocess IMAGE [REPEAT]")
+        sys.exit(1)
+    for row in benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 5):
+        print(f"{row['variant']:>10}: {row['median_ms']:>8} ms  peak RSS {row['peak_rss_mb']:>7} MB  -> {row['size']}")
@@ -0,0 +1,139 @@
+"""
+Overlap checks for technician_unavailable (leaves and job blocks).
+
+Two closed intervals overlap exactly when each starts no later than the other ends:
+
+    start_datetime <= :end AND end_datetime >= :start
+
+With the (technician_id, start_datetime, end_datetime) index this is one equality plus one
+range, and the end bound is checked inside the index. Batches (several leave requests, a
+roster import) are read with one query and checked with a sweep over intervals sorted by
+start, so rows are compared only with the ones still open at their start.
+"""
+import heapq
+from datetime import datetime
+
+# Rejected leave requests never made anyone unavailable
+BLOCKING_SQL = "status != 'rejected'"
+OVERLAP_SQL = "start_datetime <= %s AND end_datetime >= %s"
+# Leave requests, as opposed to the 'job' rows bookings write; reason is nullable
+LEAVE_SQL = "(reason IS NULL OR reason != 'job')"
+
+
+class IntervalError(ValueError):
+    pass
+
+
+def parse_datetime(value):
+    """Accept datetimes, 'YYYY-MM-DD HH:MM[:SS]' and the browser's 'YYYY-MM-DDTHH:MM'."""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).strip().replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        raise IntervalError(f"Invalid datetime: {value!r}")
+
+
+def normalize_interval(start, end):
+    start, end = parse_datetime(start), parse_datetime(end)
+    if end < start:
+        raise IntervalError("End time must not be before start time")
+    return start, end
+
+
+def find_conflict(cursor, technician_id, start, end, exclude_id=None):
+    """First blocking row of the technician overlapping [start, end] as (id, reason), or None."""
+    exclude_sql = "AND id != %s" if exclude_id is not None else ""
+    params = [technician_id, end, start] + ([exclude_id] if exclude_id is not None else [])
+    cursor.execute(f"""
+        SELECT id, reason FROM technician_unavailable
+        WHERE technician_id = %s AND {OVERLAP_SQL} AND {BLOCKING_SQL} {exclude_sql}
+        ORDER BY start_datetime
+        LIMIT 1
+    """, params)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return (row["id"], row["reason"]) if isinstance(row, dict) else (row[0], row[1])
+
+
+def sweep_overlaps(intervals):
+    """
+    All overlapping pairs among [(key, group, start, end)], where only intervals of the same
+    group (technician) can overlap. Sorted by start, each interval is compared only with those
+    whose end has not passed yet. Returns [(key_a, key_b)] with a starting first.
+    """
+    pairs = []
+    ordered = sorted(intervals, key=lambda iv: (iv[1], iv[2], iv[3]))
+    group, active = object(), []  # min-heap of (end, seq, key) open at the current start
+    for seq, (key, item_group, start, end) in enumerate(ordered):
+        if item_group != group:
+            group, active = item_group, []
+        while active and active[0][0] < start:
+            heapq.heappop(active)
+        pairs.extend((other, key) for _, _, other in active)
+        heapq.heappush(active, (end, seq, key))
+    return pairs
+
+
+def load_blocking(cursor, technician_ids, start, end):
+    """Blocking rows of the technicians overlapping [start, end], in one query."""
+    placeholders = ", ".join(["%s"] * len(technician_ids))
+    cursor.execute(f"""
+        SELECT id, technician_id, start_datetime, end_datetime, reason
+        FROM technician_unavailable
+        WHERE technician_id IN ({placeholders}) AND {OVERLAP_SQL} AND {BLOCKING_SQL}
+    """, (*technician_ids, end, start))
+    rows = cursor.fetchall()
+    if rows and not isinstance(rows[0], dict):
+        rows = [dict(zip(("id", "technician_id", "start_datetime", "end_datetime", "reason"), r)) for r in rows]
+    return rows
+
+
+def validate_leaves(cursor, leaves):
+    """
+    Check many leave requests [{technician_id, start_datetime, end_datetime, ...}] against
+    each other and the stored rows. Returns one result per request, in order:
+    {"index", "ok", "error"?, "conflicts": [{"id"|"index", "reason"}]}.
+    """
+    results, intervals = [], []
+    for i, leave in enumerate(leaves):
+        result = {"index": i, "ok": True, "conflicts": []}
+        results.append(result)
+        try:
+            technician_id = int(leave["technician_id"])
+            start, end = normalize_interval(leave["start_datetime"], leave["end_datetime"])
+        except (KeyError, TypeError, ValueError) as e:
+            result.update(ok=False, error=str(e) if isinstance(e, IntervalError) else f"Invalid leave: {e}")
+            continue
+        intervals.append((("new", i), technician_id, start, end))
+
+    if not intervals:
+        return results
+    existing = load_blocking(
+        cursor,
+        sorted({iv[1] for iv in intervals}),
+        min(iv[2] for iv in intervals),
+        max(iv[3] for iv in intervals),
+    )
+    reasons = {("old", row["id"]): row["reason"] for row in existing}
+    intervals += [(("old", row["id"]), row["technician_id"], row["start_datetime"], row["end_datetime"])
+                  for row in existing]
+
+    for a, b in sweep_overlaps(intervals):
+        for mine, other in ((a, b), (b, a)):
+            if mine[0] != "new":
+                continue
+            result = results[mine[1]]
+            result["ok"] = False
+            if other[0] == "old":
+                result["conflicts"].append({"id": other[1], "reason": reasons[other]})
+            else:
+                result["conflicts"].append({"index": other[1], "reason": leaves[other[1]].get("reason")})
+    return results
+
+
+def conflict_message(reason):
+    if (reason or "").lower() == "job":
+        return "You have a job assigned during this time. Leave cannot be applied."
+    return "You already have a leave or unavailability during this time."
@@ -0,0 +1,265 @@
+"""
+In-process background jobs for long pipelines that should not hold an HTTP worker.
+
+submit() returns a job id straight away; one worker thread per process runs jobs in order.
+Every state change is written to INSTANCE_DIR/jobs/<id>.json, so a status poll answered by
+any worker (or after a restart) sees the same record. WeeklySchedule submits a job at a
+fixed weekday and time; a lock file and a last-run marker in the instance directory make
+sure only one of several workers fires each slot.
+"""
+import fcntl
+import json
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app.utils import INSTANCE_DIR
+from app.utils.metrics import register_stats
+
+JOBS_DIR = os.path.join(INSTANCE_DIR, "jobs")
+JOBS_KEEP_IN_MEMORY = int(os.getenv("JOBS_KEEP_IN_MEMORY", 100))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+_WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+class Job:
+    """Handle passed to the job function, for reporting finished steps while it runs."""
+
+    def __init__(self, runner, record):
+        self._runner = runner
+        self._record = record
+
+    @property
+    def id(self):
+        return self._record["id"]
+
+    def step(self, name, seconds, **info):
+        self._runner._update(self._record, steps=self._record["steps"] + [
+            {"name": name, "seconds": round(seconds, 3), **info}
+        ])
+
+
+class JobRunner:
+
+    def __init__(self, jobs_dir=JOBS_DIR, keep=JOBS_KEEP_IN_MEMORY):
+        self._dir = jobs_dir
+        self._keep = keep
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._jobs = OrderedDict()
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+
+    def submit(self, name, fn, trigger="manual", dedupe=True):
+        """
+        Queue fn(job) and return the job id. With dedupe set, a job of the same name that is
+        still queued or running in this process is returned instead of starting another.
+        """
+        self._ensure_started()
+        with self._lock:
+            if dedupe:
+                for record in reversed(self._jobs.values()):
+                    if record["name"] == name and record["status"] in (QUEUED, RUNNING):
+                        return record["id"]
+            record = {
+                "id": uuid.uuid4().hex,
+                "name": name,
+                "trigger": trigger,
+                "status": QUEUED,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "steps": [],
+                "result": None,
+                "error": None,
+            }
+            self._jobs[record["id"]] = record
+            while len(self._jobs) > self._keep:
+                self._jobs.popitem(last=False)
+            self._submitted += 1
+        self._save(record)
+        self._queue.put((record, fn))
+        return record["id"]
+
+    def get(self, job_id):
+        """The job record as a dict, or None for an unknown id."""
+        if not _JOB_ID.match(job_id or ""):
+            return None
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is not None:
+                return dict(record)
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def recent(self, name=None, limit=20):
+        """Latest job records on disk, newest first."""
+        try:
+            files = [f for f in os.listdir(self._dir) if f.endswith(".json")]
+        except OSError:
+            return []
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self._dir, f)), reverse=True)
+        records = []
+        for f in files:
+            record = self.get(f[:-len(".json")])
+            if record and (name is None or record["name"] == name):
+                records.append(record)
+                if len(records) == limit:
+                    break
+        return records
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            record, fn = self._queue.get()
+            self._update(record, status=RUNNING, started_at=time.time())
+            try:
+                result = fn(Job(self, record))
+            except Exception as e:
+                traceback.print_exc()
+                self._update(record, status=FAILED, finished_at=time.time(), error=str(e))
+                with self._lock:
+                    self._failed += 1
+            else:
+                self._update(record, status=SUCCEEDED, finished_at=time.time(), result=result)
+                with self._lock:
+                    self._succeeded += 1
+
+    def _update(self, record, **changes):
+        with self._lock:
+            record.update(changes)
+        self._save(record)
+
+    def _path(self, job_id):
+        return os.path.join(self._dir, f"{job_id}.json")
+
+    def _save(self, record):
+        with self._lock:
+            data = json.dumps(record, default=str)
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+            path = self._path(record["id"])
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not persist job {record['id']}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "submitted": self._submitted,
+                "succeeded": self._succeeded,
+                "failed": self._failed,
+                "queued": self._queue.qsize(),
+                "running": [r["name"] for r in self._jobs.values() if r["status"] == RUNNING],
+            }
+
+
+def parse_weekly(spec):
+    """'mon 09:00' -> (0, 9, 0). Raises ValueError for anything else."""
+    match = re.match(r"^\s*([a-z]{3})[a-z]*\s+(\d{1,2}):(\d{2})\s*$", spec.lower())
+    if not match or match.group(1) not in _WEEKDAYS:
+        raise ValueError(f"Expected a schedule like 'mon 09:00', got {spec!r}")
+    hour, minute = int(match.group(2)), int(match.group(3))
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Invalid time in schedule {spec!r}")
+    return _WEEKDAYS.index(match.group(1)), hour, minute
+
+
+def last_slot(weekday, hour, minute, now):
+    """The most recent weekday/hour:minute (local time) at or before `now`."""
+    slot = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    slot -= timedelta(days=(now.weekday() - weekday) % 7)
+    if slot > now:
+        slot -= timedelta(days=7)
+    return slot
+
+
+class WeeklySchedule:
+    """
+    Calls submit(trigger="schedule") once per weekly slot across all workers. A slot missed
+    while the app was down is run when it comes back; on a fresh instance directory the
+    current slot is only recorded, so a first deploy does not fire straight away.
+    """
+
+    def __init__(self, name, spec, submit, check_seconds=60, state_dir=JOBS_DIR):
+        self.name = name
+        self._slot = parse_weekly(spec)
+        self._submit = submit
+        self._check_seconds = check_seconds
+        self._marker = os.path.join(state_dir, f"{name}.last_slot")
+        self._lock_path = os.path.join(state_dir, f"{name}.lock")
+        self._thread = None
+        self.last_job_id = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=f"schedule-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Schedule {self.name} failed: {e}")
+            time.sleep(self._check_seconds)
+
+    def tick(self, now=None):
+        """Submit the job if the latest slot has not run yet. Returns the job id or None."""
+        slot = last_slot(*self._slot, now or datetime.now()).isoformat()
+        if self._read_marker() == slot:
+            return None
+        os.makedirs(os.path.dirname(self._marker), exist_ok=True)
+        with open(self._lock_path, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None  # another worker is handling it
+            previous = self._read_marker()
+            if previous == slot:
+                return None
+            self._write_marker(slot)
+            if previous is None:
+                return None
+            self.last_job_id = self._submit(trigger="schedule")
+            return self.last_job_id
+
+    def _read_marker(self):
+        try:
+            with open(self._marker) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _write_marker(self, slot):
+        tmp = f"{self._marker}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(slot)
+        os.replace(tmp, self._marker)
+
+
+job_runner = JobRunner()
+register_stats("jobs", job_runner.stats)
@@ -0,0 +1,23 @@
+import threading
+
+# name -> zero-arg callable returning a JSON-serialisable dict
+_providers = {}
+_lock = threading.Lock()
+
+
+def register_stats(name, provider):
+    with _lock:
+        _providers[name] = provider
+
+
+def collect_stats():
+    with _lock:
+        providers = dict(_providers)
+
+    stats = {}
+    for name, provider in providers.items():
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {"error": str(e)}
+    return stats
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from app.utils.metrics import register_stats
+
+
+class LazyModel:
+    """
+    Holds a loader and builds the model the first time it is asked for.
+    Concurrent first calls block on the same lock, so the model is only built once.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self.loaded = False
+        self.load_seconds = None
+        self.error = None
+
+    def get(self):
+        if self.loaded:
+            return self._value
+        with self._lock:
+            if not self.loaded:
+                started = time.perf_counter()
+                try:
+                    self._value = self._loader()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.load_seconds = round(time.perf_counter() - started, 3)
+                self.error = None
+                self.loaded = True
+        return self._value
+
+
+_models = {}
+
+
+def register_model(name, loader):
+    if name not in _models:
+        _models[name] = LazyModel(name, loader)
+    return _models[name]
+
+
+def get_model(name):
+    return _models[name].get()
+
+
+def warm_up(names=None, background=True):
+    """Load the named models (all registered ones when names is None), optionally off the request path."""
+    targets = list(_models.values()) if names is None else [_models[n] for n in names]
+
+    def _run():
+        for model in targets:
+            try:
+                model.get()
+            except Exception as e:
+                print(f"Model warm-up failed for {model.name}: {e}")
+
+    if not background:
+        _run()
+        return None
+    thread = threading.Thread(target=_run, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_up_from_env():
+    # MODEL_WARMUP=all or a comma separated list of model names, e.g. "clip,minilm"
+    setting = os.getenv("MODEL_WARMUP", "").strip()
+    if not setting:
+        return None
+    if setting == "all":
+        return warm_up()
+    names = [n.strip() for n in setting.split(",") if n.strip()]
+    unknown = [n for n in names if n not in _models]
+    if unknown:
+        print(f"MODEL_WARMUP: unknown models {', '.join(unknown)} (registered: {', '.join(sorted(_models))})")
+    known = [n for n in names if n in _models]
+    # Only unknown names means nothing to warm, not everything
+    return warm_up(known) if known else None
+
+
+def model_status():
+    return {
+        name: {"loaded": m.loaded, "load_seconds": m.load_seconds, "error": m.error}
+        for name, m in _models.items()
+    }
+
+
+register_stats("models", model_status)
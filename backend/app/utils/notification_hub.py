@@ -0,0 +1,310 @@
+"""
+Push delivery of notifications to open /notifications/stream connections.
+
+Most notification rows are written by MySQL triggers (new booking, assignment, OTP, low
+stock, leave status), so the database is the only place that sees all of them. Instead of
+every logged-in client polling, one tail thread per process reads the rows added since its
+last look with a primary-key range query and fans them out to the streams subscribed to
+each recipient: "admin" for admin rows, "<user_type>:<user_id>" for the rest.
+
+The fan-out goes through LocalPubSub, an in-process stand-in with the publish/subscribe
+shape of a Redis channel broker. Code that writes notifications calls nudge(); the tail
+thread then reads immediately instead of on its next NOTIFY_POLL_SECONDS tick, and the
+touch of NOTIFY_SIGNAL_PATH wakes the tail threads of other workers on the same host.
+The tail only queries while this process has subscribers.
+
+A stream resumes from the last event id it delivered (Last-Event-ID), so a reconnect or a
+subscriber that fell behind reads the gap from the table once and carries on from the hub.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from app.db import create_connection
+from app.utils import INSTANCE_DIR
+from app.utils.metrics import register_stats
+
+NOTIFY_POLL_SECONDS = float(os.getenv("NOTIFY_POLL_SECONDS", 2))
+NOTIFY_KEEPALIVE_SECONDS = float(os.getenv("NOTIFY_KEEPALIVE_SECONDS", 15))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", 100))
+NOTIFY_SIGNAL_PATH = os.getenv("NOTIFY_SIGNAL_PATH", os.path.join(INSTANCE_DIR, "notifications.signal"))
+# Auto-increment ids are handed out before commit, so a row can become visible after rows
+# with higher ids; the tail re-reads this many ids below its high-water mark
+NOTIFY_LOOKBACK_IDS = 50
+NOTIFY_TAIL_LIMIT = 500
+# How often the tail thread checks the signal file between polls
+_SIGNAL_CHECK_SECONDS = 0.25
+
+COLUMNS = "id, user_type, user_id, message, created_at, is_seen"
+# The stream was dropped from the hub for falling behind; re-read from the table
+OVERFLOW = object()
+
+
+def channel_for(user_type, user_id=None):
+    return "admin" if user_type == "admin" else f"{user_type}:{user_id}"
+
+
+def _row(row):
+    row = dict(row)
+    if row.get("created_at") is not None:
+        row["created_at"] = row["created_at"].isoformat()
+    row["is_seen"] = bool(row["is_seen"])
+    return row
+
+
+def unseen_after(cursor, user_type, user_id, after_id=0, limit=NOTIFY_TAIL_LIMIT):
+    """Unseen notifications of one recipient with id > after_id, oldest first."""
+    if user_type == "admin":
+        where, params = "user_type = 'admin'", []
+    else:
+        where, params = "user_type = %s AND user_id = %s", [user_type, user_id]
+    cursor.execute(f"""
+        SELECT {COLUMNS} FROM notifications
+        WHERE {where} AND is_seen = 0 AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (*params, after_id, limit))
+    return [_row(r) for r in cursor.fetchall()]
+
+
+class Subscription:
+
+    def __init__(self, pubsub, channel, maxsize):
+        self.channel = channel
+        self._pubsub = pubsub
+        self._queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, message):
+        if self.overflowed:
+            return False
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            # Drop everything queued and tell the reader to resync from the table
+            self.overflowed = True
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            self._queue.put_nowait(OVERFLOW)
+            return False
+
+    def get(self, timeout=None):
+        """Next message, OVERFLOW, or None after `timeout` seconds without one."""
+        try:
+            message = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if message is OVERFLOW:
+            self.overflowed = False
+        return message
+
+    def close(self):
+        self._pubsub.unsubscribe(self)
+
+
+class LocalPubSub:
+    """In-process channel broker: publish() copies a message into every subscriber's queue."""
+
+    def __init__(self, queue_size=NOTIFY_QUEUE_SIZE):
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._channels = {}  # channel -> set of Subscription
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, channel):
+        sub = Subscription(self, channel, self._queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._channels.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._channels[sub.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subs = list(self._channels.get(channel, ()))
+        delivered = sum(sub.put(message) for sub in subs)
+        with self._lock:
+            self.published += 1
+            self.dropped += len(subs) - delivered
+        return delivered
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._channels.values())
+
+    def channel_count(self):
+        with self._lock:
+            return len(self._channels)
+
+
+class NotificationHub:
+
+    def __init__(self, poll_seconds=NOTIFY_POLL_SECONDS, signal_path=NOTIFY_SIGNAL_PATH):
+        self._poll_seconds = poll_seconds
+        self._signal_path = signal_path
+        self._pubsub = LocalPubSub()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_id = None  # high-water mark of the tail; None until the first subscriber
+        self._recent = deque(maxlen=NOTIFY_LOOKBACK_IDS * 4)  # ids published inside the lookback window
+        self._recent_set = set()
+        self._signal_mtime = self._read_signal()
+
+        self._polls = 0
+        self._rows = 0
+        self._poll_total = 0.0
+        self._last_error = None
+
+    # -- subscribers --------------------------------------------------------
+
+    def subscribe(self, user_type, user_id=None):
+        """
+        Subscribe to one recipient's new notifications. Rows that become visible after this
+        returns arrive through the subscription; read the ones before it from the table.
+        """
+        self._ensure_started()
+        with self._lock:
+            sub = self._pubsub.subscribe(channel_for(user_type, user_id))
+            if self._last_id is None:
+                try:
+                    self._last_id = self._max_id()
+                except Exception:
+                    sub.close()
+                    raise
+        self._wake.set()
+        return sub
+
+    def nudge(self):
+        """Read new rows now, here and (through the signal file) in the other workers."""
+        self._wake.set()
+        try:
+            os.makedirs(os.path.dirname(self._signal_path), exist_ok=True)
+            with open(self._signal_path, "a"):
+                os.utime(self._signal_path)
+        except OSError as e:
+            print(f"Notification signal failed: {e}")
+
+    # -- tail ---------------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notification-hub", daemon=True)
+                self._thread.start()
+
+    def _read_signal(self):
+        try:
+            return os.stat(self._signal_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _max_id(self):
+        conn = create_connection()
+        if conn is None:
+            raise RuntimeError("Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM notifications")
+            (max_id,) = cursor.fetchone()
+            cursor.close()
+            return max_id
+        finally:
+            conn.close()
+
+    def _run(self):
+        next_poll = 0.0
+        while True:
+            woken = self._wake.wait(_SIGNAL_CHECK_SECONDS)
+            self._wake.clear()
+            with self._lock:
+                idle = not self._pubsub.subscriber_count()
+                if idle:
+                    self._last_id = None  # the next subscriber starts from the table's end
+            if idle:
+                continue
+            signal = self._read_signal()
+            signalled = signal != self._signal_mtime
+            self._signal_mtime = signal
+            if woken or signalled or time.monotonic() >= next_poll:
+                self.poll()
+                next_poll = time.monotonic() + self._poll_seconds
+
+    def poll(self):
+        """Publish the rows added since the last poll; returns how many were new."""
+        with self._lock:
+            last_id = self._last_id
+        if last_id is None:
+            return 0
+        started = time.perf_counter()
+        conn = None
+        try:
+            conn = create_connection()
+            if conn is None:
+                raise RuntimeError("Database connection failed")
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT {COLUMNS} FROM notifications
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (max(last_id - NOTIFY_LOOKBACK_IDS, 0), NOTIFY_TAIL_LIMIT))
+            rows = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            with self._lock:
+                self._last_error = str(e)
+            print(f"Notification tail failed: {e}")
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+        # Rows marked seen before they were published need no push
+        new = [r for r in rows if r["id"] not in self._recent_set and not r["is_seen"]]
+        for row in new:
+            if len(self._recent) == self._recent.maxlen:
+                self._recent_set.discard(self._recent[0])
+            self._recent.append(row["id"])
+            self._recent_set.add(row["id"])
+            self._pubsub.publish(channel_for(row["user_type"], row["user_id"]), _row(row))
+        with self._lock:
+            if self._last_id is not None and rows:
+                self._last_id = max(self._last_id, rows[-1]["id"])
+            self._polls += 1
+            self._rows += len(new)
+            self._poll_total += time.perf_counter() - started
+            self._last_error = None
+        if len(rows) == NOTIFY_TAIL_LIMIT:
+            self._wake.set()  # more to read
+        return len(new)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "subscribers": self._pubsub.subscriber_count(),
+                "channels": self._pubsub.channel_count(),
+                "last_id": self._last_id,
+                "polls": self._polls,
+                "rows": self._rows,
+                "avg_poll_ms": round(self._poll_total / self._polls * 1000, 3) if self._polls else 0.0,
+                "published": self._pubsub.published,
+                "dropped": self._pubsub.dropped,
+                "last_error": self._last_error,
+            }
+
+
+notification_hub = NotificationHub()
+register_stats("notifications", notification_hub.stats)
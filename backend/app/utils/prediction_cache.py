@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from app.utils.clip_model import load_image, predict_pest_from_pil
+from app.utils.similiarity_checker import get_recommendations_for_pest, service_index
+from app.utils.metrics import register_stats
+
+MIN_CONFIDENCE = 0.40
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 1024))
+# Optional sqlite file so entries survive restarts and are shared between workers
+PREDICTION_CACHE_DB = os.getenv("PREDICTION_CACHE_DB")
+# Max Hamming distance between 64-bit dHashes to treat two uploads as the same photo; 0 disables
+PREDICTION_CACHE_PHASH_DISTANCE = int(os.getenv("PREDICTION_CACHE_PHASH_DISTANCE", 0))
+
+
+def content_key(source, chunk_size=64 * 1024):
+    """SHA-256 of bytes or of a seekable binary stream, read in chunks and rewound afterwards."""
+    if isinstance(source, (bytes, bytearray)):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def dhash(image, size=8):
+    """64-bit difference hash; survives re-encoding and resizing of the same photo."""
+    pixels = list(image.convert("L").resize((size + 1, size)).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class PredictionCache:
+    """
+    Bounded LRU of upload hash -> {pest_type, confidence, recommendations, catalog}.
+    `catalog` is the service index fingerprint the recommendations were computed against.
+    """
+
+    def __init__(self, max_entries=1024, db_path=None, phash_distance=0):
+        self._max_entries = max_entries
+        self._db_path = db_path
+        self.phash_distance = phash_distance
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._phash_hits = 0
+        self._misses = 0
+        self._stale = 0
+        if db_path:
+            self._init_db()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return dict(entry)
+        entry = self._db_get(key)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._remember(key, entry)
+        return dict(entry)
+
+    def find_similar(self, phash):
+        with self._lock:
+            for key, entry in reversed(self._entries.items()):
+                if entry.get("phash") is not None and bin(entry["phash"] ^ phash).count("1") <= self.phash_distance:
+                    self._entries.move_to_end(key)
+                    self._phash_hits += 1
+                    return dict(entry)
+        return None
+
+    def put(self, key, entry):
+        with self._lock:
+            self._remember(key, dict(entry))
+        self._db_put(key, entry)
+
+    def record_stale(self):
+        with self._lock:
+            self._stale += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._db_path:
+            with self._db() as db:
+                db.execute("DELETE FROM predictions")
+
+    def stats(self):
+        with self._lock:
+            # Perceptual hits are exact-hash misses that still avoided the model
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self._hits,
+                "phash_hits": self._phash_hits,
+                "misses": self._misses,
+                "stale_recommendations": self._stale,
+                "hit_ratio": round((self._hits + self._phash_hits) / lookups, 4) if lookups else 0.0,
+                "persistent": bool(self._db_path),
+            }
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _db(self):
+        return sqlite3.connect(self._db_path, timeout=5)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self._db_path)), exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, payload TEXT NOT NULL, used_at REAL NOT NULL)"
+            )
+
+    def _db_get(self, key):
+        if not self._db_path:
+            return None
+        try:
+            with self._db() as db:
+                row = db.execute("SELECT payload FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row:
+                    db.execute("UPDATE predictions SET used_at = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            print(f"Prediction cache read failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def _db_put(self, key, entry):
+        if not self._db_path:
+            return
+        try:
+            with self._db() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, payload, used_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(entry, default=str), time.time())
+                )
+                db.execute(
+                    "DELETE FROM predictions WHERE key NOT IN "
+                    "(SELECT key FROM predictions ORDER BY used_at DESC LIMIT ?)",
+                    (self._max_entries,)
+                )
+        except sqlite3.Error as e:
+            print(f"Prediction cache write failed: {e}")
+
+
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    db_path=PREDICTION_CACHE_DB,
+    phash_distance=PREDICTION_CACHE_PHASH_DISTANCE
+)
+register_stats("prediction_cache", prediction_cache.stats)
+
+
+def predict_pest_cached(upload):
+    """
+    (pest_type, confidence, recommendations) for an upload (bytes or a seekable stream), reusing earlier results for the
+    same bytes (or the same photo, when perceptual matching is on). Recommendations are
+    recomputed without touching CLIP when the services catalog changed since they were cached.
+    recommendations is None when confidence is below MIN_CONFIDENCE.
+    """
+    key = content_key(upload)
+    entry = prediction_cache.get(key)
+    changed = entry is None
+    image = None
+    phash = None
+
+    if entry is None and prediction_cache.phash_distance:
+        image = load_image(upload)
+        phash = dhash(image)
+        entry = prediction_cache.find_similar(phash)
+
+    if entry is None:
+        if image is None:
+            image = load_image(upload)
+        pest_type, confidence = predict_pest_from_pil(image)
+        entry = {
+            "pest_type": pest_type,
+            "confidence": confidence,
+            "recommendations": None,
+            "catalog": None,
+            "phash": phash,
+        }
+
+    if entry["confidence"] >= MIN_CONFIDENCE:
+        catalog = service_index.current_fingerprint()
+        if entry["recommendations"] is None or entry["catalog"] != catalog:
+            if entry["catalog"] is not None:
+                prediction_cache.record_stale()
+            entry["recommendations"] = get_recommendations_for_pest(entry["pest_type"])
+            entry["catalog"] = catalog
+            changed = True
+
+    if changed:
+        prediction_cache.put(key, entry)
+    return entry["pest_type"], entry["confidence"], entry["recommendations"]
@@ -0,0 +1,214 @@
+"""
+Guards for running LLM-written SELECTs from /admin/generate-report.
+
+The generated SQL is checked the same way the route always did, then:
+  * its EXPLAIN row estimate must stay under REPORT_MAX_EXAMINED_ROWS,
+  * it runs with a MAX_EXECUTION_TIME optimizer hint,
+  * the row count is capped with a LIMIT (one extra row tells us it was truncated),
+  * rows are read from an unbuffered cursor in chunks instead of fetchall().
+Validated SQL is cached per question so repeated questions skip the LLM.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from app.utils.metrics import register_stats
+
+REPORT_MAX_ROWS = int(os.getenv("REPORT_MAX_ROWS", 1000))
+REPORT_MAX_EXECUTION_MS = int(os.getenv("REPORT_MAX_EXECUTION_MS", 5000))
+REPORT_MAX_EXAMINED_ROWS = int(os.getenv("REPORT_MAX_EXAMINED_ROWS", 1_000_000))
+REPORT_SQL_CACHE_SIZE = int(os.getenv("REPORT_SQL_CACHE_SIZE", 256))
+REPORT_SQL_CACHE_TTL_SECONDS = int(os.getenv("REPORT_SQL_CACHE_TTL_SECONDS", 24 * 3600))
+REPORT_FETCH_SIZE = 500
+
+ALLOWED_TABLES = {
+    "bookings", "booking_technicians", "cart", "notifications", "payments",
+    "services", "store", "technicians", "technician_unavailable", "users"
+}
+UNSAFE_KEYWORDS = ["⚠️", "drop", "delete", "update", "insert", "--", "/*", "alter"]
+
+_TRAILING_LIMIT = re.compile(
+    r"\s+limit\s+(?:(\d+)\s*,\s*)?(\d+)(?:\s+offset\s+(\d+))?\s*$", re.IGNORECASE
+)
+
+
+class ReportQueryError(Exception):
+    """The generated SQL was rejected; `payload` and `status` are the route's response."""
+
+    def __init__(self, payload, status):
+        super().__init__(payload)
+        self.payload = payload
+        self.status = status
+
+
+def validate_sql(raw_sql):
+    """Extract the SELECT from the LLM output and apply the keyword and table checks."""
+    # Extract SELECT query from any text
+    match = re.search(r"(?i)select\s.+", raw_sql.strip(), re.DOTALL)
+    if not match:
+        raise ReportQueryError({'error': 'Only SELECT queries are allowed.'}, 500)
+
+    sql = match.group(0).strip()
+    sql_lower = sql.lower()
+
+    # Block unsafe keywords and patterns
+    if any(bad in sql_lower for bad in UNSAFE_KEYWORDS):
+        raise ReportQueryError({"message": "dangerous queries detected"}, 200)
+
+    # Strip trailing semicolon safely
+    sql = sql.rstrip(";").strip()
+    if ";" in sql:
+        raise ReportQueryError({'error': 'Only a single SELECT statement is allowed.'}, 500)
+
+    # Verify allowed tables only
+    used_tables = set(re.findall(r'from\s+(\w+)|join\s+(\w+)', sql_lower))
+    used_tables = {tbl for pair in used_tables for tbl in pair if tbl}
+    if not used_tables.intersection(ALLOWED_TABLES):
+        raise ReportQueryError({'error': 'SQL must be a SELECT query targeting allowed tables.'}, 500)
+    return sql
+
+
+def bounded_sql(sql, max_rows=REPORT_MAX_ROWS, max_execution_ms=REPORT_MAX_EXECUTION_MS):
+    """
+    Add the MAX_EXECUTION_TIME hint and cap the row count at max_rows + 1. An existing
+    trailing LIMIT is kept when it is already smaller.
+    """
+    sql = re.sub(r"(?i)^select\b", f"SELECT /*+ MAX_EXECUTION_TIME({int(max_execution_ms)}) */", sql, count=1)
+    match = _TRAILING_LIMIT.search(sql)
+    if match:
+        offset = match.group(1) or match.group(3)
+        count = min(int(match.group(2)), max_rows + 1)
+        sql = sql[:match.start()] + (f" LIMIT {count} OFFSET {offset}" if offset else f" LIMIT {count}")
+    else:
+        sql = f"{sql} LIMIT {max_rows + 1}"
+    return sql
+
+
+def estimate_examined_rows(cursor, sql):
+    """
+    Rows MySQL expects to examine: within each SELECT of the plan the tables are joined, so
+    their rows x filtered% multiply; separate SELECTs (subqueries, UNION parts) add up.
+    """
+    cursor.execute(f"EXPLAIN {sql}")
+    columns = [d[0].lower() for d in cursor.description]
+    per_select = {}
+    for values in cursor.fetchall():
+        row = dict(zip(columns, values))
+        rows = float(row.get("rows") or 1)
+        filtered = float(row.get("filtered") or 100) / 100
+        per_select[row.get("id")] = per_select.get(row.get("id"), 1.0) * max(rows * filtered, 1.0)
+    return int(sum(per_select.values()))
+
+
+def check_budget(cursor, sql, budget=REPORT_MAX_EXAMINED_ROWS):
+    estimate = estimate_examined_rows(cursor, sql)
+    if estimate > budget:
+        raise ReportQueryError({
+            'error': 'This report would scan too much data. Try narrowing the question (dates, status, a single user).',
+            'estimated_rows': estimate,
+        }, 422)
+    return estimate
+
+
+class RowStream:
+    """
+    Iterates the rows of `sql` as dicts, read from an unbuffered cursor in chunks and capped
+    at max_rows. After iteration `truncated` tells whether the query had more rows.
+    """
+
+    def __init__(self, cursor, sql, max_rows=REPORT_MAX_ROWS, fetch_size=REPORT_FETCH_SIZE):
+        self._cursor = cursor
+        self._max_rows = max_rows
+        self._fetch_size = fetch_size
+        self.count = 0
+        self.truncated = False
+        cursor.execute(sql)
+        self.columns = [d[0] for d in cursor.description]
+
+    def __iter__(self):
+        while True:
+            rows = self._cursor.fetchmany(self._fetch_size)
+            if not rows:
+                return
+            for row in rows:
+                if self.count == self._max_rows:
+                    self.truncated = True
+                    self._cursor.fetchall()  # drain the LIMIT's extra row so the connection is reusable
+                    return
+                self.count += 1
+                yield dict(zip(self.columns, row))
+
+
+def close_stream(cursor, conn):
+    """
+    Close a report cursor and hand its connection back, even mid-result (client gone, read
+    error). Unread rows are drained first; a connection that cannot be drained is discarded
+    from the pool instead of being reused with a result still pending.
+    """
+    try:
+        cursor.fetchall()
+        cursor.close()
+    except Exception as e:
+        print(f"Report cursor could not be drained, discarding the connection: {e}")
+        try:
+            conn.invalidate()
+        except Exception:
+            pass
+    finally:
+        conn.close()
+
+
+def _cache_key(question):
+    # Case and whitespace only: operators and digits ("> 1000" vs "< 1000") change the SQL
+    return " ".join(question.lower().split())
+
+
+class SqlCache:
+    """LRU of case- and whitespace-normalized question -> SQL that already passed validation, with a TTL."""
+
+    def __init__(self, max_entries=256, ttl_seconds=86400):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, question):
+        key = _cache_key(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self._ttl:
+                self._entries.pop(key, None)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, question, sql):
+        key = _cache_key(question)
+        with self._lock:
+            self._entries[key] = (time.time(), sql)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, question):
+        with self._lock:
+            self._entries.pop(_cache_key(question), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+report_sql_cache = SqlCache(REPORT_SQL_CACHE_SIZE, REPORT_SQL_CACHE_TTL_SECONDS)
+register_stats("report_sql_cache", report_sql_cache.stats)
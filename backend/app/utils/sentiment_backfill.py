@@ -0,0 +1,147 @@
+"""
+Re-score bookings.feedback with the current sentiment model.
+
+Rows are read in booking_id order with keyset pagination, scored in batches (optionally
+across a process pool) and written back one bulk UPDATE per batch. The last written
+booking_id is checkpointed after every chunk, so an interrupted run continues where it
+stopped:
+
+    python -m app.utils.sentiment_backfill                 # only rows still 'pending'
+    python -m app.utils.sentiment_backfill --all --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from app.db import create_connection
+from app.utils import INSTANCE_DIR
+from app.utils.sentiment_queue import PENDING, score_texts, write_labels
+
+CHECKPOINT_PATH = os.path.join(INSTANCE_DIR, "sentiment_backfill.json")
+
+
+def read_chunk(cursor, after_id, limit, only_pending):
+    pending_sql = "AND sentiment = %s" if only_pending else ""
+    params = [after_id, PENDING, limit] if only_pending else [after_id, limit]
+    cursor.execute(f"""
+        SELECT booking_id, feedback FROM bookings
+        WHERE booking_id > %s AND feedback != '' {pending_sql}
+        ORDER BY booking_id
+        LIMIT %s
+    """, params)
+    return cursor.fetchall()
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(path, state):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _batches(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+def backfill(only_pending=True, chunk_size=500, batch_size=64, workers=0,
+             checkpoint_path=CHECKPOINT_PATH, restart=False, log=print):
+    """Score every matching row after the checkpoint. Returns the final checkpoint state."""
+    mode = "pending" if only_pending else "all"
+    state = None if restart else load_checkpoint(checkpoint_path)
+    if state is None or state.get("mode") != mode or state.get("done"):
+        # Nothing to resume; a finished checkpoint starts a new pass
+        state = {"mode": mode, "last_id": 0, "rows": 0, "updated": 0, "seconds": 0.0}
+    else:
+        log(f"Resuming after booking_id {state['last_id']} ({state['rows']} rows already scored)")
+    state["done"] = False
+
+    pool = None
+    if workers > 1:
+        # spawn, not fork: the parent may already hold torch threads and DB sockets
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    conn = create_connection()
+    if conn is None:
+        raise RuntimeError("Database connection failed")
+    cursor = conn.cursor()
+    run_started = time.perf_counter()
+    run_rows = 0
+    try:
+        while True:
+            rows = read_chunk(cursor, state["last_id"], chunk_size, only_pending)
+            if not rows:
+                break
+            started = time.perf_counter()
+            batches = _batches(rows, batch_size)
+            texts = [[feedback for _, feedback in batch] for batch in batches]
+            scored = pool.map(score_texts, texts) if pool else map(score_texts, texts)
+
+            updated = 0
+            for batch, labels in zip(batches, scored):
+                updated += write_labels(cursor, batch, labels, only_pending=only_pending)
+            conn.commit()
+
+            elapsed = time.perf_counter() - started
+            run_rows += len(rows)
+            state.update({
+                "last_id": rows[-1][0],
+                "rows": state["rows"] + len(rows),
+                "updated": state["updated"] + updated,
+                "seconds": round(state["seconds"] + elapsed, 3),
+            })
+            save_checkpoint(checkpoint_path, state)
+            log(
+                f"booking_id <= {state['last_id']}: {len(rows)} rows in {elapsed:.2f}s "
+                f"({len(rows) / max(elapsed, 1e-9):.1f} rows/s), {state['rows']} total"
+            )
+    finally:
+        cursor.close()
+        conn.close()
+        if pool:
+            pool.shutdown()
+
+    state["done"] = True
+    save_checkpoint(checkpoint_path, state)
+    elapsed = time.perf_counter() - run_started
+    log(
+        f"Done: {run_rows} rows this run in {elapsed:.2f}s "
+        f"({run_rows / elapsed if elapsed else 0:.1f} rows/s), {state['updated']} labels written overall"
+    )
+    return state
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.utils.sentiment_backfill")
+    parser.add_argument("--all", action="store_true", help="re-score every row with feedback, not only 'pending' ones")
+    parser.add_argument("--chunk-size", type=int, default=500, help="rows read and committed per round trip")
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per pipeline call")
+    parser.add_argument("--workers", type=int, default=0, help="score in a process pool of this size")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first row")
+    args = parser.parse_args(argv)
+
+    backfill(
+        only_pending=not args.all,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
+        restart=args.restart,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,230 @@
+"""
+Background sentiment scoring for booking feedback.
+
+/user/feedback stores the text with sentiment 'pending' and enqueues it here. One worker
+thread per process collects batches, runs the DistilBERT pipeline once per batch and writes
+all labels back in a single UPDATE. Failed batches are retried with exponential backoff.
+Rows still pending after a restart or a dropped batch are picked up by a periodic sweep.
+"""
+import os
+import queue
+import threading
+import time
+from app.db import create_connection
+from app.models import sentiment_pipeline
+from app.utils.metrics import register_stats
+
+PENDING = "pending"
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", 16))
+SENTIMENT_BATCH_WAIT_MS = int(os.getenv("SENTIMENT_BATCH_WAIT_MS", 200))
+SENTIMENT_MAX_ATTEMPTS = int(os.getenv("SENTIMENT_MAX_ATTEMPTS", 5))
+SENTIMENT_RETRY_SECONDS = float(os.getenv("SENTIMENT_RETRY_SECONDS", 2))
+# Rows pending longer than this are assumed lost (restart, dropped batch) and re-enqueued
+SENTIMENT_SWEEP_SECONDS = int(os.getenv("SENTIMENT_SWEEP_SECONDS", 300))
+
+
+def label_for(result):
+    """Map a pipeline result to the values stored in bookings.sentiment."""
+    label = result['label'].lower()  # "positive" or "negative"
+    return label if label in ('positive', 'negative') else 'neutral'
+
+
+def score_texts(texts):
+    return [label_for(r) for r in sentiment_pipeline(list(texts), truncation=True)]
+
+
+def write_labels(cursor, items, labels, only_pending=True):
+    """
+    Bulk-update bookings.sentiment for [(booking_id, feedback)] in one statement. Rows whose
+    feedback changed since it was read are left alone, as are already-scored rows when
+    only_pending is set.
+    """
+    cases = " ".join(["WHEN %s THEN %s"] * len(items))
+    pairs = ", ".join(["(%s, %s)"] * len(items))
+    params = [v for (booking_id, _), label in zip(items, labels) for v in (booking_id, label)]
+    pending_sql = ""
+    if only_pending:
+        pending_sql = "sentiment = %s AND "
+        params.append(PENDING)
+    params.extend(v for item in items for v in item)
+    cursor.execute(f"""
+        UPDATE bookings
+        SET sentiment = CASE booking_id {cases} END
+        WHERE {pending_sql}(booking_id, feedback) IN ({pairs})
+    """, params)
+    return cursor.rowcount
+
+
+class SentimentQueue:
+
+    def __init__(self, batch_size=SENTIMENT_BATCH_SIZE, max_wait_ms=SENTIMENT_BATCH_WAIT_MS,
+                 max_attempts=SENTIMENT_MAX_ATTEMPTS, retry_seconds=SENTIMENT_RETRY_SECONDS,
+                 sweep_seconds=SENTIMENT_SWEEP_SECONDS):
+        self._batch_size = batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._max_attempts = max_attempts
+        self._retry_seconds = retry_seconds
+        self._sweep_seconds = sweep_seconds
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_sweep = 0.0
+        # booking_id -> time first enqueued, for everything not yet written (incl. retries)
+        self._in_flight = {}
+
+        self._batches = 0
+        self._scored = 0
+        self._retries = 0
+        self._failed = 0
+        self._swept = 0
+        self._lag_total = 0.0
+        self._max_lag = 0.0
+        self._last_error = None
+
+    def enqueue(self, booking_id, feedback):
+        self._ensure_started()
+        with self._lock:
+            self._in_flight.setdefault(booking_id, time.time())
+        self._queue.put((booking_id, feedback, 0))
+
+    def start(self):
+        """Start the worker at app startup, so the sweep picks up rows left pending by a restart."""
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sentiment-queue", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get(timeout=self._sweep_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self._max_wait
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            if time.time() - self._last_sweep >= self._sweep_seconds:
+                self._sweep()
+            batch = self._collect()
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch):
+        # A booking can be queued twice if feedback was edited; only the latest text matters
+        latest = {}
+        for booking_id, feedback, attempt in batch:
+            latest[booking_id] = (feedback, attempt)
+        items = [(booking_id, feedback) for booking_id, (feedback, _) in latest.items()]
+
+        conn = None
+        try:
+            labels = score_texts(feedback for _, feedback in items)
+            conn = create_connection()
+            if conn is None:
+                raise RuntimeError("Database connection failed")
+            cursor = conn.cursor()
+            write_labels(cursor, items, labels)
+            conn.commit()
+            cursor.close()
+        except Exception as e:
+            self._retry(latest, e)
+            return
+        finally:
+            if conn:
+                conn.close()
+
+        now = time.time()
+        with self._lock:
+            self._batches += 1
+            self._scored += len(items)
+            self._last_error = None
+            for booking_id, _ in items:
+                lag = now - self._in_flight.pop(booking_id, now)
+                self._lag_total += lag
+                self._max_lag = max(self._max_lag, lag)
+
+    def _retry(self, latest, error):
+        print(f"Sentiment batch of {len(latest)} failed: {error}")
+        with self._lock:
+            self._last_error = str(error)
+        for booking_id, (feedback, attempt) in latest.items():
+            if attempt + 1 >= self._max_attempts:
+                # Left as 'pending' in the table; the sweep will try again later
+                with self._lock:
+                    self._failed += 1
+                    self._in_flight.pop(booking_id, None)
+                continue
+            with self._lock:
+                self._retries += 1
+            timer = threading.Timer(
+                self._retry_seconds * 2 ** attempt, self._queue.put, args=((booking_id, feedback, attempt + 1),)
+            )
+            timer.daemon = True
+            timer.start()
+
+    def _sweep(self):
+        self._last_sweep = time.time()
+        conn = None
+        try:
+            conn = create_connection()
+            if conn is None:
+                return
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT booking_id, feedback FROM bookings
+                WHERE sentiment = %s AND updated_at < NOW() - INTERVAL %s SECOND
+                LIMIT 1000
+            """, (PENDING, self._sweep_seconds))
+            rows = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            print(f"Sentiment sweep failed: {e}")
+            return
+        finally:
+            if conn:
+                conn.close()
+
+        for booking_id, feedback in rows:
+            with self._lock:
+                if booking_id in self._in_flight:
+                    continue
+                self._in_flight[booking_id] = time.time()
+                self._swept += 1
+            self._queue.put((booking_id, feedback, 0))
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            oldest = min(self._in_flight.values(), default=None)
+            return {
+                "running": self._thread is not None,
+                "queue_depth": self._queue.qsize(),
+                "in_flight": len(self._in_flight),
+                "oldest_pending_seconds": round(now - oldest, 3) if oldest else 0.0,
+                "batches": self._batches,
+                "scored": self._scored,
+                "retries": self._retries,
+                "failed": self._failed,
+                "swept": self._swept,
+                "avg_lag_seconds": round(self._lag_total / self._scored, 3) if self._scored else 0.0,
+                "max_lag_seconds": round(self._max_lag, 3),
+                "last_error": self._last_error,
+            }
+
+
+sentiment_queue = SentimentQueue()
+register_stats("sentiment_queue", sentiment_queue.stats)
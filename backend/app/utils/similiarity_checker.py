@@ -1,45 +1,282 @@
-from flask import jsonify
-import pandas as pd
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
 import os
+import json
+import hashlib
+import threading
+import numpy as np
+from app.db import create_connection
+from app.utils.model_registry import register_model, get_model
+from app.utils.metrics import register_stats
+from app.utils import INSTANCE_DIR
 
-load_dotenv()
 
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-db_name = os.getenv("DB_NAME")
+def _load_minilm():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer('all-MiniLM-L6-v2')
 
-engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}")
-model = SentenceTransformer('all-MiniLM-L6-v2')  # load once
+register_model("minilm", _load_minilm)  # loaded once, on first use
 
-def get_recommendations_for_pest(pest: str = None):
-    if pest is None:
-        raise ValueError("Pest type is required")
+SIMILARITY_THRESHOLD = 0.4
+INDEX_DIR = os.getenv("SERVICE_INDEX_DIR", INSTANCE_DIR)
+
+
+def _service_text(row):
+    return f"{row['name']}. {row['description'] or ''}"
+
+
+def _text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def encode_texts(texts):
+    """Batch-encode texts into L2-normalised float32 rows so cosine similarity is a dot product."""
+    model = get_model("minilm")
+    vectors = model.encode(list(texts), batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _service_row(row):
+    """JSON-native copy of a services row, so it reads back from disk exactly as fetched."""
+    row = dict(row)
+    if row.get('price') is not None:
+        row['price'] = float(row['price'])
+    return row
+
+
+def _fetch_services(service_id=None):
+    conn = create_connection()
+    if conn is None:
+        raise RuntimeError("Database connection failed")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        if service_id is None:
+            cursor.execute("SELECT service_id, name, description, price FROM services")
+        else:
+            cursor.execute(
+                "SELECT service_id, name, description, price FROM services WHERE service_id = %s",
+                (service_id,)
+            )
+        return [_service_row(r) for r in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class ServiceEmbeddingIndex:
+    """
+    Normalised MiniLM embeddings for every row of `services`, kept in memory and
+    persisted to INDEX_DIR (the matrix is memory-mapped when loaded back).
+
+    Admin add/update/delete call upsert()/remove() so only the changed row is re-encoded.
+    Other workers notice the new file on disk and reload it on their next lookup.
+    """
+
+    def __init__(self, index_dir):
+        self._matrix_path = os.path.join(index_dir, "service_embeddings.npy")
+        self._meta_path = os.path.join(index_dir, "service_embeddings.json")
+        self._lock = threading.RLock()
+        self._ids = []
+        self._rows = []
+        self._hashes = []
+        self._matrix = None
+        self._loaded_mtime = None
+        self.version = 0
+        self.fingerprint = None
+
+    @property
+    def built(self):
+        return self._matrix is not None
 
-    query = "SELECT service_id, name, description, price FROM services"
-    df = pd.read_sql(query, engine)
+    def ensure_ready(self):
+        with self._lock:
+            if not self.built:
+                if not self._load():
+                    self.rebuild()
+            elif self._disk_mtime() != self._loaded_mtime:
+                # Another worker saved a newer index, or invalidated it
+                if not self._load():
+                    self.rebuild()
 
-    df['combined_text'] = df['name'] + ". " + df['description']
+    def rebuild(self):
+        """Re-sync with the table, encoding only rows that are new or whose text changed."""
+        rows = _fetch_services()
+        with self._lock:
+            known = {sid: i for i, sid in enumerate(self._ids)}
+            texts = [_service_text(r) for r in rows]
+            hashes = [_text_hash(t) for t in texts]
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    df['embedding'] = df['combined_text'].apply(lambda x: model.encode(x))
+            stale = [
+                i for i, r in enumerate(rows)
+                if r['service_id'] not in known or self._hashes[known[r['service_id']]] != hashes[i]
+            ]
+            fresh = encode_texts([texts[i] for i in stale]) if stale else None
 
-    pest_vector = model.encode(pest).reshape(1, -1)
-    service_vectors = np.vstack(df['embedding'].values)
+            vectors = []
+            fresh_pos = {row_idx: j for j, row_idx in enumerate(stale)}
+            for i, r in enumerate(rows):
+                if i in fresh_pos:
+                    vectors.append(fresh[fresh_pos[i]])
+                else:
+                    vectors.append(self._matrix[known[r['service_id']]])
 
-    similarities = cosine_similarity(pest_vector, service_vectors)[0]
-    df['similarity'] = similarities
+            self._set(rows, hashes, np.vstack(vectors) if vectors else None)
+            self._save()
 
-    # Filter by similarity threshold
-    filtered_df = df[df['similarity'] > 0.4].sort_values(by="similarity", ascending=False)
+    def upsert(self, service_id):
+        if not self.built:
+            self.invalidate()  # nothing in memory here; make sure other workers re-sync
+            return
+        self.ensure_ready()
+        rows = _fetch_services(service_id)
+        if not rows:
+            self.remove(service_id)
+            return
+        row = rows[0]
+        text = _service_text(row)
+        vector = encode_texts([text])
+        with self._lock:
+            ids, kept_rows, hashes = list(self._ids), list(self._rows), list(self._hashes)
+            matrix = np.array(self._matrix, dtype=np.float32) if self._matrix.size else vector[:0]
+            if service_id in ids:
+                i = ids.index(service_id)
+                kept_rows[i], hashes[i] = row, _text_hash(text)
+                matrix[i] = vector[0]
+            else:
+                kept_rows.append(row)
+                hashes.append(_text_hash(text))
+                matrix = np.vstack([matrix, vector])
+            self._set(kept_rows, hashes, matrix)
+            self._save()
+
+    def remove(self, service_id):
+        if not self.built:
+            self.invalidate()
+            return
+        self.ensure_ready()
+        with self._lock:
+            if service_id not in self._ids:
+                return
+            i = self._ids.index(service_id)
+            keep = [j for j in range(len(self._ids)) if j != i]
+            self._set(
+                [self._rows[j] for j in keep],
+                [self._hashes[j] for j in keep],
+                np.array(self._matrix[keep], dtype=np.float32)
+            )
+            self._save()
+
+    def current_fingerprint(self):
+        self.ensure_ready()
+        return self.fingerprint
+
+    def invalidate(self):
+        for path in (self._meta_path, self._matrix_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def search(self, text, threshold=SIMILARITY_THRESHOLD, k=3):
+        self.ensure_ready()
+        with self._lock:
+            matrix, rows = self._matrix, self._rows
+        if matrix is None or not len(rows):
+            return []
+
+        query = encode_texts([text])[0]
+        scores = matrix @ query
+        order = np.argsort(-scores)[:k]
+        return [
+            {
+                "service_id": rows[i]['service_id'],
+                "name": rows[i]['name'],
+                "similarity": float(scores[i]),
+                "price": rows[i]['price'],
+            }
+            for i in order if scores[i] > threshold
+        ]
+
+    def stats(self):
+        return {
+            "built": self.built,
+            "services": len(self._ids),
+            "dim": int(self._matrix.shape[1]) if self.built and self._matrix.ndim == 2 else None,
+            "version": self.version,
+            "fingerprint": self.fingerprint,
+        }
+
+    def _set(self, rows, hashes, matrix):
+        self._rows = rows
+        self._ids = [r['service_id'] for r in rows]
+        self._hashes = hashes
+        self._matrix = matrix if matrix is not None else np.zeros((0, 0), dtype=np.float32)
+        self.version += 1
+        # Content-based over every returned column (a price edit must retire cached
+        # recommendations too), so every worker derives the same value for the same catalog
+        self.fingerprint = hashlib.sha1(
+            json.dumps([[r, h] for r, h in zip(rows, hashes)], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _disk_mtime(self):
+        try:
+            return os.path.getmtime(self._meta_path)
+        except OSError:
+            return None
+
+    def _load(self):
+        mtime = self._disk_mtime()
+        if mtime is None or not os.path.exists(self._matrix_path):
+            return False
+        try:
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            matrix = np.load(self._matrix_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            print(f"Service index load failed, rebuilding: {e}")
+            return False
+        if len(meta["rows"]) != matrix.shape[0]:
+            return False
+        # Files written before prices were stored as numbers hold them as strings
+        self._set([_service_row(r) for r in meta["rows"]], meta["hashes"], matrix)
+        self._loaded_mtime = mtime
+        return True
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self._meta_path), exist_ok=True)
+        tmp_matrix = self._matrix_path + ".tmp.npy"
+        tmp_meta = self._meta_path + ".tmp"
+        try:
+            np.save(tmp_matrix, np.asarray(self._matrix, dtype=np.float32))
+            with open(tmp_meta, "w") as f:
+                json.dump({"rows": self._rows, "hashes": self._hashes}, f)
+            os.replace(tmp_matrix, self._matrix_path)
+            os.replace(tmp_meta, self._meta_path)
+            self._loaded_mtime = self._disk_mtime()
+        except OSError as e:
+            # The in-memory index is still valid; we only lose persistence
+            print(f"Service index save failed: {e}")
+
+
+service_index = ServiceEmbeddingIndex(INDEX_DIR)
+register_stats("service_index", service_index.stats)
+
+
+def on_service_changed(service_id, deleted=False):
+    # Called by the admin service routes after commit; never fails the request
+    try:
+        if deleted:
+            service_index.remove(service_id)
+        else:
+            service_index.upsert(service_id)
+    except Exception as e:
+        print(f"Service index update failed for {service_id}: {e}")
+
+
+def get_recommendations_for_pest(pest: str = None):
+    if pest is None:
+        raise ValueError("Pest type is required")
 
-    if filtered_df.empty:
+    results = service_index.search(pest)
+    if not results:
         return [{"message": "No related services found for this pest type"}]
 
-    return filtered_df[['service_id', 'name', 'similarity', 'price']].head(3).to_dict(orient='records')
+    return results
@@ -0,0 +1,39 @@
+import importlib
+import sys
+import time
+from app.utils.metrics import register_stats
+
+# Modules we never want a worker to pay for before the first request that needs them
+HEAVY_MODULES = [
+    "torch", "transformers", "sentence_transformers", "sklearn", "surprise",
+    "langchain_huggingface", "langgraph", "groq",
+]
+
+_import_ms = {}
+
+
+def timed_import(module_name):
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _import_ms[module_name] = round((time.perf_counter() - started) * 1000, 1)
+    return module
+
+
+def startup_report():
+    return {
+        "imports_ms": dict(_import_ms),
+        "total_ms": round(sum(_import_ms.values()), 1),
+        "heavy_modules_loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+    }
+
+
+def print_startup_report():
+    report = startup_report()
+    print(f"Blueprint imports took {report['total_ms']} ms")
+    for name, ms in sorted(report["imports_ms"].items(), key=lambda kv: -kv[1]):
+        print(f"  {ms:>8} ms  {name}")
+    if report["heavy_modules_loaded"]:
+        print("  heavy modules loaded at startup:", ", ".join(report["heavy_modules_loaded"]))
+
+
+register_stats("startup", startup_report)
@@ -0,0 +1,271 @@
+"""
+In-memory technician availability for booking assignment.
+
+book_service used to LEFT JOIN every technician against the whole booking history to find
+their last job, and filter with DATE()-wrapped technician_unavailable columns. This index
+keeps, per technician, the last job date and the merged day ranges they are unavailable,
+loaded once from the database and kept current by the write paths. Picking the N
+least-recently-used technicians free on a day is then a walk over an in-memory order.
+
+Other workers' writes only reach this index on its periodic reload, so reserve_technicians()
+confirms the pick inside the booking's transaction: it locks the chosen technicians' rows
+(skipping ones another booking holds) and re-checks them with an index-friendly range
+predicate before they are assigned. The re-check must be a locking read (FOR SHARE): under
+REPEATABLE READ a plain read would use the snapshot taken by the booking's first query and
+miss a job row another booking committed for the same technician since.
+"""
+import bisect
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from app.db import create_connection
+from app.utils.dispatch import DISPATCH_POOL, dispatch_index
+from app.utils.intervals import BLOCKING_SQL
+from app.utils.metrics import register_stats
+
+AVAILABILITY_REFRESH_SECONDS = float(os.getenv("AVAILABILITY_REFRESH_SECONDS", 300))
+# Unavailability that ended before this many days ago is not loaded
+AVAILABILITY_HISTORY_DAYS = int(os.getenv("AVAILABILITY_HISTORY_DAYS", 2))
+RESERVE_ATTEMPTS = 5
+NEVER = date(1970, 1, 1).toordinal()
+
+
+def _day(value):
+    """Day ordinal of a date, datetime or 'YYYY-MM-DD[ HH:MM:SS]' string."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+def _merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [s for s, _ in merged], [e for _, e in merged]
+
+
+class _Technician:
+    __slots__ = ("last_job", "ranges", "starts", "ends")
+
+    def __init__(self):
+        self.last_job = NEVER
+        self.ranges = {}  # technician_unavailable.id -> (first day, last day)
+        self.starts = []
+        self.ends = []
+
+    def rebuild(self):
+        self.starts, self.ends = _merge(self.ranges.values())
+
+    def free_on(self, day):
+        i = bisect.bisect_right(self.starts, day) - 1
+        return i < 0 or self.ends[i] < day
+
+
+class TechnicianAvailability:
+
+    def __init__(self, refresh_seconds=AVAILABILITY_REFRESH_SECONDS):
+        self._refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._technicians = {}
+        self._order = []  # (last_job, technician_id), ascending
+        self._loaded_at = None
+        self._load_seconds = 0.0
+        self._queries = 0
+        self._query_total = 0.0
+        self._conflicts = 0
+        self._last_error = None
+
+    # -- loading ------------------------------------------------------------
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self._refresh_seconds:
+            return
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self._refresh_seconds:
+                try:
+                    self.reload()
+                except Exception as e:
+                    self._last_error = str(e)
+                    if self._loaded_at is None:
+                        raise
+                    print(f"Technician availability reload failed, keeping the old index: {e}")
+                    self._loaded_at = time.monotonic()
+
+    def reload(self):
+        started = time.perf_counter()
+        conn = create_connection()
+        if conn is None:
+            raise RuntimeError("Database connection failed")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT technician_id FROM technicians")
+            technicians = {tid: _Technician() for (tid,) in cursor.fetchall()}
+            cursor.execute("""
+                SELECT bt.technician_id, MAX(b.booking_date)
+                FROM booking_technicians bt
+                JOIN bookings b ON bt.booking_id = b.booking_id
+                GROUP BY bt.technician_id
+            """)
+            for tid, last_job in cursor.fetchall():
+                if tid in technicians and last_job:
+                    technicians[tid].last_job = _day(last_job)
+            cursor.execute(f"""
+                SELECT id, technician_id, start_datetime, end_datetime
+                FROM technician_unavailable
+                WHERE end_datetime >= CURDATE() - INTERVAL %s DAY AND {BLOCKING_SQL}
+            """, (AVAILABILITY_HISTORY_DAYS,))
+            for row_id, tid, start, end in cursor.fetchall():
+                if tid in technicians:
+                    technicians[tid].ranges[row_id] = (_day(start), _day(end))
+            cursor.close()
+        finally:
+            conn.close()
+
+        for tech in technicians.values():
+            tech.rebuild()
+        order = sorted((tech.last_job, tid) for tid, tech in technicians.items())
+        with self._lock:
+            self._technicians = technicians
+            self._order = order
+            self._loaded_at = time.monotonic()
+            self._load_seconds = time.perf_counter() - started
+            self._last_error = None
+
+    # -- queries ------------------------------------------------------------
+
+    def least_recent_free(self, day, count, exclude=()):
+        """Up to `count` technician ids free on `day`, least recently assigned first."""
+        self._ensure_loaded()
+        started = time.perf_counter()
+        day = _day(day)
+        picked = []
+        with self._lock:
+            for _, tid in self._order:
+                if tid not in exclude and self._technicians[tid].free_on(day):
+                    picked.append(tid)
+                    if len(picked) == count:
+                        break
+            self._queries += 1
+            self._query_total += time.perf_counter() - started
+        return picked
+
+    # -- change events ------------------------------------------------------
+
+    def add_unavailability(self, technician_id, row_id, start, end):
+        try:
+            days = (_day(start), _day(end))
+        except (TypeError, ValueError):
+            self.invalidate()  # let the reload read what MySQL made of it
+            return
+        with self._lock:
+            tech = self._technicians.get(int(technician_id))
+            if tech is None:
+                return
+            tech.ranges[row_id] = days
+            tech.rebuild()
+
+    def remove_unavailability(self, row_id, technician_id=None):
+        with self._lock:
+            if technician_id is not None:
+                techs = [self._technicians.get(int(technician_id))]
+            else:
+                techs = self._technicians.values()
+            for tech in techs:
+                if tech is not None and tech.ranges.pop(row_id, None) is not None:
+                    tech.rebuild()
+                    return
+
+    def record_job(self, technician_id, booking_date):
+        technician_id = int(technician_id)
+        with self._lock:
+            tech = self._technicians.get(technician_id)
+            day = _day(booking_date)
+            if tech is None or day <= tech.last_job:
+                return
+            self._order.remove((tech.last_job, technician_id))
+            tech.last_job = day
+            bisect.insort(self._order, (day, technician_id))
+
+    def invalidate(self):
+        """Force a reload on next use, e.g. after a bulk write whose row ids are not known."""
+        with self._lock:
+            self._loaded_at = None
+
+    def mark_stale(self):
+        """Like invalidate(), after a conflict showed the index is behind."""
+        with self._lock:
+            self._conflicts += 1
+            self._loaded_at = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "technicians": len(self._technicians),
+                "ranges": sum(len(t.ranges) for t in self._technicians.values()),
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+                "load_ms": round(self._load_seconds * 1000, 3),
+                "queries": self._queries,
+                "avg_query_us": round(self._query_total / self._queries * 1e6, 2) if self._queries else 0.0,
+                "conflicts": self._conflicts,
+                "last_error": self._last_error,
+            }
+
+
+technician_availability = TechnicianAvailability()
+register_stats("technician_availability", technician_availability.stats)
+
+
+def reserve_technicians(cursor, booking_date, count, location=None):
+    """
+    Pick `count` technicians free on booking_date from the index and lock them inside the
+    caller's transaction. With a (lat, lng) location the DISPATCH_POOL least recently used
+    free technicians are ranked by the distance the job adds to their route. Rows another booking already holds are skipped (SKIP LOCKED) and
+    the next candidates are tried, so concurrent bookings never wait on or share a
+    technician. Returns the ids in assignment order; fewer than `count` means not enough
+    technicians are free.
+    """
+    day = date.fromordinal(_day(booking_date))
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    reserved = []
+    tried = set()
+    for _ in range(RESERVE_ATTEMPTS):
+        needed = count - len(reserved)
+        if location is None:
+            candidates = technician_availability.least_recent_free(day, needed, exclude=tried)
+        else:
+            pool = technician_availability.least_recent_free(day, max(needed, DISPATCH_POOL), exclude=tried)
+            candidates = dispatch_index.rank(pool, day, *location)[:needed]
+        if not candidates:
+            break
+        tried.update(candidates)
+        placeholders = ", ".join(["%s"] * len(candidates))
+        cursor.execute(
+            f"SELECT technician_id FROM technicians WHERE technician_id IN ({placeholders}) FOR UPDATE SKIP LOCKED",
+            candidates,
+        )
+        locked = {row[0] for row in cursor.fetchall()}
+        if not locked:
+            continue
+        # Same as DATE(%s) BETWEEN DATE(start_datetime) AND DATE(end_datetime), but sargable.
+        # A locking read, so it sees rows committed after this transaction's snapshot was taken.
+        placeholders = ", ".join(["%s"] * len(locked))
+        cursor.execute(f"""
+            SELECT DISTINCT technician_id FROM technician_unavailable
+            WHERE technician_id IN ({placeholders})
+              AND start_datetime < %s AND end_datetime >= %s AND {BLOCKING_SQL}
+            FOR SHARE
+        """, (*locked, day_end, day_start))
+        busy = {row[0] for row in cursor.fetchall()}
+        if busy:
+            technician_availability.mark_stale()
+        reserved.extend(tid for tid in candidates if tid in locked and tid not in busy)
+        if len(reserved) == count:
+            break
+    return reserved
@@ -0,0 +1,195 @@
+"""
+Data for /technician/dashboard.
+
+Today's, upcoming and completed bookings come from one query over bookings /
+booking_technicians / services and are split in Python. The leave, earnings and
+notification lookups run concurrently with it on their own pooled connections.
+Results are cached per technician for DASHBOARD_CACHE_SECONDS; booking and leave
+writes call on_technician_schedule_changed() to drop the affected entries at once.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from app.db import create_connection
+from app.utils.metrics import register_stats
+
+DASHBOARD_CACHE_SECONDS = float(os.getenv("DASHBOARD_CACHE_SECONDS", 30))
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", 2000))
+DASHBOARD_LOOKUP_WORKERS = int(os.getenv("DASHBOARD_LOOKUP_WORKERS", 6))
+
+# is_today / is_upcoming are evaluated by MySQL so CURDATE() and NOW() keep the
+# server's clock, exactly like the three separate queries did.
+BOOKINGS_SQL = """
+    SELECT b.booking_id, s.name AS service_type, b.booking_date, b.status,
+           b.location_lat, b.location_lng,
+           DATE(b.booking_date) = CURDATE() AS is_today,
+           b.booking_date > NOW() AS is_upcoming
+    FROM bookings b
+    JOIN booking_technicians bt ON b.booking_id = bt.booking_id
+    JOIN services s ON b.service_id = s.service_id
+    WHERE bt.technician_id = %s
+      AND (DATE(b.booking_date) = CURDATE() OR b.booking_date > NOW() OR b.status = 'completed')
+    ORDER BY b.booking_date ASC
+"""
+
+AVAILABILITY_SQL = """
+    SELECT start_datetime, end_datetime, reason,status
+    FROM technician_unavailable
+    WHERE technician_id = %s AND end_datetime >= NOW() and reason !='job' and status = 'approved'
+    ORDER BY start_datetime ASC
+"""
+
+EARNINGS_SQL = """
+    SELECT SUM(s.salary) as total_earned
+    FROM salary s where technician_id =%s
+"""
+
+NOTIFICATIONS_SQL = """
+    SELECT id, message, created_at
+    FROM notifications
+    WHERE user_type = 'technician'
+    AND user_id = %s
+    AND is_seen = FALSE
+    ORDER BY created_at DESC
+    LIMIT 5
+"""
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_LOOKUP_WORKERS, thread_name_prefix="tech-dashboard")
+
+
+def _utc_iso(value):
+    # Naive DB datetimes are taken as local time, converted to UTC and sent as ISO strings
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).isoformat()
+    return value
+
+
+def _fetch(sql, technician_id, one=False):
+    conn = create_connection()
+    if conn is None:
+        raise RuntimeError("Database connection failed")
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(sql, (technician_id,))
+        rows = cursor.fetchone() if one else cursor.fetchall()
+        cursor.close()
+        return rows
+    finally:
+        conn.close()
+
+
+def partition_bookings(rows):
+    """Split the combined booking rows into (today, upcoming, history) in the dashboard's shape."""
+    today, upcoming, history = [], [], []
+    for row in rows:
+        booking_date = _utc_iso(row["booking_date"])
+        summary = {
+            "booking_id": row["booking_id"],
+            "service_type": row["service_type"],
+            "booking_date": booking_date,
+            "status": row["status"],
+        }
+        if row["is_today"]:
+            today.append(dict(summary, location_lat=row["location_lat"], location_lng=row["location_lng"]))
+        if row["is_upcoming"]:
+            upcoming.append(summary)
+        if row["status"] == "completed":
+            history.append(summary)
+    history.reverse()  # newest first
+    return today, upcoming, history
+
+
+def load_dashboard(technician_id):
+    lookups = [
+        _executor.submit(_fetch, AVAILABILITY_SQL, technician_id),
+        _executor.submit(_fetch, EARNINGS_SQL, technician_id, True),
+        _executor.submit(_fetch, NOTIFICATIONS_SQL, technician_id),
+    ]
+    today, upcoming, history = partition_bookings(_fetch(BOOKINGS_SQL, technician_id))
+    availability, earnings, notifications = [f.result() for f in lookups]
+
+    for item in availability:
+        item["start_datetime"] = _utc_iso(item["start_datetime"])
+        item["end_datetime"] = _utc_iso(item["end_datetime"])
+    for item in notifications:
+        item["created_at"] = _utc_iso(item["created_at"])
+
+    return {
+        "success": True,
+        "today_services": today,
+        "upcoming_services": upcoming,
+        "service_history": history,
+        "availability": availability,
+        "earnings": (earnings or {}).get("total_earned", 0),
+        "notifications": notifications,
+    }
+
+
+class DashboardCache:
+    """Per-technician dashboard payloads with a short TTL."""
+
+    def __init__(self, ttl_seconds=30, max_entries=2000):
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Bumped on invalidation so a load that started before it is not cached afterwards
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, technician_id, loader):
+        key = str(technician_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] <= self._ttl:
+                self._hits += 1
+                return entry[2]
+            self._misses += 1
+            generation = self._generation
+        payload = loader(technician_id)
+        with self._lock:
+            if generation == self._generation:
+                if len(self._entries) >= self._max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[key] = (time.monotonic(), generation, payload)
+        return payload
+
+    def invalidate(self, technician_ids=None):
+        """Drop the given technicians' entries, or everything when ids are not known."""
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+            if technician_ids is None:
+                self._entries.clear()
+            else:
+                for technician_id in technician_ids:
+                    self._entries.pop(str(technician_id), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "ttl_seconds": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+dashboard_cache = DashboardCache(DASHBOARD_CACHE_SECONDS, DASHBOARD_CACHE_SIZE)
+register_stats("tech_dashboard_cache", dashboard_cache.stats)
+
+
+def get_dashboard(technician_id):
+    return dashboard_cache.get(technician_id, load_dashboard)
+
+
+def on_technician_schedule_changed(technician_ids=None):
+    """Call after booking or leave writes; pass None when the affected technicians are unknown."""
+    dashboard_cache.invalidate(technician_ids)
@@ -0,0 +1,67 @@
+import { useEffect, useRef } from 'react';
+
+const STREAM_URL = 'http://127.0.0.1:5000/notifications/stream';
+
+// EventSource cannot send the Authorization header, so the stream is read with fetch.
+// Reconnects resume after the last notification id received.
+export function useNotificationStream(token, onNotification) {
+  const handlerRef = useRef(onNotification);
+  handlerRef.current = onNotification;
+
+  useEffect(() => {
+    if (!token) return undefined;
+    const controller = new AbortController();
+    let lastId = null;
+    let retryMs = 3000;
+
+    const handleFrame = (frame) => {
+      let event = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('id: ')) lastId = line.slice(4);
+        else if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+        else if (line.startsWith('retry: ')) retryMs = Number(line.slice(7)) || retryMs;
+      }
+      if (event === 'notification' && data) handlerRef.current(JSON.parse(data));
+    };
+
+    const connect = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          const headers = { Authorization: `Bearer ${token}` };
+          if (lastId) headers['Last-Event-ID'] = lastId;
+          const res = await fetch(STREAM_URL, { headers, signal: controller.signal });
+          if (res.status === 401 || res.status === 403) return;
+          if (!res.ok) throw new Error(`Notification stream failed: ${res.status}`);
+
+          const reader = res.body.getReader();
+          const decoder = new TextDecoder();
+          let buffer = '';
+          for (;;) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let end;
+            while ((end = buffer.indexOf('\n\n')) !== -1) {
+              handleFrame(buffer.slice(0, end));
+              buffer = buffer.slice(end + 2);
+            }
+          }
+        } catch (err) {
+          if (controller.signal.aborted) return;
+          console.error('Notification stream error:', err);
+        }
+        await new Promise((resolve) => setTimeout(resolve, retryMs));
+      }
+    };
+
+    connect();
+    return () => controller.abort();
+  }, [token]);
+}
+
+// Adds a pushed notification to a list unless it is already there
+export function addNotification(list, notification) {
+  return list.some((n) => n.id === notification.id) ? list : [notification, ...list];
+}
@@ -68,12 +68,28 @@ export default function AdminBlog() {
         {},
         { headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' } }
       );
-      if (response.data.status === 'success') {
-        setResponseMessage(response.data.message);
+      if (response.data.status !== 'queued') {
+        setResponseMessage(response.data.message || 'Failed to generate blog');
+        setResponseStatus('error');
+        return;
+      }
+      setResponseMessage(response.data.message);
+      // Generation runs as a background job; poll it until it finishes
+      let job = null;
+      while (!job || job.status === 'queued' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const poll = await axios.get(
+          `http://127.0.0.1:5000/admin/blog-jobs/${response.data.job_id}`,
+          { headers: { Authorization: `Bearer ${token}` } }
+        );
+        job = poll.data.job;
+      }
+      if (job.status === 'succeeded') {
+        setResponseMessage('Blog generated and saved successfully');
         setResponseStatus('success');
         await fetchBlogs(); // Refresh blog list
       } else {
-        setResponseMessage(response.data.message || 'Failed to generate blog');
+        setResponseMessage(job.error || 'Failed to generate blog');
         setResponseStatus('error');
       }
     } catch (error) {
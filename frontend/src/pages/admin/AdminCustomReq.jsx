@@ -258,10 +258,13 @@ export default function AdminCustomReq() {
                                       ? 'bg-green-500/20 text-green-400 border border-green-500/30'
                                       : booking.sentiment === 'neutral'
                                       ? 'bg-gray-500/20 text-gray-400 border border-gray-500/30'
+                                      : booking.sentiment === 'pending'
+                                      ? 'bg-yellow-500/20 text-yellow-400 border border-yellow-500/30'
                                       : 'bg-red-500/20 text-red-400 border border-red-500/30'
                                   }`}
                                 >
-                                  {booking.sentiment}
+                                  {/* Feedback waits as 'pending' until the background worker scores it */}
+                                  {booking.sentiment === 'pending' ? 'Analysing…' : booking.sentiment}
                                 </span>
                               )}
 
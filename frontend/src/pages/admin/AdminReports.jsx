@@ -101,7 +101,10 @@ export default function AdminReports() {
         { question: advancedQuery },
         { headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' } }
       );
-      if (response.data.results && Array.isArray(response.data.results)) {
+      if (response.data.error) {
+        // The query failed while its rows were streaming; the partial results are not shown
+        setAdvancedError(response.data.error);
+      } else if (response.data.results && Array.isArray(response.data.results)) {
         const columns = response.data.results.length > 0 ? Object.keys(response.data.results[0]) : [];
         const rows = response.data.results.map(row => columns.map(col => {
           const value = row[col];
@@ -17,6 +17,7 @@ import {
 } from '@heroicons/react/24/outline';
 import axios from 'axios';
 import { GlassCard } from '../../components/ui/GlassCard';
+import { useNotificationStream, addNotification } from '../../components/useNotificationStream';
 
 export default function AdminTemplate() {
   const navigate = useNavigate();
@@ -76,6 +77,10 @@ export default function AdminTemplate() {
     fetchNotifications();
   }, []);
 
+  useNotificationStream(sessionStorage.getItem('token'), (notification) =>
+    setNotifications((prev) => addNotification(prev, notification))
+  );
+
   const sidebarVariants = {
     open: { x: 0 },
     closed: { x: '-100%' },
@@ -17,6 +17,7 @@ import {
   ChartBarIcon
 } from '@heroicons/react/24/outline';
 import { GlassCard } from '../../components/ui/GlassCard';
+import { useNotificationStream, addNotification } from '../../components/useNotificationStream';
 
 export default function TechnicianTemplate() {
   const navigate = useNavigate();
@@ -70,6 +71,10 @@ export default function TechnicianTemplate() {
     fetchNotifications();
   }, []);
 
+  useNotificationStream(sessionStorage.getItem("token"), (notification) =>
+    setNotifications((prev) => addNotification(prev, notification))
+  );
+
   const markAsSeen = async (notificationId) => {
     try {
       const token = sessionStorage.getItem("token");
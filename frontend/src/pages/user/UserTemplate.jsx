@@ -21,6 +21,7 @@ import {
 } from '@heroicons/react/24/outline';
 import axios from 'axios';
 import { GlassCard } from '../../components/ui/GlassCard';
+import { useNotificationStream, addNotification } from '../../components/useNotificationStream';
 import { AnimatedButton } from '../../components/ui/AnimatedButton';
 import { FloatingOrbs, ParticleField } from '../../components/ui/FloatingElements';
 
@@ -61,6 +62,10 @@ export default function UserTemplate() {
     if (token) fetchNotifications();
   }, [token, userType]);
 
+  useNotificationStream(token, (notification) =>
+    setNotifications((prev) => addNotification(prev, notification))
+  );
+
   useEffect(() => {
     const fetchCartCount = async () => {
       try {
@@ -190,7 +190,8 @@ CREATE TABLE IF NOT EXISTS `notifications` (
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   `user_id` int DEFAULT NULL,
   `is_seen` tinyint(1) NOT NULL DEFAULT '0',
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `recipient_unseen` (`user_type`,`user_id`,`is_seen`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 -- --------------------------------------------------------
@@ -365,7 +366,7 @@ CREATE TABLE IF NOT EXISTS `technician_unavailable` (
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   `status` enum('pending','approved','rejected') DEFAULT 'pending',
   PRIMARY KEY (`id`),
-  KEY `technician_id` (`technician_id`)
+  KEY `technician_interval` (`technician_id`,`start_datetime`,`end_datetime`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 --